@@ -1,128 +1,1294 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_sqlalchemy import SQLAlchemy
-
-from werkzeug.security import check_password_hash,generate_password_hash # Pour vérifier le hash du mot de passe
-
-from datetime import datetime
-import pytz
-PARIS = pytz.timezone('Europe/Paris')
-
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.secret_key = 'votre_cle_secrete'  # Nécessaire pour utiliser les sessions
-db = SQLAlchemy(app)
-
-# ------------------ MODELES ------------------
-############follows
-followers = db.Table(
-    'followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-)
-
-
-#############
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), unique=False, nullable=False)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password = db.Column(db.String(80), nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    biography = db.Column(db.Text, nullable=True)  
-    posts = db.relationship('Post', backref='author', lazy=True)
-    
-    followed = db.relationship(
-        'User',
-        secondary=followers,
-        primaryjoin=(followers.c.follower_id == id),
-        secondaryjoin=(followers.c.followed_id == id),
-        backref=db.backref('followers', lazy='dynamic'),
-        lazy='dynamic'
-    )
+from flask import Flask, render_template, stream_template, stream_with_context, request, redirect, url_for, flash, session, abort, g, jsonify, current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload
+from werkzeug.local import LocalProxy
+
+from hashing import PasswordHasher # Hachage / vérification des mots de passe hors du thread de la requête
+
+from datetime import datetime, timedelta
+from functools import partial
+import os
+import re
+import time
+import threading
+import base64
+import hashlib
+import binascii
+import click
+from cache import make_cache
+from db_profiles import load_profile, engine_options, configure_engines, RoutingSession
+from metrics import install_metrics
+from assets import install_assets
+from compression import install_compression
+from ratelimit import install_rate_limits
+from follow_graph import FollowGraph, FOLLOWED
+from versions import VersionStore
+from like_writer import LikeWriter
+from jobs import JobQueue
+from trending import TrendingRanking
+# Modèles dans models.py ; réexportés ici pour les scripts et les tests
+from models import (db, followers, PARIS, User, Post, Like, Comment, CommentLike, TimelineEntry,
+                    Notification, NotificationInbox)
+
+
+# ------------------ CONFIGURATION ------------------
+def configure(app, overrides=None):
+    """Réglages par défaut (certains lus dans l'environnement), puis `overrides` ; renvoie le profil de base."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['POSTS_PER_PAGE'] = 20
+    app.config['SEARCH_RESULTS_PER_PAGE'] = 20
+    # Pages en streaming : le haut de page part avant que tous les posts soient chargés
+    app.config['STREAM_BATCH_SIZE'] = 5       # posts chargés par lot pendant l'envoi de la page
+    app.config['STREAM_BUFFER_SIZE'] = 4096   # octets regroupés avant chaque envoi au client
+    app.config['API_MAX_BATCH'] = 50   # nombre max d'actions par appel à /api/actions
+    # Suppression de compte : au-delà de ce nombre de lignes (posts + likes + commentaires),
+    # elle se fait par une tâche de la file (jobs.py), par lots de DELETE_CHUNK_SIZE, avec un commit par lot
+    app.config['ACCOUNT_DELETE_BACKGROUND_THRESHOLD'] = 5000
+    app.config['DELETE_CHUNK_SIZE'] = 500
+    # Hachage des mots de passe : méthode werkzeug (et son coût), pool de processus borné
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    app.config['PASSWORD_HASH_EXECUTOR'] = os.environ.get('PASSWORD_HASH_EXECUTOR', 'process')  # ou 'inline'
+    # None = un processus par cœur ; serve.py, qui lance plusieurs workers web, en met 1 par worker
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ['PASSWORD_HASH_WORKERS']) if os.environ.get('PASSWORD_HASH_WORKERS') else None
+    app.config['PASSWORD_HASH_MAX_PENDING'] = None  # None = 4 calculs en attente par processus
+    # Fil d'actualité : 'pull' (requête sur les posts des suivis) ou 'push' (boîte précalculée à l'écriture)
+    app.config['TIMELINE_MODE'] = os.environ.get('TIMELINE_MODE', 'pull')
+    app.config['TIMELINE_INBOX_SIZE'] = 500       # nombre max d'entrées gardées par boîte
+    app.config['TIMELINE_PUSH_MAX_FOLLOWING'] = 1000  # au-delà, l'utilisateur reste en mode pull
+    app.secret_key = 'votre_cle_secrete'  # Nécessaire pour utiliser les sessions
+    # Cache des pages rendues : 'memory' (par processus), 'sqlite' (partagé entre workers) ou 'none'
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+    app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
+    app.config['CACHE_MAX_ENTRIES'] = 1000
+    app.config['CACHE_DEFAULT_TTL'] = 300   # secondes, pour les profils (invalidés à l'écriture)
+    app.config['FEED_CACHE_TTL'] = 15       # le fil agrège trop d'auteurs pour être invalidé finement
+    # Versions des contenus (abonnements, pages de profil et de fil) : fichier partagé par les workers, jamais évincé
+    app.config['VERSION_STORE_PATH'] = os.environ.get('VERSION_STORE_PATH', os.path.join(app.instance_path, 'versions.db'))
+    # Graphe des abonnements en mémoire (ids suivis / abonnés), borné en nombre total d'ids
+    app.config['FOLLOW_GRAPH_MAX_IDS'] = 1_000_000
+    app.config['FOLLOW_SUGGESTION_FANOUT'] = 50   # comptes suivis explorés pour les suggestions
+    # Likes des routes HTML : 'inline' (un commit par clic) ou 'batched' (clics groupés par un thread)
+    app.config['LIKE_WRITE_MODE'] = os.environ.get('LIKE_WRITE_MODE', 'inline')
+    app.config['LIKE_BATCH_INTERVAL'] = 0.005   # secondes d'attente max avant d'écrire un lot
+    app.config['LIKE_BATCH_MAX'] = 500          # événements max par lot
+    # Notifications agrégées : compactées (au plus une fois par intervalle et par destinataire)
+    app.config['NOTIFICATIONS_PER_PAGE'] = 20
+    app.config['NOTIFICATIONS_KEEP'] = 200          # notifications gardées par utilisateur
+    app.config['NOTIFICATIONS_MAX_AGE_DAYS'] = 30   # au-delà, les notifications lues sont supprimées
+    app.config['NOTIFICATIONS_COMPACT_INTERVAL'] = 3600  # secondes
+    # Posts tendance : likes et commentaires pondérés, divisés par deux toutes les TRENDING_HALF_LIFE secondes
+    app.config['TRENDING_HALF_LIFE'] = 6 * 3600
+    app.config['TRENDING_WINDOW'] = 3 * 24 * 3600   # événements relus à la reconstruction
+    app.config['TRENDING_LIKE_WEIGHT'] = 1.0
+    app.config['TRENDING_COMMENT_WEIGHT'] = 2.0
+    app.config['TRENDING_SIZE'] = 50              # posts affichés sur /trending
+    app.config['TRENDING_CAPACITY'] = 5000        # candidats gardés en mémoire
+    app.config['TRENDING_REFRESH_INTERVAL'] = 5   # secondes entre deux tris du classement
+    app.config['TRENDING_REBUILD_INTERVAL'] = 300  # secondes entre deux relectures de la base
+    # File de tâches (table job) : travail secondaire des écritures, fait après la réponse
+    app.config['JOB_MODE'] = os.environ.get('JOB_MODE', 'thread')  # ou 'inline' (fin de requête)
+    app.config['JOB_POLL_INTERVAL'] = 1.0   # secondes entre deux relevés de la file sans réveil
+    app.config['JOB_MAX_ATTEMPTS'] = 5
+    app.config['JOB_RETRY_DELAY'] = 2.0     # secondes avant le 2e essai, doublées à chaque échec
+    app.config['JOB_TIMEOUT'] = 300         # une tâche 'running' depuis plus longtemps est reprise
+    app.config['JOB_BATCH_SIZE'] = 20       # tâches réservées à la fois
+    app.config['JOB_KEEP_DONE'] = 86400     # secondes avant la purge des tâches terminées
+    # Limitation de débit (seaux à jetons) : 'memory' (par processus), 'sqlite' (partagé entre workers) ou 'none'
+    app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    app.config['RATE_LIMIT_PATH'] = os.environ.get('RATE_LIMIT_PATH', os.path.join(app.instance_path, 'rate_limits.db'))
+    app.config['RATE_LIMIT_MAX_KEYS'] = 100_000   # seaux gardés au plus
+    # Par classe de routes : (requêtes, période en secondes) par utilisateur connecté et par IP
+    app.config['RATE_LIMITS'] = {
+        'auth': {'ip': (20, 60), 'methods': ('POST',)},   # essais de mots de passe, créations de comptes
+        'search': {'user': (30, 60), 'ip': (120, 60)},
+        'write': {'user': (120, 60), 'ip': (600, 60)},
+    }
+    app.config['RATE_LIMIT_ENDPOINTS'] = {
+        'login': 'auth', 'register': 'auth',
+        'search': 'search',
+        'like_post': 'write', 'like_comment': 'write', 'create_comment': 'write', 'create_post': 'write',
+        'follow_user': 'write', 'unfollow_user': 'write', 'api_actions': 'write',
+    }
+    # Instrumentation : totaux sur /_metrics, journal des requêtes SQL lentes
+    app.config['METRICS_SLOWEST'] = 5             # requêtes SQL les plus lentes gardées par requête et au total
+    app.config['METRICS_SLOW_QUERY_MS'] = float(os.environ.get('METRICS_SLOW_QUERY_MS', 100))
+    app.config['METRICS_SLOW_QUERY_LOG'] = os.environ.get('METRICS_SLOW_QUERY_LOG')  # fichier, sinon app.logger
+    app.config['METRICS_HEADER'] = os.environ.get('METRICS_HEADER') == '1'              # en-tête Server-Timing
+    app.config['METRICS_DEBUG_FOOTER'] = os.environ.get('METRICS_DEBUG_FOOTER') == '1'  # relevé en bas des pages
+    # Accès à /_metrics : adresses locales seulement (None : tout le monde), ou partout avec
+    # l'en-tête Authorization: Bearer <METRICS_TOKEN> si un jeton est défini (derrière un proxy)
+    app.config['METRICS_ALLOWED_ADDRS'] = ('127.0.0.1', '::1')
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    # Fichiers statiques : URL avec empreinte, servies avec un cache d'un an (immutable)
+    app.config['ASSETS_MAX_AGE'] = 365 * 24 * 3600
+    app.config['ASSETS_COMPRESS_MIN_SIZE'] = 512   # octets ; en dessous, gzip n'apporte rien
+    # Variantes WebP (si Pillow est installé) : largeur affichée (img.logo) et écran haute densité
+    app.config['ASSETS_WEBP_WIDTHS'] = {'images/LOGO.png': (240, 480), 'images/LOGO_sidebar.png': (240, 480)}
+    # Compression gzip des réponses texte ; les pages en streaming sont toujours compressées
+    app.config['GZIP_MIN_SIZE'] = 1024   # octets
+    app.config['GZIP_LEVEL'] = 6
+    # Templates : bytecode compilé partagé sur disque entre workers ('' désactive), compilation au démarrage
+    app.config['JINJA_BYTECODE_CACHE'] = os.environ.get('JINJA_BYTECODE_CACHE', os.path.join(app.instance_path, 'jinja_cache'))
+    app.config['TEMPLATE_PREWARM'] = os.environ.get('TEMPLATE_PREWARM') == '1'
+    app.config.update(overrides or {})
+    # Profil de base de données (pragmas SQLite, pools, moteur de lecture) : variable DB_PROFILE
+    db_profile = load_profile()
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(db_profile, app.config['SQLALCHEMY_DATABASE_URI']))
+    return db_profile
+
+
+# Routes, commandes et tâches déclarées dans ce module, enregistrées sur chaque application par create_app()
+ROUTES = []
+COMMANDS = []
+JOB_HANDLERS = {}
+
+
+def route(rule, **options):
+    def register(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return register
+
+
+def command(name):
+    def register(function):
+        COMMANDS.append(click.command(name)(with_appcontext(function)))
+        return function
+    return register
+
+
+def job_handler(kind):
+    def register(function):
+        JOB_HANDLERS[kind] = function
+        return function
+    return register
+
+
+# Services propres à chaque application (voir create_app), utilisables dans un contexte d'application
+response_cache = LocalProxy(lambda: current_app.extensions['response_cache'])
+password_hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
+follow_graph = LocalProxy(lambda: current_app.extensions['follow_graph'])
+versions = LocalProxy(lambda: current_app.extensions['versions'])
+like_writer = LocalProxy(lambda: current_app.extensions['like_writer'])
+assets = LocalProxy(lambda: current_app.extensions['assets'])
+metrics = LocalProxy(lambda: current_app.extensions['metrics'])
+jobs = LocalProxy(lambda: current_app.extensions['jobs'])
+ranking = LocalProxy(lambda: current_app.extensions['trending'])
+
+
+# ------------------ GRAPHE DES ABONNEMENTS ------------------
+def load_follow_ids(direction, user_id):
+    """Ids suivis par (ou abonnés à) `user_id`, tels qu'enregistrés en base."""
+    if direction == FOLLOWED:
+        query = db.select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+    else:
+        query = db.select(followers.c.follower_id).where(followers.c.followed_id == user_id)
+    # Connexion à part : le graphe ne doit pas voir les écritures pas encore validées de la session
+    with (current_app.extensions['read_engine'] or db.engine).connect() as connection:
+        return connection.execute(query).scalars().all()
 
-    # ------------------- Méthodes pour suivre / unfollow / vérifier -------------------
-    def follow(self, user):
-        if not self.is_following(user):
-            self.followed.append(user)
 
-    def unfollow(self, user):
-        if self.is_following(user):
-            self.followed.remove(user)
+@db.event.listens_for(RoutingSession, 'after_commit')
+def publish_follows(session):
+    for (user_id, other_id), following in session.info.pop('follow_changes', {}).items():
+        follow_graph.apply(user_id, other_id, following)
 
-    def is_following(self, user):
-        return self.followed.filter(followers.c.followed_id == user.id).count() > 0
 
-    def __repr__(self):
-        return f'<User {self.username}>'
+@db.event.listens_for(RoutingSession, 'after_rollback')
+def discard_follows(session):
+    session.info.pop('follow_changes', None)
 
-    @property
-    def followers_count(self):
-        return self.followers.count()
 
-    @property
-    def following_count(self):
-        return self.followed.count()
+def mutual_follows(user):
+    """Comptes que `user` suit et qui le suivent."""
+    ids = follow_graph.mutual(user.id)
+    return User.query.filter(User.id.in_(ids)).order_by(User.username).all() if ids else []
 
 
-#######POSTS ET LIKES
-class Post(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    content = db.Column(db.String(255), nullable=False)
-    date_posted = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
-    likes = db.relationship('Like', backref='post', lazy=True)
-    comments = db.relationship('Comment', backref='post', lazy=True)
-    
+def suggested_users(user, limit=10):
+    """Comptes les plus suivis par ceux que suit `user`, avec le nombre de ses suivis qui les suivent."""
+    ranked = follow_graph.suggestions(user.id, limit, current_app.config['FOLLOW_SUGGESTION_FANOUT'])
+    users = {u.id: u for u in User.query.filter(User.id.in_([user_id for user_id, _ in ranked]))}
+    return [(users[user_id], common) for user_id, common in ranked if user_id in users]
 
 
-class Like(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
-    date_liked = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
+# ------------------ POSTS TENDANCE ------------------
+def pending_trending():
+    """Événements (post_id, poids) de la transaction en cours, appliqués au classement après le commit."""
+    return db.session.info.setdefault('trending_events', [])
 
-    # Un utilisateur ne peut liker un post qu'une seule fois
-    __table_args__ = (db.UniqueConstraint('user_id', 'post_id', name='unique_like'),)
-##########
 
+@db.event.listens_for(RoutingSession, 'after_commit')
+def publish_trending(session):
+    events = session.info.pop('trending_events', None)
+    if events:
+        ranking.apply(events)
 
 
-#######COMMENTAIRES
-class Comment(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    content = db.Column(db.String(255), nullable=False)
-    date_posted = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
-    
-    # Relation vers l'auteur
-    author = db.relationship('User', backref='comments', lazy=True)
-    
-    likes = db.relationship('CommentLike', backref='comment', lazy=True)
+@db.event.listens_for(RoutingSession, 'after_rollback')
+def discard_trending(session):
+    session.info.pop('trending_events', None)
 
-class CommentLike(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    comment_id = db.Column(db.Integer, db.ForeignKey('comment.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    date_liked = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
-##############
 
+def load_trending_events(app, since):
+    """Likes et commentaires depuis `since` (epoch), regroupés par post et par heure : [(post_id, poids, horodatage)].
 
+    Appelée par le thread de reconstruction du classement, hors de toute requête.
+    """
+    since = datetime.fromtimestamp(since, PARIS).replace(tzinfo=None)
+    sources = (
+        (Like.post_id, Like.date_liked, app.config['TRENDING_LIKE_WEIGHT']),
+        (Comment.post_id, Comment.date_posted, app.config['TRENDING_COMMENT_WEIGHT']),
+    )
+    events, hours = [], {}  # heure -> epoch : une conversion par heure de la fenêtre, pas par ligne
+    with app.app_context():
+        for post_column, date_column, weight in sources:
+            # Début de l'heure : jamais plus récent que l'événement, un like retiré ensuite
+            # (compté au poids actuel) ne laisse pas de reste positif dans le classement
+            hour = func.strftime('%Y-%m-%d %H:00', date_column)
+            rows = db.session.execute(
+                db.select(post_column, hour, func.count()).where(date_column >= since).group_by(post_column, hour)
+            )
+            for post_id, bucket, count in rows:
+                if bucket not in hours:
+                    hours[bucket] = PARIS.localize(datetime.strptime(bucket, '%Y-%m-%d %H:%M')).timestamp()
+                events.append((post_id, weight * count, hours[bucket]))
+    return events
+
+
+def trending_posts(limit=None):
+    """Posts tendance chargés en une requête : [(post, score)], du plus haut au plus bas."""
+    ranked = ranking.top(limit)
+    posts = {post.id: post for post in Post.query.options(selectinload(Post.author))
+             .filter(Post.id.in_([post_id for post_id, _ in ranked]))}
+    missing = [post_id for post_id, _ in ranked if post_id not in posts]
+    if missing:
+        ranking.discard(missing)  # supprimés par un autre worker, avant la prochaine reconstruction
+    return [(posts[post_id], score) for post_id, score in ranked if post_id in posts]
+
+
+# ------------------ CHARGEMENT DES PAGES ------------------
+def with_page_graph(query):
+    """Ajoute à une requête de posts le chargement groupé des auteurs et des commentaires.
+
+    Sans ça, chaque `post.author`, `post.comments` et `comment.author` du template
+    déclenche sa propre requête SQL (N+1).
+    """
+    return query.options(
+        selectinload(Post.author),
+        selectinload(Post.comments).selectinload(Comment.author),
+    )
 
 
-#créer les bases de données qui ne le sont pas déjà
-with app.app_context():
+def encode_cursor(post):
+    """Curseur opaque pointant juste après `post` dans l'ordre (date_posted, id) décroissant."""
+    raw = f'{post.date_posted.isoformat()}|{post.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_posted, post_id = raw.split('|')
+        return datetime.fromisoformat(date_posted), int(post_id)
+    except (ValueError, binascii.Error):
+        abort(400)
+
+
+def paginate_posts(query, cursor=None, keys=None, limit=None):
+    """Pagination par curseur (keyset) sur (date_posted, id), sans OFFSET ni COUNT.
+
+    On lit une ligne de plus que la page pour savoir s'il en reste.
+    `keys` permet de trier sur des colonnes équivalentes d'une autre table (ex. TimelineEntry).
+    Renvoie (posts, next_cursor) ; next_cursor vaut None sur la dernière page.
+    """
+    limit = limit or current_app.config['POSTS_PER_PAGE']
+    date_key, id_key = keys or (Post.date_posted, Post.id)
+    if cursor:
+        query = query.filter(db.tuple_(date_key, id_key) < decode_cursor(cursor))
+    rows = (
+        with_page_graph(query)
+        .order_by(date_key.desc(), id_key.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    posts = rows[:limit]
+    next_cursor = encode_cursor(posts[-1]) if len(rows) > limit else None
+    return posts, next_cursor
+
+
+class PostStream:
+    """Page de posts chargée par lots pendant que le template l'itère.
+
+    `fetch(cursor, limit)` renvoie (posts, next_cursor) comme paginate_posts. Les ensembles
+    liked_post_ids / liked_comment_ids sont complétés à chaque lot, avant que ses posts
+    soient rendus ; next_cursor n'est connu qu'une fois la page parcourue.
+    """
+
+    def __init__(self, fetch, viewer, cursor=None):
+        self.fetch = fetch
+        self.viewer = viewer
+        self.cursor = cursor
+        self.next_cursor = None
+        self.liked_post_ids = set()
+        self.liked_comment_ids = set()
+        self._first_batch = None
+
+    def _load(self, cursor, limit):
+        posts, next_cursor = self.fetch(cursor, limit)
+        liked_post_ids, liked_comment_ids = load_liked_ids(self.viewer, posts)
+        self.liked_post_ids |= liked_post_ids
+        self.liked_comment_ids |= liked_comment_ids
+        return posts, next_cursor
+
+    def __bool__(self):
+        # `{% if posts %}` : on charge le premier lot, réutilisé par l'itération
+        if self._first_batch is None:
+            self._first_batch = self._load(self.cursor, min(current_app.config['STREAM_BATCH_SIZE'], current_app.config['POSTS_PER_PAGE']))
+        return bool(self._first_batch[0])
+
+    def __iter__(self):
+        remaining = current_app.config['POSTS_PER_PAGE']
+        cursor = self.cursor
+        while True:
+            limit = min(current_app.config['STREAM_BATCH_SIZE'], remaining)
+            if self._first_batch is not None:
+                (posts, next_cursor), self._first_batch = self._first_batch, None
+            else:
+                posts, next_cursor = self._load(cursor, limit)
+            yield from posts
+            remaining -= len(posts)
+            if next_cursor is None or remaining <= 0:
+                self.next_cursor = next_cursor
+                return
+            cursor = next_cursor
+
+
+# ------------------ INDEX DE RECHERCHE (FTS5) ------------------
+# Tables virtuelles FTS5, rowid = id de l'utilisateur / du post.
+# Elles ne sont pas des modèles : on les crée et supprime avec le reste du schéma.
+SEARCH_TABLES = {
+    'user_search': ('user', ['name', 'username']),
+    'post_search': ('post', ['content']),
+}
+# URL de la base -> tables FTS5 présentes ; absente : pas encore vérifié dans ce processus.
+# Par base et non globale : plusieurs applications (create_app) n'ont pas toutes l'index.
+search_index = {}
+
+
+def search_available():
+    """Vrai si les tables FTS5 existent (vérifié une fois, puis tenu à jour par create / drop)."""
+    url = str(db.engine.url)
+    if url not in search_index:
+        found = db.session.execute(db.text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name IN ('user_search', 'post_search')")).scalar()
+        search_index[url] = found == len(SEARCH_TABLES)
+    return search_index[url]
+
+
+@db.event.listens_for(db.metadata, 'after_create')
+def create_search_tables(target, connection, **kw):
+    for table, (source, columns) in SEARCH_TABLES.items():
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).first()
+        if exists:
+            continue
+        try:
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE {table} USING fts5({', '.join(columns)}, "
+                "tokenize='unicode61 remove_diacritics 2')")
+        except OperationalError:
+            # SQLite compilé sans FTS5 : on garde la recherche LIKE
+            search_index[str(connection.engine.url)] = False
+            return
+        # Base existante : on indexe les lignes déjà présentes
+        connection.exec_driver_sql(
+            f"INSERT INTO {table}(rowid, {', '.join(columns)}) "
+            f"SELECT id, {', '.join(columns)} FROM \"{source}\"")
+    search_index[str(connection.engine.url)] = True
+
+
+@db.event.listens_for(db.metadata, 'before_drop')
+def drop_search_tables(target, connection, **kw):
+    for table in SEARCH_TABLES:
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+    search_index.pop(str(connection.engine.url), None)
+
+
+def index_user(user):
+    """(Ré)indexe le nom et le username de `user` (à appeler avant le commit)."""
+    if search_available():
+        db.session.flush()
+        unindex_user(user.id)
+        db.session.execute(db.text(
+            "INSERT INTO user_search(rowid, name, username) VALUES (:id, :name, :username)"),
+            {'id': user.id, 'name': user.name, 'username': user.username})
+
+
+def unindex_user(user_id):
+    if search_available():
+        db.session.execute(db.text("DELETE FROM user_search WHERE rowid = :id"), {'id': user_id})
+
+
+def index_post(post):
+    if search_available():
+        db.session.execute(db.text(
+            "INSERT INTO post_search(rowid, content) VALUES (:id, :content)"),
+            {'id': post.id, 'content': post.content})
+
+
+post_search_table = db.table('post_search', db.column('rowid'))
+
+
+def unindex_posts(post_ids):
+    """Retire des posts de l'index ; `post_ids` est une liste ou une sous-requête d'ids."""
+    if search_available():
+        db.session.execute(db.delete(post_search_table).where(post_search_table.c.rowid.in_(post_ids)))
+
+
+def match_expression(text):
+    """Transforme la saisie en requête FTS5 : chaque mot est un préfixe (recherche au fil de la frappe)."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def search_users(text, exclude_id=None, page=1):
+    """Utilisateurs correspondant à `text`, classés par pertinence.
+
+    Renvoie (users, has_more) ; une page contient au plus SEARCH_RESULTS_PER_PAGE résultats.
+    """
+    limit = current_app.config['SEARCH_RESULTS_PER_PAGE']
+    offset = (page - 1) * limit
+    expression = match_expression(text)
+    if not expression:
+        return [], False
+    if search_available():
+        ids = db.session.execute(db.text(
+            "SELECT rowid FROM user_search WHERE user_search MATCH :q AND rowid != :me "
+            "ORDER BY rank LIMIT :limit OFFSET :offset"),
+            {'q': expression, 'me': exclude_id or 0, 'limit': limit + 1, 'offset': offset}).scalars().all()
+        users = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+        results = [users[i] for i in ids if i in users]
+    else:
+        # Saisie échappée : % et _ y sont des caractères comme les autres, pas des jokers
+        prefix = re.sub(r'([\\%_])', r'\\\1', text) + '%'
+        query = User.query.filter(User.name.ilike(prefix, escape='\\') | User.username.ilike(prefix, escape='\\'))
+        if exclude_id is not None:
+            query = query.filter(User.id != exclude_id)
+        results = query.order_by(User.username).offset(offset).limit(limit + 1).all()
+    return results[:limit], len(results) > limit
+
+
+def search_posts(text, page=1):
+    """Posts dont le contenu correspond à `text` (vide si FTS5 n'est pas disponible)."""
+    limit = current_app.config['SEARCH_RESULTS_PER_PAGE']
+    expression = match_expression(text)
+    if not expression or not search_available():
+        return [], False
+    ids = db.session.execute(db.text(
+        "SELECT rowid FROM post_search WHERE post_search MATCH :q "
+        "ORDER BY rank LIMIT :limit OFFSET :offset"),
+        {'q': expression, 'limit': limit + 1, 'offset': (page - 1) * limit}).scalars().all()
+    posts = {post.id: post for post in Post.query.options(selectinload(Post.author)).filter(Post.id.in_(ids))}
+    results = [posts[i] for i in ids if i in posts]
+    return results[:limit], len(results) > limit
+
+
+@command('rebuild-search-index')
+def rebuild_search_index():
+    """Reconstruit l'index de recherche à partir des tables user et post."""
+    with db.engine.begin() as connection:
+        drop_search_tables(db.metadata, connection)
+        create_search_tables(db.metadata, connection)
+    print('Index de recherche reconstruit ✅')
+
+
+# ------------------ UTILISATEUR COURANT ------------------
+def reset_current_user():
+    # Un contexte d'application peut survivre à plusieurs requêtes (tests, CLI)
+    g.pop('current_user', None)
+
+
+def get_current_user():
+    """Utilisateur connecté, chargé une seule fois par requête et par clé primaire."""
+    if 'current_user' not in g:
+        user = None
+        if 'user_id' in session:
+            user = db.session.get(User, session['user_id'])
+        elif 'username' in session:
+            # Sessions ouvertes avant l'ajout de user_id
+            user = User.query.filter_by(username=session['username']).first()
+            if user:
+                session['user_id'] = user.id
+        g.current_user = user
+    return g.current_user
+
+
+def load_liked_ids(user, posts):
+    """Ensembles des posts et commentaires de la page likés par `user`.
+
+    Seuls les ids affichés sont interrogés, pas tout l'historique de likes.
+    """
+    if user is None or not posts:
+        return set(), set()
+    post_ids = [post.id for post in posts]
+    comment_ids = [comment.id for post in posts for comment in post.comments]
+    liked_post_ids = {row[0] for row in db.session.query(Like.post_id).filter(
+        Like.user_id == user.id, Like.post_id.in_(post_ids))}
+    liked_comment_ids = set()
+    if comment_ids:
+        liked_comment_ids = {row[0] for row in db.session.query(CommentLike.comment_id).filter(
+            CommentLike.user_id == user.id, CommentLike.comment_id.in_(comment_ids))}
+    return liked_post_ids, liked_comment_ids
+
+
+# ------------------ CACHE DES PAGES ------------------
+def content_version(scope, user_id):
+    """Version courante du contenu `scope` ('profile' ou 'feed') de l'utilisateur, incluse dans les clés.
+
+    Lue dans le store de versions partagé (jamais évincé) : la clé, donc l'ETag, ne change
+    qu'après une écriture, même avec le cache de pages désactivé.
+    """
+    return f"{versions.get('pages')}.{versions.get(f'{scope}:{user_id}')}"
+
+
+def invalidate(*user_ids, scope='profile'):
+    """Change la version des utilisateurs donnés : leurs pages en cache ne seront plus lues.
+
+    À appeler après le commit, pour qu'aucune page rendue avant l'écriture ne prenne la nouvelle version.
+    """
+    for user_id in user_ids:
+        versions.bump(f'{scope}:{user_id}')
+
+
+def invalidate_all():
+    """Change la version de toutes les pages (écriture visible partout, comme une suppression de compte)."""
+    versions.bump('pages')
+    response_cache.clear()  # pages devenues inaccessibles : autant libérer la place tout de suite
+
+
+def buffered(chunks, size):
+    """Regroupe les petits morceaux produits par Jinja en envois d'au moins `size` octets."""
+    buffer, buffered_size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield ''.join(buffer)
+            buffer, buffered_size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def page_etag(key, ttl):
+    """ETag d'une page mise en cache sous `key` (la clé contient déjà les versions du contenu).
+
+    Les fichiers statiques en font partie : après un déploiement, les pages pointent vers les
+    nouvelles empreintes. Une page à durée de vie limitée change d'ETag toutes les `ttl` secondes.
+    """
+    bucket = int(time.time() // ttl) if ttl else ''
+    return hashlib.sha1(f'{key}:{assets.version}:{bucket}'.encode()).hexdigest()[:20]
+
+
+def with_etag(response, etag):
+    if etag is not None:
+        response.set_etag(etag, weak=True)  # faible : même ETag compressé ou non
+        response.cache_control.private = True
+        response.cache_control.no_cache = True  # revalidée à chaque affichage, pour un 304 sans rendu
+    return response
+
+
+def cached_stream(key, ttl, template, **context):
+    """HTML en cache pour `key`, sinon la page `template` envoyée en streaming.
+
+    Le HTML envoyé est mis en cache une fois la page entièrement produite. La réponse porte
+    un ETag tiré de `key` : si le navigateur l'a déjà, 304 sans lire le cache ni rendre.
+    Les pages avec des messages flash en attente ne passent ni par le cache ni par l'ETag, et
+    sont rendues d'un bloc : la session, qui perd ses messages au rendu, est enregistrée avant
+    l'envoi du corps d'une réponse en streaming.
+    """
+    if session.get('_flashes'):
+        return render_template(template, **context)
+    etag = page_etag(key, ttl)
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(current_app.response_class(status=304), etag)
+    html = response_cache.get(key)
+    if html is not None:
+        return with_etag(current_app.response_class(html), etag)
+
+    @stream_with_context
+    def send():
+        # Le streaming commence après la fin de la vue, dont la session SQL a été fermée :
+        # on rattache les objets du contexte à la nouvelle session avant le rendu
+        for value in context.values():
+            if isinstance(value, db.Model):
+                db.session.add(value)
+        stream = stream_template(template, **context)
+        sent = []
+        try:
+            for chunk in buffered(stream, current_app.config['STREAM_BUFFER_SIZE']):
+                sent.append(chunk)
+                yield chunk
+        finally:
+            # Client déconnecté en cours de route : on referme le rendu tout de suite
+            stream.close()
+        response_cache.set(key, ''.join(sent), ttl)
+
+    return with_etag(current_app.response_class(send()), etag)
+
+
+# ------------------ FIL PRÉCALCULÉ ------------------
+def uses_inbox(user):
+    """Vrai si le fil de `user` est lu depuis sa boîte précalculée."""
+    return (current_app.config['TIMELINE_MODE'] == 'push'
+            and user.following_count <= current_app.config['TIMELINE_PUSH_MAX_FOLLOWING'])
+
+
+def trim_timelines(user_ids):
+    """Ne garde que les TIMELINE_INBOX_SIZE entrées les plus récentes de chaque boîte."""
+    ranked = db.select(
+        TimelineEntry.user_id,
+        TimelineEntry.post_id,
+        func.row_number().over(
+            partition_by=TimelineEntry.user_id,
+            order_by=(TimelineEntry.date_posted.desc(), TimelineEntry.post_id.desc()),
+        ).label('rank'),
+    ).where(TimelineEntry.user_id.in_(user_ids)).subquery()
+    overflow = db.select(ranked.c.user_id, ranked.c.post_id).where(ranked.c.rank > current_app.config['TIMELINE_INBOX_SIZE'])
+    db.session.execute(
+        db.delete(TimelineEntry).where(db.tuple_(TimelineEntry.user_id, TimelineEntry.post_id).in_(overflow))
+    )
+
+
+def fan_out_post(post):
+    """Pousse un nouveau post dans la boîte de chaque abonné de son auteur (post déjà flushé)."""
+    if current_app.config['TIMELINE_MODE'] != 'push':
+        return
+    readers = (
+        db.select(followers.c.follower_id)
+        .join(User, User.id == followers.c.follower_id)
+        .where(followers.c.followed_id == post.user_id,
+               User.following_count <= current_app.config['TIMELINE_PUSH_MAX_FOLLOWING'])
+    )
+    # OR IGNORE : un abonné arrivé entre-temps a déjà reçu le post par backfill_timeline
+    db.session.execute(db.insert(TimelineEntry).prefix_with('OR IGNORE').from_select(
+        ['user_id', 'post_id', 'date_posted'],
+        db.select(readers.subquery().c.follower_id, db.literal(post.id), db.literal(post.date_posted, db.DateTime)),
+    ))
+    trim_timelines(readers)
+
+
+def backfill_timeline(user, author):
+    """Ajoute les posts récents de `author` à la boîte de `user` (après un follow)."""
+    recent = (
+        db.select(db.literal(user.id), Post.id, Post.date_posted)
+        .where(Post.user_id == author.id)
+        .order_by(Post.date_posted.desc(), Post.id.desc())
+        .limit(current_app.config['TIMELINE_INBOX_SIZE'])
+    )
+    db.session.execute(
+        db.insert(TimelineEntry).prefix_with('OR IGNORE')
+        .from_select(['user_id', 'post_id', 'date_posted'], recent)
+    )
+    trim_timelines([user.id])
+
+
+def rebuild_timeline(user):
+    """Reconstruit entièrement la boîte de `user` à partir de ses abonnements."""
+    TimelineEntry.query.filter_by(user_id=user.id).delete()
+    recent = (
+        db.select(db.literal(user.id), Post.id, Post.date_posted)
+        .join(followers, followers.c.followed_id == Post.user_id)
+        .where(followers.c.follower_id == user.id)
+        .order_by(Post.date_posted.desc(), Post.id.desc())
+        .limit(current_app.config['TIMELINE_INBOX_SIZE'])
+    )
+    db.session.execute(db.insert(TimelineEntry).from_select(['user_id', 'post_id', 'date_posted'], recent))
+
+
+def sync_timeline_after_follow(user, other, following):
+    """Met à jour la boîte de `user` après qu'il a suivi (ou cessé de suivre) `other`."""
+    if current_app.config['TIMELINE_MODE'] != 'push':
+        return
+    db.session.flush()
+    db.session.refresh(user, ['following_count'])
+    if not uses_inbox(user):
+        # Trop d'abonnements : on repasse en lecture pull, la boîte ne sert plus
+        TimelineEntry.query.filter_by(user_id=user.id).delete()
+    elif following:
+        backfill_timeline(user, other)
+    elif user.following_count == current_app.config['TIMELINE_PUSH_MAX_FOLLOWING']:
+        # On vient de repasser sous le seuil : la boîte n'était plus alimentée
+        rebuild_timeline(user)
+    else:
+        TimelineEntry.query.filter(
+            TimelineEntry.user_id == user.id,
+            TimelineEntry.post_id.in_(db.select(Post.id).where(Post.user_id == other.id)),
+        ).delete(synchronize_session=False)
+
+
+def read_timeline(user, cursor, limit=None):
+    """Renvoie (posts, next_cursor) pour le fil de `user`, en mode push ou pull."""
+    if uses_inbox(user):
+        inbox = Post.query.join(TimelineEntry, TimelineEntry.post_id == Post.id).filter(TimelineEntry.user_id == user.id)
+        posts, next_cursor = paginate_posts(inbox, cursor, keys=(TimelineEntry.date_posted, TimelineEntry.post_id), limit=limit)
+        inbox_size = TimelineEntry.query.filter_by(user_id=user.id).limit(current_app.config['TIMELINE_INBOX_SIZE']).count()
+        # Au-delà des entrées gardées dans la boîte, on retombe sur la requête pull
+        if next_cursor is not None or inbox_size < current_app.config['TIMELINE_INBOX_SIZE']:
+            return posts, next_cursor
+
+    followed_ids = follow_graph.followed(user.id)
+    # Si aucun suivi, on renvoie une liste vide
+    if not followed_ids:
+        return [], None
+    return paginate_posts(Post.query.filter(Post.user_id.in_(sorted(followed_ids))), cursor, limit=limit)
+
+
+@command('rebuild-timelines')
+def rebuild_timelines():
+    """Reconstruit les boîtes de tous les utilisateurs (à lancer en passant en mode push)."""
+    for user in User.query.all():
+        if uses_inbox(user):
+            rebuild_timeline(user)
+        else:
+            TimelineEntry.query.filter_by(user_id=user.id).delete()
+    db.session.commit()
+    print('Fils reconstruits ✅')
+
+
+# ------------------ COMPTEURS ------------------
+def refresh_counters(post_ids=None, comment_ids=None, user_ids=None):
+    """Recalcule les compteurs dénormalisés à partir des tables sources.
+
+    Chaque argument limite le recalcul aux ids donnés ; None recalcule toute la table.
+    Ne fait pas de commit : l'appelant reste maître de la transaction.
+    """
+    def restrict(query, column, ids):
+        return query if ids is None else query.filter(column.in_(ids))
+
+    if post_ids is None or post_ids:
+        restrict(Post.query, Post.id, post_ids).update({
+            Post.likes_count: db.select(func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery(),
+            Post.comments_count: db.select(func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery(),
+        }, synchronize_session=False)
+    if comment_ids is None or comment_ids:
+        restrict(Comment.query, Comment.id, comment_ids).update({
+            Comment.likes_count: db.select(func.count(CommentLike.id)).where(CommentLike.comment_id == Comment.id).scalar_subquery(),
+        }, synchronize_session=False)
+    if user_ids is None or user_ids:
+        restrict(User.query, User.id, user_ids).update({
+            User.followers_count: db.select(func.count()).select_from(followers).where(followers.c.followed_id == User.id).scalar_subquery(),
+            User.following_count: db.select(func.count()).select_from(followers).where(followers.c.follower_id == User.id).scalar_subquery(),
+        }, synchronize_session=False)
+
+
+@command('reconcile-counters')
+def reconcile_counters():
+    """Recalcule tous les compteurs et corrige les écarts."""
+    refresh_counters()
+    db.session.commit()
+    print('Compteurs recalculés ✅')
+
+
+# ------------------ NOTIFICATIONS ------------------
+# Écrites dans la transaction de l'action qui les cause ; aucune ne fait de commit.
+def notify(user_id, kind, target_id, actor_id, count=1, post_id=None):
+    """Ajoute `count` événements de `actor_id` à la notification (user_id, kind, target_id).
+
+    Un `count` négatif (like retiré, désabonnement) les retire : le cumul reste le nombre de
+    personnes qui aiment ou suivent encore, même après des bascules répétées.
+    """
+    if user_id == actor_id or not count:
+        return
+    if count < 0:
+        retract_notification(user_id, kind, target_id, -count)
+        return
+    values = {'count': Notification.count + count, 'actor_id': actor_id, 'updated_at': datetime.now(PARIS)}
+    # Notification déjà non lue : simple cumul, le nombre de non-lues ne change pas
+    if db.session.execute(db.update(Notification).where(
+            Notification.user_id == user_id, Notification.kind == kind,
+            Notification.target_id == target_id, Notification.unread).values(values)).rowcount:
+        return
+    db.session.execute(sqlite_insert(Notification).values(
+        user_id=user_id, kind=kind, target_id=target_id, post_id=post_id, actor_id=actor_id,
+        count=count, unread=True, updated_at=values['updated_at'],
+    ).on_conflict_do_update(index_elements=['user_id', 'kind', 'target_id'], set_={**values, 'unread': True}))
+    db.session.execute(sqlite_insert(NotificationInbox).values(user_id=user_id, unread=1).on_conflict_do_update(
+        index_elements=['user_id'], set_={'unread': NotificationInbox.unread + 1}))
+    # Une ligne de plus à lire : compaction de la boîte, au plus une fois par intervalle
+    interval = current_app.config['NOTIFICATIONS_COMPACT_INTERVAL']
+    jobs.enqueue('compact_notifications', {'user_id': user_id},
+                 key=f'compact_notifications:{user_id}:{int(time.time() // interval)}', delay=interval)
+
+
+def retract_notification(user_id, kind, target_id, count):
+    """Retire `count` événements ; une notification qui tombe à zéro est supprimée."""
+    condition = ((Notification.user_id == user_id) & (Notification.kind == kind)
+                 & (Notification.target_id == target_id))
+    db.session.execute(db.update(Notification).where(condition).values(count=Notification.count - count))
+    emptied = db.session.execute(
+        db.delete(Notification).where(condition, Notification.count <= 0).returning(Notification.unread)).scalars().all()
+    if any(emptied):
+        NotificationInbox.query.filter_by(user_id=user_id).update(
+            {NotificationInbox.unread: NotificationInbox.unread - 1}, synchronize_session=False)
+
+
+def retract_notifications(kind, events):
+    """Retire en bloc des événements supprimés avec leur auteur (compte supprimé).
+
+    `events` : db.select de (destinataire, cible), une ligne par événement, sans ceux d'un
+    utilisateur sur ses propres contenus (jamais notifiés). Même effet que retract_notification
+    pour chacun : les notifications qui tombent à zéro sont supprimées.
+    """
+    events = events.subquery()
+    condition = (Notification.kind == kind) & db.tuple_(Notification.user_id, Notification.target_id).in_(
+        db.select(events.c[0], events.c[1]))
+    db.session.execute(db.update(Notification).where(condition).values(count=Notification.count - db.select(func.count())
+        .where(events.c[0] == Notification.user_id, events.c[1] == Notification.target_id).scalar_subquery()))
+    emptied = db.session.execute(db.delete(Notification).where(condition, Notification.count <= 0)
+                                 .returning(Notification.user_id, Notification.unread)).all()
+    refresh_unread({user_id for user_id, unread in emptied if unread})
+
+
+def notify_likes(likes):
+    """Notifie les auteurs des cibles likées ; `likes` : (type, id) -> (variation du nombre de likes, dernier auteur)."""
+    post_ids = [target_id for kind, target_id in likes if kind == 'post']
+    comment_ids = [target_id for kind, target_id in likes if kind == 'comment']
+    targets = []
+    if post_ids:
+        targets += [('post', 'like_post', *row) for row in db.session.execute(
+            db.select(Post.id, Post.user_id, Post.id).where(Post.id.in_(post_ids)))]
+    if comment_ids:
+        targets += [('comment', 'like_comment', *row) for row in db.session.execute(
+            db.select(Comment.id, Comment.user_id, Comment.post_id).where(Comment.id.in_(comment_ids)))]
+    for kind, notification_kind, target_id, owner_id, post_id in targets:
+        count, actor_id = likes[kind, target_id]
+        notify(owner_id, notification_kind, target_id, actor_id, count, post_id=post_id)
+
+
+def unread_notifications(user_id):
+    inbox = db.session.get(NotificationInbox, user_id)
+    return inbox.unread if inbox is not None else 0
+
+
+def load_notifications(user_id, page=1):
+    """Notifications de `user_id`, les plus récentes d'abord ; renvoie (notifications, has_more)."""
+    limit = current_app.config['NOTIFICATIONS_PER_PAGE']
+    rows = (
+        Notification.query.filter_by(user_id=user_id)
+        .options(selectinload(Notification.actor), selectinload(Notification.post))
+        .order_by(Notification.updated_at.desc(), Notification.id.desc())
+        .offset((page - 1) * limit).limit(limit + 1).all()
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def mark_notifications_read(user_id):
+    Notification.query.filter_by(user_id=user_id, unread=True).update({Notification.unread: False}, synchronize_session=False)
+    NotificationInbox.query.filter_by(user_id=user_id).update({NotificationInbox.unread: 0}, synchronize_session=False)
+
+
+def refresh_unread(user_ids):
+    """Recompte les notifications non lues des utilisateurs donnés (après des suppressions)."""
+    NotificationInbox.query.filter(NotificationInbox.user_id.in_(user_ids)).update({
+        NotificationInbox.unread: db.select(func.count(Notification.id))
+        .where(Notification.user_id == NotificationInbox.user_id, Notification.unread).scalar_subquery(),
+    }, synchronize_session=False)
+
+
+def remove_notifications(condition):
+    """Supprime les notifications qui vérifient `condition` (cible supprimée) et recompte les non-lues."""
+    recipients = db.session.execute(db.select(Notification.user_id).where(condition).distinct()).scalars().all()
+    Notification.query.filter(condition).delete(synchronize_session=False)
+    refresh_unread(recipients)
+
+
+def compact_notifications(user_ids):
+    """Borne les boîtes de notifications ; renvoie le nombre de lignes supprimées.
+
+    Chaque utilisateur garde ses NOTIFICATIONS_KEEP notifications les plus récentes ; les
+    notifications lues depuis plus de NOTIFICATIONS_MAX_AGE_DAYS jours sont supprimées.
+    """
+    ranked = db.select(
+        Notification.id,
+        func.row_number().over(
+            partition_by=Notification.user_id,
+            order_by=(Notification.updated_at.desc(), Notification.id.desc()),
+        ).label('rank'),
+    ).where(Notification.user_id.in_(user_ids)).subquery()
+    overflow = db.select(ranked.c.id).where(ranked.c.rank > current_app.config['NOTIFICATIONS_KEEP'])
+    expired = datetime.now(PARIS) - timedelta(days=current_app.config['NOTIFICATIONS_MAX_AGE_DAYS'])
+    removed = Notification.query.filter(
+        Notification.user_id.in_(user_ids),
+        Notification.id.in_(overflow) | (~Notification.unread & (Notification.updated_at < expired)),
+    ).delete(synchronize_session=False)
+    if removed:
+        refresh_unread(user_ids)
+    return removed
+
+
+@job_handler('compact_notifications')
+def compact_notifications_job(user_id):
+    compact_notifications([user_id])
+
+
+@command('compact-notifications')
+def compact_all_notifications():
+    """Compacte les notifications de tous les utilisateurs (en plus des tâches faites au fil de l'eau)."""
+    removed = compact_notifications(db.select(NotificationInbox.user_id))
+    db.session.commit()
+    click.echo(f'{removed} notifications supprimées')
+
+
+# ------------------ ACTIONS ------------------
+# Partagées par les routes HTML et l'API JSON. Aucune ne fait de commit : l'appelant
+# commit puis appelle invalidate() pour les pages concernées.
+LIKE_TARGETS = {
+    'post': (Like, 'post_id', Post),
+    'comment': (CommentLike, 'comment_id', Comment),
+}
+
+
+def set_like(kind, user_id, target_id, liked=None):
+    """Like (liked=True), retire le like (False) ou bascule (None) ; renvoie (liké, variation du compteur).
+
+    Pas de lecture préalable : un DELETE puis, si besoin, un INSERT ... ON CONFLICT DO NOTHING.
+    Deux bascules concurrentes ne lèvent pas d'IntegrityError et la variation suit les lignes
+    réellement insérées ou supprimées. Le compteur n'est pas mis à jour ici.
+    L'INSERT sélectionne la cible : SQLite ne vérifie pas les clés étrangères (pas de PRAGMA
+    foreign_keys), un like sur une cible supprimée entre-temps n'insère donc rien au lieu
+    de laisser une ligne orpheline.
+    """
+    model, column, target = LIKE_TARGETS[kind]
+    delta = 0
+    if liked is not True:
+        delta = -model.query.filter_by(user_id=user_id, **{column: target_id}).delete(synchronize_session=False)
+        if liked is None:
+            liked = not delta
+    if liked:
+        delta += db.session.execute(
+            sqlite_insert(model).from_select(
+                ['user_id', column], db.select(db.literal(user_id), target.id).where(target.id == target_id)
+            ).on_conflict_do_nothing()
+        ).rowcount
+    return liked, delta
+
+
+def toggle_post_like(user, post):
+    """Like ou retire le like de `user` sur `post` ; renvoie True si le post est désormais liké."""
+    liked, delta = set_like('post', user.id, post.id)
+    if delta:
+        post.likes_count = Post.likes_count + delta
+        pending_trending().append((post.id, delta * current_app.config['TRENDING_LIKE_WEIGHT']))
+        notify(post.user_id, 'like_post', post.id, user.id, delta, post_id=post.id)
+    return liked
+
+
+def toggle_comment_like(user, comment):
+    """Like ou retire le like de `user` sur `comment` ; renvoie True si le commentaire est désormais liké."""
+    liked, delta = set_like('comment', user.id, comment.id)
+    if delta:
+        comment.likes_count = Comment.likes_count + delta
+        notify(comment.user_id, 'like_comment', comment.id, user.id, delta, post_id=comment.post_id)
+    return liked
+
+
+def apply_like_events(events):
+    """Applique des événements (type, user_id, id, liked) et les valide en une transaction.
+
+    Une seule mise à jour de compteur et une seule notification par cible pour tout le lot ;
+    renvoie l'état final de chaque like.
+    """
+    results, deltas = [], {}
+    for kind, user_id, target_id, liked in events:
+        liked, delta = set_like(kind, user_id, target_id, liked)
+        results.append(liked)
+        if delta:
+            # Dernier auteur d'un like (d'un retrait à défaut), affiché sur la notification
+            total, actor_id = deltas.get((kind, target_id), (0, None))
+            deltas[kind, target_id] = (total + delta, user_id if delta > 0 or actor_id is None else actor_id)
+    likes = {target: (delta, actor_id) for target, (delta, actor_id) in deltas.items() if delta}
+    for (kind, target_id), (delta, _) in likes.items():
+        target = LIKE_TARGETS[kind][2]
+        target.query.filter_by(id=target_id).update(
+            {target.likes_count: target.likes_count + delta}, synchronize_session=False)
+        if kind == 'post':
+            pending_trending().append((target_id, delta * current_app.config['TRENDING_LIKE_WEIGHT']))
+    if likes:
+        notify_likes(likes)
+    db.session.commit()
+    return results
+
+
+def apply_like_batch(app, events):
+    # Appelée par le thread d'écriture, hors de toute requête
+    with app.app_context():
+        return apply_like_events(events)
+
+
+def add_comment(user, post, content):
+    comment = Comment(post_id=post.id, user_id=user.id, content=content)
+    db.session.add(comment)
+    post.comments_count = Post.comments_count + 1
+    pending_trending().append((post.id, current_app.config['TRENDING_COMMENT_WEIGHT']))
+    notify(post.user_id, 'comment', post.id, user.id, post_id=post.id)
+    return comment
+
+
+def set_following(user, other, following):
+    """Suit (following=True) ou ne suit plus `other` ; le fil précalculé est mis à jour par une tâche."""
+    if following:
+        if user.follow(other):
+            notify(other.id, 'follow', 0, user.id)
+    elif user.unfollow(other):
+        notify(other.id, 'follow', 0, user.id, -1)
+    if current_app.config['TIMELINE_MODE'] == 'push':
+        jobs.enqueue('follow_changed', {'user_id': user.id, 'other_id': other.id})
+
+
+# ------------------ TÂCHES EN ARRIÈRE-PLAN ------------------
+# Exécutées par la file de jobs.py, chacune dans sa transaction, après la réponse.
+# Elles peuvent être rejouées (nouvel essai) : elles repartent de l'état de la base.
+@db.event.listens_for(RoutingSession, 'after_commit')
+def wake_jobs(session):
+    if session.info.pop('jobs_enqueued', False):
+        jobs.notify()
+
+
+@db.event.listens_for(RoutingSession, 'after_rollback')
+def discard_jobs(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+@job_handler('post_created')
+def publish_post(post_id):
+    """Diffuse un nouveau post dans les boîtes des abonnés et l'ajoute à l'index de recherche."""
+    post = db.session.get(Post, post_id)
+    if post is None:
+        return  # supprimé entre-temps
+    fan_out_post(post)
+    index_post(post)
+
+
+@job_handler('follow_changed')
+def sync_follow(user_id, other_id):
+    """Aligne la boîte de `user_id` sur son abonnement (ou non) à `other_id`, tel qu'il est en base."""
+    user, other = db.session.get(User, user_id), db.session.get(User, other_id)
+    if user is None or other is None:
+        return  # compte supprimé entre-temps
+    following = db.session.execute(db.select(followers.c.follower_id).where(
+        followers.c.follower_id == user_id, followers.c.followed_id == other_id)).first() is not None
+    sync_timeline_after_follow(user, other, following=following)
+    return partial(invalidate, user_id, scope='feed')
+
+
+@command('run-jobs')
+@click.option('--once', is_flag=True, help='Exécute les tâches prêtes puis s\'arrête.')
+def run_jobs(once):
+    """Worker de la file de tâches au premier plan (en plus ou à la place des threads des workers web)."""
+    if once:
+        while jobs.run_pending():
+            pass
+    else:
+        jobs.work()
+    click.echo(jobs.stats())
+
+
+# ------------------ SUPPRESSIONS EN CASCADE ------------------
+# Suppressions ensemblistes : chaque fonction reçoit une liste d'ids ou une sous-requête
+# (db.select) et n'émet qu'un nombre fixe de requêtes, sans charger les lignes en mémoire.
+# Aucune ne fait de commit.
+def remove_likes(like_ids):
+    """Supprime des likes de posts en décrémentant le compteur et les notifications des posts concernés."""
+    retract_notifications('like_post', db.select(Post.user_id, Like.post_id).join(Post, Post.id == Like.post_id)
+                          .where(Like.id.in_(like_ids), Like.user_id != Post.user_id))
+    Post.query.filter(Post.id.in_(db.select(Like.post_id).where(Like.id.in_(like_ids)))).update({
+        Post.likes_count: Post.likes_count - db.select(func.count(Like.id))
+        .where(Like.post_id == Post.id, Like.id.in_(like_ids)).scalar_subquery(),
+    }, synchronize_session=False)
+    Like.query.filter(Like.id.in_(like_ids)).delete(synchronize_session=False)
+
+
+def remove_comment_likes(comment_like_ids):
+    """Supprime des likes de commentaires en décrémentant le compteur et les notifications des commentaires concernés."""
+    retract_notifications('like_comment', db.select(Comment.user_id, CommentLike.comment_id)
+                          .join(Comment, Comment.id == CommentLike.comment_id)
+                          .where(CommentLike.id.in_(comment_like_ids), CommentLike.user_id != Comment.user_id))
+    Comment.query.filter(Comment.id.in_(
+        db.select(CommentLike.comment_id).where(CommentLike.id.in_(comment_like_ids))
+    )).update({
+        Comment.likes_count: Comment.likes_count - db.select(func.count(CommentLike.id))
+        .where(CommentLike.comment_id == Comment.id, CommentLike.id.in_(comment_like_ids)).scalar_subquery(),
+    }, synchronize_session=False)
+    CommentLike.query.filter(CommentLike.id.in_(comment_like_ids)).delete(synchronize_session=False)
+
+
+def remove_comments(comment_ids):
+    """Supprime des commentaires et leurs likes, en décrémentant le compteur et les notifications des posts."""
+    retract_notifications('comment', db.select(Post.user_id, Comment.post_id).join(Post, Post.id == Comment.post_id)
+                          .where(Comment.id.in_(comment_ids), Comment.user_id != Post.user_id))
+    Post.query.filter(Post.id.in_(db.select(Comment.post_id).where(Comment.id.in_(comment_ids)))).update({
+        Post.comments_count: Post.comments_count - db.select(func.count(Comment.id))
+        .where(Comment.post_id == Post.id, Comment.id.in_(comment_ids)).scalar_subquery(),
+    }, synchronize_session=False)
+    CommentLike.query.filter(CommentLike.comment_id.in_(comment_ids)).delete(synchronize_session=False)
+    remove_notifications((Notification.kind == 'like_comment') & Notification.target_id.in_(comment_ids))
+    Comment.query.filter(Comment.id.in_(comment_ids)).delete(synchronize_session=False)
+
+
+def delete_posts(post_ids):
+    """Supprime des posts et tout ce qui en dépend : likes, commentaires, likes de commentaires, fils, index, notifications."""
+    comment_ids = db.select(Comment.id).where(Comment.post_id.in_(post_ids))
+    TimelineEntry.query.filter(TimelineEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+    remove_notifications(Notification.post_id.in_(post_ids))
+    unindex_posts(post_ids)
+    CommentLike.query.filter(CommentLike.comment_id.in_(comment_ids)).delete(synchronize_session=False)
+    Like.query.filter(Like.post_id.in_(post_ids)).delete(synchronize_session=False)
+    Comment.query.filter(Comment.post_id.in_(post_ids)).delete(synchronize_session=False)
+    Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+
+
+def detach_account(user_id):
+    """Rend un compte invisible des autres : abonnements, fils, recherche, connexion."""
+    followed_ids = db.select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+    follower_ids = db.select(followers.c.follower_id).where(followers.c.followed_id == user_id)
+    User.query.filter(User.id.in_(followed_ids)).update(
+        {User.followers_count: User.followers_count - 1}, synchronize_session=False)
+    User.query.filter(User.id.in_(follower_ids)).update(
+        {User.following_count: User.following_count - 1}, synchronize_session=False)
+    retract_notifications('follow', db.select(followers.c.followed_id, db.literal(0))
+                          .where(followers.c.follower_id == user_id, followers.c.followed_id != user_id))
+    db.session.execute(followers.delete().where(
+        (followers.c.follower_id == user_id) | (followers.c.followed_id == user_id)))
+    TimelineEntry.query.filter(
+        (TimelineEntry.user_id == user_id)
+        | TimelineEntry.post_id.in_(db.select(Post.id).where(Post.user_id == user_id))
+    ).delete(synchronize_session=False)
+    unindex_user(user_id)
+    unindex_posts(db.select(Post.id).where(Post.user_id == user_id))
+    Notification.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    NotificationInbox.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    # Notifications qui gardent d'autres auteurs : le compte supprimé n'y est plus nommé
+    Notification.query.filter_by(actor_id=user_id).update({Notification.actor_id: None}, synchronize_session=False)
+    # Hash invalide : plus aucune connexion possible pendant une suppression en arrière-plan
+    User.query.filter_by(id=user_id).update({User.password: '!'}, synchronize_session=False)
+
+
+def delete_user_data(user_id, chunk_size=None):
+    """Supprime les likes, commentaires et posts d'un utilisateur, puis l'utilisateur.
+
+    chunk_size=None : tout se fait dans la transaction courante, sans commit.
+    Sinon, chaque étape est découpée en lots de `chunk_size` ids, avec un commit par lot.
+    """
+    steps = [
+        (db.select(Like.id).where(Like.user_id == user_id), remove_likes),
+        (db.select(CommentLike.id).where(CommentLike.user_id == user_id), remove_comment_likes),
+        (db.select(Comment.id).where(Comment.user_id == user_id), remove_comments),
+        (db.select(Post.id).where(Post.user_id == user_id), delete_posts),
+    ]
+    for ids, action in steps:
+        if chunk_size is None:
+            action(ids)
+            continue
+        while True:
+            chunk = db.session.execute(ids.limit(chunk_size)).scalars().all()
+            if not chunk:
+                break
+            action(chunk)
+            db.session.commit()
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+
+
+def account_size(user_id, limit):
+    """Nombre de lignes rattachées au compte, compté au plus jusqu'à `limit`."""
+    total = 0
+    for column in (Post.user_id, Like.user_id, Comment.user_id):
+        total += db.session.query(column).filter(column == user_id).limit(limit - total + 1).count()
+        if total > limit:
+            break
+    return total
+
+
+@job_handler('delete_user_data')
+def delete_account_data(user_id):
+    """Suppression par lots d'un compte déjà détaché ; un nouvel essai reprend où le précédent s'est arrêté."""
+    delete_user_data(user_id, chunk_size=current_app.config['DELETE_CHUNK_SIZE'])
+    return invalidate_all
+
+
+# ------------------ MIGRATIONS ------------------
+# `db.create_all()` crée les tables manquantes mais ne modifie jamais une table existante.
+# Les migrations ci-dessous mettent à niveau les anciennes bases ; elles sont idempotentes
+# et PRAGMA user_version retient la dernière appliquée. Toute nouvelle migration s'ajoute
+# à la fin de MIGRATIONS.
+def add_counter_columns():
+    """Ajoute les colonnes de compteurs dénormalisés et les remplit."""
+    inspector = db.inspect(db.session.connection())
+    added = False
+    for model in (User, Post, Comment):
+        existing = {column['name'] for column in inspector.get_columns(model.__tablename__)}
+        for column in model.__table__.columns:
+            if column.name not in existing and column.name.endswith('_count'):
+                db.session.execute(db.text(
+                    f'ALTER TABLE "{model.__tablename__}" ADD COLUMN {column.name} INTEGER NOT NULL DEFAULT 0'
+                ))
+                added = True
+    if added:
+        refresh_counters()
+
+
+def dedupe_comment_likes():
+    """Supprime les doublons de CommentLike (avant la création de l'index unique)."""
+    first_likes = db.select(func.min(CommentLike.id)).group_by(CommentLike.user_id, CommentLike.comment_id)
+    removed = CommentLike.query.filter(CommentLike.id.not_in(first_likes)).delete(synchronize_session=False)
+    if removed:
+        refresh_counters(post_ids=[], user_ids=[])
+
+
+def create_indexes():
+    """Crée les index déclarés sur les modèles qui manquent aux tables existantes."""
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+MIGRATIONS = [
+    add_counter_columns,
+    dedupe_comment_likes,
+    create_indexes,
+]
+
+
+def migrate():
+    """Applique les migrations pas encore passées sur la base courante."""
+    current = db.session.execute(db.text('PRAGMA user_version')).scalar()
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version > current:
+            migration()
+            db.session.execute(db.text(f'PRAGMA user_version = {version}'))
+            db.session.commit()
+            current = version
+    return current
+
+
+@command('upgrade-db')
+def upgrade_db():
+    """Crée les tables manquantes et met à niveau le schéma (colonnes, doublons, index)."""
     db.create_all()
+    print(f'Base au schéma {migrate()} ✅')
 
 # ------------------ ROUTES ------------------
 #########AUTHENTIFICATION ET PROFIL
-@app.route('/')
+@route('/')
 def home():
     return render_template('home.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         name = request.form['name']
@@ -136,8 +1302,9 @@ def register():
             return "Username déjà existant"
 
         # Créer un nouvel utilisateur
-        new_user = User(name=name, username=username, password=generate_password_hash(password), email=email)
+        new_user = User(name=name, username=username, password=password_hasher.hash(password), email=email)
         db.session.add(new_user)
+        index_user(new_user)
         db.session.commit()
 
         flash('Inscription réussie !', 'success')
@@ -145,7 +1312,7 @@ def register():
 
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -159,9 +1326,15 @@ def login():
         if not user:
             flash( "Nom d'utilisateur n'existe pas.",'error')
             return redirect(url_for('login'))
-        #Sachant que le username est le bon, on vérifie le mot de passe   
-        elif  user.username==username  and check_password_hash(user.password,password):   
+        #Sachant que le username est le bon, on vérifie le mot de passe (dans le pool de hachage)
+        valid, new_hash = password_hasher.verify(user.password, password)
+        if valid:
+            if new_hash:
+                # Hash calculé avec d'anciens paramètres : on le remplace par un hash à jour
+                user.password = new_hash
+                db.session.commit()
             session['username'] = username
+            session['user_id'] = user.id
             #flash('Connexion réussie !', 'success')
             return redirect(url_for('profile'))
         else :
@@ -172,94 +1345,93 @@ def login():
     return render_template('login.html')
 
 
-@app.route('/logout', methods=['GET', 'POST'])
+@route('/logout', methods=['GET', 'POST'])
 def logout():
     session.pop('username', None)
+    session.pop('user_id', None)
     return redirect(url_for('home'))
 
 
 
-@app.route('/profile')
+@route('/profile')
 def profile():
     if 'username' not in session:
         return redirect(url_for('login'))
-    current_user = User.query.filter_by(username=session['username']).first()
-    posts = Post.query.filter_by(user_id=current_user.id).order_by(Post.date_posted.desc()).all()
-    # Liste des posts likés
-    liked_post_ids = [like.post_id for like in Like.query.filter_by(user_id=current_user.id).all()]
-    # Liste des commentaires likés
-    liked_comment_ids = [like.comment_id for like in CommentLike.query.filter_by(user_id=current_user.id).all()]
-    return render_template(
-        'profile.html',
+    current_user = get_current_user()
+    cursor = request.args.get('cursor')
+    if cursor:
+        decode_cursor(cursor)  # curseur invalide : 400 avant le début du streaming
+
+    # Posts chargés par lots pendant le rendu, avec les likes du visiteur
+    posts = PostStream(
+        lambda after, limit: paginate_posts(Post.query.filter_by(user_id=current_user.id), after, limit=limit),
+        current_user, cursor)
+    key = f"page:profile:{current_user.id}:{content_version('profile', current_user.id)}:{cursor}"
+    return cached_stream(
+        key, None, 'profile.html',
         user=current_user,
         posts=posts,
         current_user=current_user,
-        liked_post_ids=liked_post_ids,
-        liked_comment_ids=liked_comment_ids
+        liked_post_ids=posts.liked_post_ids,
+        liked_comment_ids=posts.liked_comment_ids
     )
 #########################
 
 
 ############POSTS COMMENTAIRES ET LIKES
-@app.route('/create_post', methods=['POST'])
+@route('/create_post', methods=['POST'])
 def create_post():
     if 'username' not in session:
         flash('Vous devez être connecté pour publier.', 'warning')
         return redirect(url_for('login'))
-    user = User.query.filter_by(username=session['username']).first()
+    user = get_current_user()
     content = request.form['content']
     if not content.strip():
         flash('Le contenu ne peut pas être vide.', 'danger')
         return redirect(url_for('profile'))
     new_post = Post(user_id=user.id, content=content)
     db.session.add(new_post)
+    db.session.flush()
+    # Diffusion et indexation après la réponse ; la tâche est validée avec le post
+    jobs.enqueue('post_created', {'post_id': new_post.id}, key=f'post_created:{new_post.id}')
     db.session.commit()
+    invalidate(user.id)
     flash('Publication ajoutée !', 'success')
     return redirect(url_for('profile'))
 
-@app.route('/like_post/<int:post_id>', methods=['POST'])
+@route('/like_post/<int:post_id>', methods=['POST'])
 def like_post(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
-    user = User.query.filter_by(username=session['username']).first()
+    user = get_current_user()
     post = Post.query.get_or_404(post_id)
-    # Vérifier si l'utilisateur a déjà liké ce post
-    existing_like = Like.query.filter_by(user_id=user.id, post_id=post.id).first()
-    if existing_like:
-        # Si déjà liké, on supprime le like
-        db.session.delete(existing_like)
-    else:
-        # Sinon, on ajoute un like
-        new_like = Like(user_id=user.id, post_id=post.id)
-        db.session.add(new_like)
-    db.session.commit()
-    return redirect(request.referrer or url_for('profile'))
+    author_id = post.user_id
+    like_writer.submit('post', user.id, post.id)
+    invalidate(author_id)
+    invalidate(user.id, scope='feed')
     # Redirige vers la page précédente
     return redirect(request.referrer or url_for('profile'))
 
 
-@app.route('/delete_post/<int:post_id>', methods=['POST'])
+@route('/delete_post/<int:post_id>', methods=['POST'])
 def delete_post(post_id):
-    post = Post.query.get(post_id)
-    # Supprimer les likes et commentaires liés au post (optionnel)
-    Like.query.filter_by(post_id=post_id).delete()
-    Comment.query.filter_by(post_id=post_id).delete()
-        # Supprimer les likes et commentaires liés au post (optionnel)
-    Like.query.filter_by(post_id=post_id).delete()
-    Comment.query.filter_by(post_id=post_id).delete()
-    # Supprimer le post
-    db.session.delete(post)
+    post = Post.query.get_or_404(post_id)
+    author_id = post.user_id
+    # Supprimer le post avec ses likes, commentaires et likes de commentaires
+    delete_posts([post_id])
+    pending_trending().append((post_id, None))
     db.session.commit()
+    invalidate(author_id)
     flash('Votre post a été supprimé avec succès.', 'success')
     return redirect(url_for('profile'))
 
 
-@app.route('/edit_profile', methods=['GET', 'POST'])
+@route('/edit_profile', methods=['GET', 'POST'])
 def edit_profile():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    user = User.query.filter_by(username=session['username']).first()
+    user = get_current_user()
 
     if request.method == 'POST':
         # Récupérer les données (mais ne pas forcer à changer quoi que ce soit)
@@ -304,9 +1476,11 @@ def edit_profile():
             if len(new_password) < 6:
                 flash('Le mot de passe doit contenir au moins 6 caractères.', 'error')
                 return render_template('edit_profile.html', user=user)
-            user.password = generate_password_hash(new_password)
+            user.password = password_hasher.hash(new_password)
 
+        index_user(user)
         db.session.commit()
+        invalidate(user.id)
 
         # Mettre à jour session uniquement si username changé
         if new_username:
@@ -319,111 +1493,122 @@ def edit_profile():
 
 
 
-@app.route('/comment/<int:post_id>', methods=['POST'])
+@route('/comment/<int:post_id>', methods=['POST'])
 def create_comment(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
-    user = User.query.filter_by(username=session['username']).first()
+    user = get_current_user()
     post = Post.query.get_or_404(post_id)
     content = request.form['content'].strip()
     if not content:
         flash('Le commentaire ne peut pas être vide.', 'warning')
         return redirect(request.referrer or url_for('profile'))
-    comment = Comment(post_id=post.id, user_id=user.id, content=content)
-    db.session.add(comment)
+    add_comment(user, post, content)
+    author_id = post.user_id
     db.session.commit()
+    invalidate(author_id)
+    invalidate(user.id, scope='feed')
     return redirect(request.referrer or url_for('profile'))
 
-@app.route('/like_comment/<int:comment_id>', methods=['POST'])
+@route('/like_comment/<int:comment_id>', methods=['POST'])
 def like_comment(comment_id):
     if 'username' not in session:
         return redirect(url_for('login'))
-    user = User.query.filter_by(username=session['username']).first()
+    user = get_current_user()
     comment = Comment.query.get_or_404(comment_id)
-    existing_like = CommentLike.query.filter_by(user_id=user.id, comment_id=comment.id).first()
-    if existing_like:
-        db.session.delete(existing_like)
-    else:
-        new_like = CommentLike(user_id=user.id, comment_id=comment.id)
-        db.session.add(new_like)
-    db.session.commit()
+    author_id = comment.post.user_id
+    like_writer.submit('comment', user.id, comment.id)
+    invalidate(author_id)
+    invalidate(user.id, scope='feed')
     return redirect(request.referrer or url_for('profile'))
 ##################
 
 ##########FOLLOWS/UNFOLLOWS
-@app.route('/follow/<int:user_id>', methods=['POST'])
+@route('/follow/<int:user_id>', methods=['POST'])
 def follow_user(user_id):
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    current_user = User.query.filter_by(username=session['username']).first()
+    current_user = get_current_user()
     user_to_follow = User.query.get_or_404(user_id)
 
     if current_user.id == user_to_follow.id:
         flash("Vous ne pouvez pas vous suivre vous-même.", "error")
         return redirect(request.referrer)
 
-    current_user.follow(user_to_follow)
+    set_following(current_user, user_to_follow, True)
     db.session.commit()
+    invalidate(current_user.id, user_to_follow.id)
+    invalidate(current_user.id, scope='feed')
     return redirect(request.referrer or url_for('profile'))
 
-@app.route('/unfollow/<int:user_id>', methods=['POST'])
+@route('/unfollow/<int:user_id>', methods=['POST'])
 def unfollow_user(user_id):
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    current_user = User.query.filter_by(username=session['username']).first()
+    current_user = get_current_user()
     user_to_unfollow = User.query.get_or_404(user_id)
 
-    current_user.unfollow(user_to_unfollow)
+    set_following(current_user, user_to_unfollow, False)
     db.session.commit()
+    invalidate(current_user.id, user_to_unfollow.id)
+    invalidate(current_user.id, scope='feed')
     return redirect(request.referrer or url_for('profile'))
 
 
 ###########RECHERCHE ET AUTRE PROFILES D UTILISATEURS
-@app.route('/search', methods=['GET', 'POST'])
+@route('/search', methods=['GET', 'POST'])
 def search():
     if 'username' not in session:
         return redirect(url_for('login'))
     query = request.args.get('q', '').strip()
-    results = []
-    if query:
-        # Recherche sur le nom ou le username, insensible à la casse
-        results = User.query.filter(
-            ((User.name.ilike(f'%{query}%')) | (User.username.ilike(f'%{query}%'))) &
-            (User.username != session['username'])  # exclut l'utilisateur connecté
-        ).all()
+    page = max(request.args.get('page', 1, type=int), 1)
+    # Recherche plein texte sur le nom et le username (préfixes, classés par pertinence),
+    # en excluant l'utilisateur connecté
+    results, has_more_users = search_users(query, exclude_id=get_current_user().id, page=page)
+    post_results, has_more_posts = search_posts(query, page=page)
 
-    return render_template('search_results.html', query=query, results=results)
+    return render_template(
+        'search_results.html',
+        query=query,
+        results=results,
+        post_results=post_results,
+        page=page,
+        has_more=has_more_users or has_more_posts
+    )
 
 
 
-@app.route('/user/<username>')
+@route('/user/<username>')
 def user_profile(username):
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(user_id=user.id).order_by(Post.date_posted.desc()).all()
-    current_user = None
-    liked_post_ids = []
-    liked_comment_ids = []
-    if 'username' in session:
-        current_user = User.query.filter_by(username=session['username']).first()
-        liked_post_ids = [like.post_id for like in Like.query.filter_by(user_id=current_user.id).all()]
-        liked_comment_ids = [like.comment_id for like in CommentLike.query.filter_by(user_id=current_user.id).all()]
-    return render_template(
-        'user_profile.html',
+    current_user = get_current_user()
+    cursor = request.args.get('cursor')
+    if cursor:
+        decode_cursor(cursor)
+
+    posts = PostStream(
+        lambda after, limit: paginate_posts(Post.query.filter_by(user_id=user.id), after, limit=limit),
+        current_user, cursor)
+    # La page dépend du visiteur (likes, bouton suivre) : il fait partie de la clé
+    viewer = current_user.id if current_user else 'anon'
+    key = f"page:user_profile:{user.id}:{content_version('profile', user.id)}:{viewer}:{cursor}"
+    return cached_stream(
+        key, None, 'user_profile.html',
         user=user,
         posts=posts,
         current_user=current_user,
-        liked_post_ids=liked_post_ids,
-        liked_comment_ids=liked_comment_ids
+        liked_post_ids=posts.liked_post_ids,
+        liked_comment_ids=posts.liked_comment_ids
     )
     
-@app.route('/edit_biography', methods=['GET', 'POST'])
+@route('/edit_biography', methods=['GET', 'POST'])
 def edit_biography():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    user = User.query.filter_by(username=session['username']).first()
+    user = get_current_user()
 
     if request.method == 'POST':
         biography_text = request.form.get('biography', '').strip()
@@ -433,32 +1618,36 @@ def edit_biography():
         
         user.biography = biography_text
         db.session.commit()
+        invalidate(user.id)
         flash('Biographie mise à jour avec succès !', 'success')
         return redirect(url_for('profile'))  # redirige vers le profil
 
     return render_template('edit_biography.html', user=user)
 
-@app.route('/delete_account', methods=['GET', 'POST'])
+@route('/delete_account', methods=['GET', 'POST'])
 def delete_account():
-    user = User.query.filter_by(username=session['username']).first()
+    user = get_current_user()
     
     if request.method == 'POST':
-        # Supprimer tous les likes de l'utilisateur
-        Like.query.filter_by(user_id=user.id).delete()
-        CommentLike.query.filter_by(user_id=user.id).delete()
-
-        # Supprimer tous les commentaires de l'utilisateur
-        Comment.query.filter_by(user_id=user.id).delete()
-
-        # Supprimer tous les posts de l'utilisateur
-        Post.query.filter_by(user_id=user.id).delete()
-
-        # Supprimer l'utilisateur
-        db.session.delete(user)
-        db.session.commit()
+        # Abonnements, fils et recherche tout de suite, pour que le compte disparaisse
+        user_id = user.id
+        neighbors = follow_graph.followers(user_id) | follow_graph.followed(user_id)
+        detach_account(user.id)
+        if account_size(user.id, current_app.config['ACCOUNT_DELETE_BACKGROUND_THRESHOLD']) > current_app.config['ACCOUNT_DELETE_BACKGROUND_THRESHOLD']:
+            # Gros compte : le reste est supprimé par lots par une tâche, validée avec le détachement
+            jobs.enqueue('delete_user_data', {'user_id': user.id}, key=f'delete_user_data:{user.id}')
+            db.session.commit()
+        else:
+            # Tout dans une seule transaction
+            delete_user_data(user.id)
+            db.session.commit()
+        # Ses likes, commentaires et abonnements apparaissaient sur d'autres pages
+        invalidate_all()
+        follow_graph.invalidate(user_id, *neighbors)
 
         # Déconnecter l'utilisateur
         session.pop('username', None)
+        session.pop('user_id', None)
         flash('Votre compte a été supprimé avec succès.', 'success')
         return redirect(url_for('home'))
 
@@ -469,52 +1658,330 @@ def delete_account():
 
 from flask import render_template
 
-@app.route('/feed')
+@route('/feed')
 def feed():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-     # Récupérer l'offset (par défaut 0)
-    offset = int(request.args.get('offset', 0))
+    # Curseur de la page demandée (absent pour la première page)
+    cursor = request.args.get('cursor')
 
-    user = User.query.filter_by(username=session['username']).first()
-    followed_users = user.followed.all()
-    followed_ids = [u.id for u in followed_users]
+    user = get_current_user()
+    if cursor:
+        decode_cursor(cursor)
 
-    # Si aucun suivi, on renvoie une liste vide
-    if not followed_ids:
-        posts = []
-        total_count = 0
-    else:
-        total_count = Post.query.filter(Post.user_id.in_(followed_ids)).count()
-        posts = (
-            Post.query
-            .filter(Post.user_id.in_(followed_ids))
-            .order_by(Post.date_posted.desc())
-            .offset(offset)
-            .limit(20)
-            .all()
-        )
-
-    # IDs des likes pour l'affichage des boutons
-    liked_post_ids = [like.post_id for like in Like.query.filter_by(user_id=user.id).all()]
-    liked_comment_ids = [like.comment_id for like in CommentLike.query.filter_by(user_id=user.id).all()]
-
-    has_more = (offset + 20) < total_count
+    # Posts du fil et IDs des likes (pour les boutons) chargés par lots pendant le rendu
+    posts = PostStream(lambda after, limit: read_timeline(user, after, limit), user, cursor)
 
-    return render_template(
-        'timeline.html',
+    # Invalidé par les actions du lecteur ; les nouveaux posts des autres arrivent après FEED_CACHE_TTL
+    key = f"page:feed:{user.id}:{content_version('feed', user.id)}:{cursor}"
+    return cached_stream(
+        key, current_app.config['FEED_CACHE_TTL'], 'timeline.html',
+        current_user=user,
         posts=posts,
-        offset=offset,
-        has_more=has_more,
-        liked_post_ids=liked_post_ids,
-        liked_comment_ids=liked_comment_ids
+        liked_post_ids=posts.liked_post_ids,
+        liked_comment_ids=posts.liked_comment_ids
     )
 
 
+@route('/trending')
+def trending():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    # Classement en mémoire : une seule requête SQL, pour les posts affichés
+    return render_template('trending.html', ranked=trending_posts())
+
+
+@route('/notifications')
+def notifications():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    user = get_current_user()
+    page = max(request.args.get('page', 1, type=int), 1)
+    items, has_more = load_notifications(user.id, page)
+    unread = unread_notifications(user.id)
+    # Rendu avant le commit : les notifications non lues restent mises en évidence cette fois-ci
+    html = render_template('notifications.html', notifications=items, unread=unread, page=page, has_more=has_more)
+    if unread:
+        mark_notifications_read(user.id)
+        db.session.commit()
+    return html
+
+
+
+###########API JSON
+# Mêmes données que les pages, sans rendu HTML : le client ne recharge que ce qui a changé.
+def comment_to_dict(comment, liked_comment_ids):
+    return {
+        'id': comment.id,
+        'author': comment.author.username,
+        'content': comment.content,
+        'date_posted': comment.date_posted.isoformat(),
+        'likes_count': comment.likes_count,
+        'liked': comment.id in liked_comment_ids,
+    }
+
+
+def post_to_dict(post, liked_post_ids, liked_comment_ids):
+    return {
+        'id': post.id,
+        'author': post.author.username,
+        'content': post.content,
+        'date_posted': post.date_posted.isoformat(),
+        'likes_count': post.likes_count,
+        'comments_count': post.comments_count,
+        'liked': post.id in liked_post_ids,
+        'comments': [comment_to_dict(comment, liked_comment_ids) for comment in post.comments],
+    }
+
+
+def api_error(status, message):
+    return jsonify({'error': message}), status
+
+
+@route('/api/feed')
+def api_feed():
+    user = get_current_user()
+    if user is None:
+        return api_error(401, 'non connecté')
+    posts, next_cursor = read_timeline(user, request.args.get('cursor'))
+    liked_post_ids, liked_comment_ids = load_liked_ids(user, posts)
+    return jsonify({
+        'posts': [post_to_dict(post, liked_post_ids, liked_comment_ids) for post in posts],
+        'next_cursor': next_cursor,
+    })
+
+
+API_ACTION_IDS = {'like_post': 'post_id', 'comment': 'post_id', 'like_comment': 'comment_id',
+                  'follow': 'user_id', 'unfollow': 'user_id'}
+
+
+@route('/api/actions', methods=['POST'])
+def api_actions():
+    """Exécute une liste d'actions dans une seule transaction.
+
+    Corps : {"actions": [{"type": "like_post", "post_id": 1},
+                         {"type": "like_comment", "comment_id": 2},
+                         {"type": "comment", "post_id": 1, "content": "..."},
+                         {"type": "follow" | "unfollow", "user_id": 3}]}
+    Réponse : un résultat par action, avec uniquement les compteurs mis à jour.
+    """
+    user = get_current_user()
+    if user is None:
+        return api_error(401, 'non connecté')
+    actions = (request.get_json(silent=True) or {}).get('actions')
+    if not isinstance(actions, list) or not actions:
+        return api_error(400, 'liste "actions" attendue')
+    if len(actions) > current_app.config['API_MAX_BATCH']:
+        return api_error(400, f"au plus {current_app.config['API_MAX_BATCH']} actions par appel")
+
+    results = []
+    touched_posts, touched_comments, touched_users = set(), set(), set()
+    profiles_to_invalidate = set()
+    for action in actions:
+        kind = action.get('type') if isinstance(action, dict) else None
+        if not isinstance(kind, str):
+            # Liste, objet... : non hachable, refusé avant la recherche dans API_ACTION_IDS
+            db.session.rollback()
+            return api_error(400, '"type" doit être une chaîne')
+        field = API_ACTION_IDS.get(kind)
+        identifier = action.get(field) if field is not None else None
+        if identifier is not None and (not isinstance(identifier, int) or isinstance(identifier, bool)):
+            # Liste, objet... : le lot est refusé comme une action inconnue
+            db.session.rollback()
+            return api_error(400, f'"{field}" doit être un entier')
+        result = {'type': kind}
+        if kind in ('like_post', 'comment'):
+            post = db.session.get(Post, action.get('post_id') or 0)
+            if post is None:
+                result['error'] = 'post introuvable'
+            elif kind == 'like_post':
+                result.update(post_id=post.id, liked=toggle_post_like(user, post))
+            elif not str(action.get('content', '')).strip():
+                result['error'] = 'commentaire vide'
+            else:
+                comment = add_comment(user, post, str(action['content']).strip())
+                db.session.flush()
+                result.update(post_id=post.id, comment_id=comment.id)
+            if post is not None and 'error' not in result:
+                touched_posts.add(post.id)
+                profiles_to_invalidate.add(post.user_id)
+        elif kind == 'like_comment':
+            comment = db.session.get(Comment, action.get('comment_id') or 0)
+            if comment is None:
+                result['error'] = 'commentaire introuvable'
+            else:
+                result.update(comment_id=comment.id, liked=toggle_comment_like(user, comment))
+                touched_comments.add(comment.id)
+                profiles_to_invalidate.add(comment.post.user_id)
+        elif kind in ('follow', 'unfollow'):
+            other = db.session.get(User, action.get('user_id') or 0)
+            if other is None or other.id == user.id:
+                result['error'] = 'utilisateur invalide'
+            else:
+                set_following(user, other, kind == 'follow')
+                result['user_id'] = other.id
+                touched_users.update((user.id, other.id))
+                profiles_to_invalidate.update((user.id, other.id))
+        else:
+            # Lot refusé en entier : rien de ce qui précède n'est enregistré
+            db.session.rollback()
+            return api_error(400, f'action inconnue : {kind}')
+        results.append(result)
+    db.session.commit()
+    invalidate(*profiles_to_invalidate)
+    invalidate(user.id, scope='feed')
+
+    # Compteurs à jour, relus en une requête par table
+    post_counts = {row.id: row for row in db.session.query(
+        Post.id, Post.likes_count, Post.comments_count).filter(Post.id.in_(touched_posts))}
+    comment_counts = dict(db.session.query(Comment.id, Comment.likes_count).filter(Comment.id.in_(touched_comments)))
+    user_counts = {row.id: row for row in db.session.query(
+        User.id, User.followers_count, User.following_count).filter(User.id.in_(touched_users))}
+    for result in results:
+        if 'error' in result:
+            continue
+        if result['type'] in ('like_post', 'comment'):
+            counts = post_counts[result['post_id']]
+            result.update(likes_count=counts.likes_count, comments_count=counts.comments_count)
+        elif result['type'] == 'like_comment':
+            result['likes_count'] = comment_counts[result['comment_id']]
+        else:
+            counts = user_counts[result['user_id']]
+            result.update(followers_count=counts.followers_count)
+    return jsonify({'results': results})
+
+
+@route('/api/mutuals')
+def api_mutuals():
+    user = get_current_user()
+    if user is None:
+        return api_error(401, 'non connecté')
+    return jsonify({'users': [{'id': u.id, 'username': u.username} for u in mutual_follows(user)]})
+
+
+@route('/api/suggestions')
+def api_suggestions():
+    """Comptes à suivre : les plus suivis par les comptes que suit l'utilisateur."""
+    user = get_current_user()
+    if user is None:
+        return api_error(401, 'non connecté')
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['API_MAX_BATCH'])
+    return jsonify({'users': [{'id': u.id, 'username': u.username, 'followed_by': common}
+                              for u, common in suggested_users(user, limit)]})
+
+
+@route('/api/trending')
+def api_trending():
+    user = get_current_user()
+    if user is None:
+        return api_error(401, 'non connecté')
+    limit = min(request.args.get('limit', current_app.config['TRENDING_SIZE'], type=int), current_app.config['TRENDING_SIZE'])
+    return jsonify({'posts': [
+        {'id': post.id, 'author': post.author.username, 'content': post.content,
+         'likes_count': post.likes_count, 'comments_count': post.comments_count, 'score': round(score, 3)}
+        for post, score in trending_posts(limit)]})
+
+
+@route('/api/notifications/unread')
+def api_unread_notifications():
+    """Nombre de notifications non lues (une lecture par clé primaire), pour un badge rafraîchi par le client."""
+    user = get_current_user()
+    if user is None:
+        return api_error(401, 'non connecté')
+    return jsonify({'unread': unread_notifications(user.id)})
+
+
+# ------------------ APPLICATION ------------------
+def setup_templates(app):
+    """Cache de bytecode Jinja sur disque (partagé entre workers) et, si demandé, compilation de tous les templates."""
+    directory = app.config['JINJA_BYTECODE_CACHE']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    if app.config['TEMPLATE_PREWARM']:
+        # Le premier visiteur de chaque page ne paie plus la compilation
+        for name in app.jinja_env.list_templates(extensions=['html']):
+            app.jinja_env.get_template(name)
+
+
+def create_app(config=None):
+    """Construit une application : réglages, moteurs, services, routes et commandes.
+
+    `config` surcharge les réglages par défaut. Aucune connexion à la base n'est ouverte :
+    le schéma se crée avec `flask --app app upgrade-db`.
+    """
+    app = Flask(__name__)
+    db_profile = configure(app, config)
+    db.init_app(app)
+    install_compression(app)  # avant install_metrics : compresse le pied de page de débogage
+    with app.app_context():
+        configure_engines(app, db, db_profile)
+        app.extensions['metrics'] = install_metrics(app, [db.engine, app.extensions['read_engine']])
+    app.extensions['assets'] = install_assets(app)
+    app.extensions['rate_limits'] = install_rate_limits(app)  # après install_metrics : les 429 sont comptées
+    app.extensions['response_cache'] = make_cache(app.config)
+    app.extensions['password_hasher'] = PasswordHasher.from_config(app.config)
+    app.extensions['versions'] = VersionStore(app.config['VERSION_STORE_PATH'])
+    app.extensions['follow_graph'] = FollowGraph(load_follow_ids, app.extensions['versions'], app.config['FOLLOW_GRAPH_MAX_IDS'])
+    app.extensions['like_writer'] = LikeWriter.from_config(
+        app.config, apply_like_events if app.config['LIKE_WRITE_MODE'] == 'inline' else partial(apply_like_batch, app))
+    app.extensions['trending'] = TrendingRanking.from_config(app.config, partial(load_trending_events, app))
+    queue = app.extensions['jobs'] = JobQueue.from_config(app, JOB_HANDLERS)
+    if queue.mode == 'inline':
+        @app.after_request
+        def run_jobs_inline(response):
+            queue.run_due()
+            return response
+    else:
+        # Serveur lancé autrement que par serve.py (qui démarre le worker au chargement) :
+        # au plus tard à la première requête, pour reprendre les tâches d'un processus précédent
+        app.before_request(queue.start)
+    add_gauge = app.extensions['metrics'].add_gauge
+    add_gauge('app_jobs_pending', 'Tâches en attente dans la file.', lambda: queue.stats()['pending'])
+    add_gauge('app_jobs_lag_seconds', 'Retard de la plus ancienne tâche prête.', lambda: queue.stats()['lag'])
+    add_gauge('app_jobs_failed', 'Tâches abandonnées après JOB_MAX_ATTEMPTS essais.', lambda: queue.stats()['failed'])
+    # Compteurs propres à chaque worker : lus ici, dans le processus qui sert les requêtes
+    for service, stat, help_text in (
+        ('response_cache', 'hits', 'Pages servies depuis le cache de pages.'),
+        ('response_cache', 'misses', 'Pages absentes du cache de pages.'),
+        ('response_cache', 'entries', 'Pages dans le cache de pages.'),
+        ('follow_graph', 'hits', "Ensembles d'abonnements lus dans le graphe en mémoire."),
+        ('follow_graph', 'misses', "Ensembles d'abonnements rechargés depuis la base."),
+        ('follow_graph', 'ids', "Ids gardés dans le graphe des abonnements."),
+    ):
+        add_gauge(f'app_{service}_{stat}', help_text, lambda service=service, stat=stat: app.extensions[service].stats()[stat])
+    app.before_request(reset_current_user)
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    for cli_command in COMMANDS:
+        app.cli.add_command(cli_command)
+    setup_templates(app)
+    return app
+
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    """`from app import app` (scripts, flask, gunicorn) : application réglée par l'environnement, créée au premier accès."""
+    global _default_app
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+    return _default_app
+
 
 # ------------------ EXECUTION ------------------
 
+# Serveur de développement ; en production : python serve.py (plusieurs workers et threads)
 if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        migrate()
     app.run(host="0.0.0.0", port=5000, debug=True)
 
@@ -0,0 +1,149 @@
+"""Fichiers statiques : empreinte dans l'URL, variantes précompressées, cache d'un an.
+
+Au démarrage, chaque fichier de static/ est lu une fois. Son empreinte (sha256) est insérée
+dans son nom (style.css -> style.3f2a9c1b04de.css) et url_for('static', ...) renvoie ce nom :
+le contenu d'une URL ne change jamais, elle est servie avec Cache-Control immutable et le
+navigateur ne la redemande plus. Les fichiers texte sont gardés en mémoire compressés en
+gzip et, si le module brotli est installé, en brotli ; la variante envoyée dépend
+d'Accept-Encoding. Si Pillow est installé, des variantes WebP des images listées dans
+ASSETS_WEBP_WIDTHS sont générées aux largeurs affichées (macro picture de _assets.html).
+
+Un nom sans empreinte reste servi par le gestionnaire de Flask, avec revalidation.
+"""
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+
+from flask import request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEXT_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+def fingerprinted(filename, digest):
+    """'style.css' -> 'style.<digest>.css'."""
+    stem, dot, ext = filename.rpartition('.')
+    return f'{stem}.{digest}.{ext}' if dot else f'{filename}.{digest}'
+
+
+class Asset:
+    """Contenu d'un fichier statique et ses variantes compressées (encodage -> octets)."""
+
+    def __init__(self, data, mimetype, digest):
+        self.data = data
+        self.mimetype = mimetype
+        self.digest = digest
+        self.encodings = {}
+
+
+class Assets:
+    """Empreintes des fichiers de `folder` : nom d'origine -> nom servi, nom servi -> Asset."""
+
+    def __init__(self, folder, compress_min_size=512, webp_widths=None):
+        self.folder = folder
+        self.compress_min_size = compress_min_size
+        self.webp_widths = webp_widths or {}
+        self.urls = {}
+        self.files = {}
+        self.variants = {}  # nom d'origine -> [(largeur, nom d'origine de la variante WebP)]
+        self.version = None  # empreinte de l'ensemble : change dès qu'un fichier change
+
+    def build(self):
+        for root, _, names in os.walk(self.folder):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                self.add(filename, data)
+                if filename in self.webp_widths:
+                    self.add_webp(filename, data, self.webp_widths[filename])
+        self.version = hashlib.sha256(' '.join(sorted(self.files)).encode()).hexdigest()[:12]
+        return self
+
+    def add(self, filename, data, mimetype=None):
+        mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        asset = Asset(data, mimetype, digest)
+        if mimetype.startswith(TEXT_TYPES) and len(data) >= self.compress_min_size:
+            compressed = {'gzip': gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(data, quality=11)
+            asset.encodings = {name: body for name, body in compressed.items() if len(body) < len(data)}
+        name = fingerprinted(filename, digest)
+        self.urls[filename] = name
+        self.files[name] = asset
+        return name
+
+    def add_webp(self, filename, data, widths):
+        try:
+            from PIL import Image
+        except ImportError:
+            return
+        stem = filename.rpartition('.')[0]
+        variants = self.variants.setdefault(filename, [])
+        with Image.open(io.BytesIO(data)) as image:
+            # Jamais plus large que l'original
+            for width in sorted({min(width, image.width) for width in widths}):
+                resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+                out = io.BytesIO()
+                resized.save(out, 'WEBP', quality=85, method=6)
+                variant = f'{stem}.{width}w.webp'
+                self.add(variant, out.getvalue(), 'image/webp')
+                variants.append((width, variant))
+
+    def stats(self):
+        return {
+            'files': len(self.files),
+            'bytes': sum(len(asset.data) for asset in self.files.values()),
+            'compressed_bytes': sum(min([len(asset.data), *map(len, asset.encodings.values())])
+                                    for asset in self.files.values()),
+        }
+
+
+def install_assets(app):
+    """Calcule les empreintes de app.static_folder et remplace le gestionnaire 'static' ; renvoie l'objet Assets.
+
+    Réglages : ASSETS_MAX_AGE (secondes), ASSETS_COMPRESS_MIN_SIZE (octets), ASSETS_WEBP_WIDTHS.
+    """
+    assets = Assets(app.static_folder, app.config['ASSETS_COMPRESS_MIN_SIZE'],
+                    app.config['ASSETS_WEBP_WIDTHS']).build()
+    send_static = app.view_functions['static']
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in assets.urls:
+            values['filename'] = assets.urls[values['filename']]
+
+    def serve_static(filename):
+        asset = assets.files.get(filename)
+        if asset is None:
+            return send_static(filename=filename)
+        encoding = next((name for name in ('br', 'gzip')
+                         if name in asset.encodings and request.accept_encodings[name]), None)
+        response = app.response_class(asset.encodings[encoding] if encoding else asset.data, mimetype=asset.mimetype)
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['ASSETS_MAX_AGE']
+        response.cache_control.immutable = True
+        response.set_etag(asset.digest + (f'-{encoding}' if encoding else ''))
+        if asset.encodings:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.content_encoding = encoding
+        return response.make_conditional(request)
+
+    app.view_functions['static'] = serve_static
+
+    def webp_srcset(filename):
+        """srcset des variantes WebP de `filename` ('' sans Pillow ou sans variante)."""
+        return ', '.join(f"{url_for('static', filename=variant)} {width}w"
+                         for width, variant in assets.variants.get(filename, []))
+
+    app.jinja_env.globals['webp_srcset'] = webp_srcset
+    return assets
@@ -0,0 +1,77 @@
+"""Débit de /login en rafale, hachage dans le thread de la requête ('inline') ou dans le pool ('process').
+
+Usage : python bench_login.py [nb_threads] [connexions_par_thread]
+
+Pendant la rafale, un thread sonde la page d'accueil pour mesurer la latence des autres routes.
+Chaque mode tourne dans un sous-processus sur une base temporaire ; users.db n'est pas touchée.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def worker_main(nb_threads, logins_per_thread):
+    from app import app, db, User, password_hasher
+
+    with app.app_context():
+        db.create_all()
+        hashed = password_hasher.hash('motdepasse')
+        db.session.execute(db.insert(User), [
+            {'id': i, 'name': f'User {i}', 'username': f'user{i}', 'password': hashed, 'email': f'user{i}@example.com'}
+            for i in range(1, nb_threads + 1)
+        ])
+        db.session.commit()
+
+    done = threading.Event()
+    probe_latencies = []
+
+    def probe():
+        client = app.test_client()
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get('/')
+            probe_latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    def run(user_id):
+        client = app.test_client()
+        for _ in range(logins_per_thread):
+            response = client.post('/login', data={'username': f'user{user_id}', 'password': 'motdepasse'})
+            assert response.status_code == 302
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(1, nb_threads + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    prober.join()
+    app.extensions['password_hasher'].shutdown()  # hors contexte d'application : pas de proxy
+
+    probe_latencies.sort()
+    print(f"{os.environ['PASSWORD_HASH_EXECUTOR']:>8} : {nb_threads * logins_per_thread / elapsed:.1f} connexions/s | "
+          f"accueil pendant la rafale p50 {probe_latencies[len(probe_latencies) // 2] * 1000:.1f} ms, "
+          f"max {probe_latencies[-1] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    nb_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    logins_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    if os.environ.get('BENCH_WORKER'):
+        worker_main(nb_threads, logins_per_thread)
+        sys.exit(0)
+
+    print(f'{nb_threads} threads x {logins_per_thread} connexions, {os.cpu_count()} cœurs')
+    for executor in ('inline', 'process'):
+        tmpdir = tempfile.mkdtemp()
+        env = dict(os.environ, BENCH_WORKER='1', PASSWORD_HASH_EXECUTOR=executor, RATE_LIMIT_BACKEND='none',
+                   DATABASE_URL=f'sqlite:///{os.path.join(tmpdir, "bench.db")}')
+        subprocess.run([sys.executable, __file__, str(nb_threads), str(logins_per_thread)], env=env, check=True)
@@ -0,0 +1,82 @@
+"""Test de charge : likes et commentaires en parallèle, profil 'default' contre 'production'.
+
+Usage : python bench_sqlite_profile.py [nb_threads] [actions_par_thread]
+
+Chaque profil tourne dans un sous-processus (le profil est lu à l'import de app.py)
+sur une base temporaire ; users.db n'est pas touchée.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def worker_main(nb_threads, actions_per_thread):
+    from app import app, db, User, Post
+
+    app.config['TESTING'] = False
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(User), [
+            {'id': i, 'name': f'User {i}', 'username': f'user{i}', 'password': 'x', 'email': f'user{i}@example.com'}
+            for i in range(1, nb_threads + 1)
+        ])
+        db.session.execute(db.insert(Post), [{'id': i, 'user_id': 1, 'content': f'Post {i}'} for i in range(1, 4)])
+        db.session.commit()
+
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+
+    def run(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['username'] = f'user{user_id}'
+            sess['user_id'] = user_id
+        for n in range(actions_per_thread):
+            post_id = n % 3 + 1
+            start = time.perf_counter()
+            try:
+                if n % 2:
+                    response = client.post(f'/comment/{post_id}', data={'content': f'Commentaire {n}'})
+                else:
+                    response = client.post(f'/like_post/{post_id}')
+                failed = response.status_code >= 500
+            except Exception:
+                failed = True
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                if failed:
+                    errors.append(n)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(1, nb_threads + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"{os.environ['DB_PROFILE']:>10} : {total / elapsed:.0f} écritures/s | "
+          f"p50 {latencies[total // 2] * 1000:.1f} ms | p99 {latencies[int(total * 0.99)] * 1000:.1f} ms | "
+          f"{len(errors)} erreurs")
+
+
+if __name__ == '__main__':
+    nb_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    actions_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    if os.environ.get('BENCH_WORKER'):
+        worker_main(nb_threads, actions_per_thread)
+        sys.exit(0)
+
+    print(f'{nb_threads} threads x {actions_per_thread} likes/commentaires')
+    for profile in ('default', 'production'):
+        tmpdir = tempfile.mkdtemp()
+        env = dict(os.environ, BENCH_WORKER='1', DB_PROFILE=profile, CACHE_BACKEND='none', RATE_LIMIT_BACKEND='none',
+                   DATABASE_URL=f'sqlite:///{os.path.join(tmpdir, "bench.db")}')
+        subprocess.run([sys.executable, __file__, str(nb_threads), str(actions_per_thread)], env=env, check=True)
@@ -0,0 +1,119 @@
+"""Suite de benchmarks : latence (p50 / p95 / p99) et requêtes SQL par route, à plusieurs tailles de base.
+
+Usage : python bench_suite.py [nb_requêtes] [taille ...]
+        python bench_suite.py 30 100 1000 10000
+
+Chaque taille est un nombre d'utilisateurs, générés par seed.py dans une base en mémoire.
+Le cache de pages est désactivé : on mesure le rendu. Une route qui fait plus de requêtes SQL
+à la plus grande taille qu'à toutes les autres est signalée (régression de type N+1) et le
+script sort avec le code 1.
+"""
+import os
+import sys
+import time
+from itertools import cycle
+
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ.setdefault('CACHE_BACKEND', 'none')
+os.environ.setdefault('PASSWORD_HASH_EXECUTOR', 'inline')
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'none')  # le lecteur enchaîne les likes et les follows
+os.environ.setdefault('JOB_MODE', 'inline')  # base en mémoire : une seule connexion, pas de thread de tâches
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db, User, Post  # noqa: E402
+from seed import seed  # noqa: E402
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(client, method, urls, nb_requests):
+    """Renvoie (p50, p95, p99) en ms et le nombre moyen de requêtes SQL, `urls` étant appelées à tour de rôle."""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    for url in urls:
+        response = getattr(client, method)(url)  # échauffement
+        response.get_data()
+        response.close()
+    urls = cycle(urls)
+    timings = []
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for _ in range(nb_requests):
+            url = next(urls)
+            start = time.perf_counter()
+            response = getattr(client, method)(url)
+            response.get_data()  # pages en streaming : rendu compris
+            response.close()
+            timings.append(time.perf_counter() - start)
+            assert response.status_code < 400, (url, response.status_code)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    timings.sort()
+    ms = [percentile(timings, f) * 1000 for f in (0.5, 0.95, 0.99)]
+    return ms, len(statements) / nb_requests
+
+
+def run(nb_users, nb_requests):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        counts = seed(nb_users)
+        # Cas défavorables : le lecteur qui suit le plus de comptes, l'auteur le plus prolifique,
+        # le compte le plus suivi et le post le plus liké
+        reader = User.query.order_by(User.following_count.desc()).first()
+        author_id = (db.session.query(Post.user_id).group_by(Post.user_id)
+                     .order_by(db.func.count().desc()).limit(1).scalar())
+        author_name = db.session.get(User, author_id).username
+        star_id = User.query.order_by(User.followers_count.desc()).first().id
+        post_id = Post.query.order_by(Post.likes_count.desc()).first().id
+        reader_id, reader_name = reader.id, reader.username
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = reader_name
+        sess['user_id'] = reader_id
+    # /profile est lu par l'auteur prolifique : pages pleines quelle que soit la taille de la base
+    author = app.test_client()
+    with author.session_transaction() as sess:
+        sess['username'] = author_name
+        sess['user_id'] = author_id
+    print(f"\n{nb_users} utilisateurs : " + ' | '.join(f'{name} {value}' for name, value in counts.items()))
+
+    # Bascules : like / retrait du like, abonnement / désabonnement en alternance
+    routes = [
+        ('GET /feed', client, 'get', ['/feed']),
+        ('GET /profile', author, 'get', ['/profile']),
+        ('GET /user/<username>', client, 'get', [f'/user/{author_name}']),
+        ('GET /search', client, 'get', ['/search?q=user1']),
+        ('POST /like_post', client, 'post', [f'/like_post/{post_id}']),
+        ('POST /follow + /unfollow', client, 'post', [f'/follow/{star_id}', f'/unfollow/{star_id}']),
+    ]
+    results = {}
+    for name, route_client, method, urls in routes:
+        (p50, p95, p99), queries = measure(route_client, method, urls, nb_requests)
+        results[name] = queries
+        print(f'{name:>26} : p50 {p50:7.1f} ms | p95 {p95:7.1f} ms | p99 {p99:7.1f} ms | {queries:5.1f} requêtes SQL')
+    return results
+
+
+if __name__ == '__main__':
+    nb_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    sizes = [int(size) for size in sys.argv[2:]] or [100, 1000, 10000]
+
+    all_results = [run(size, nb_requests) for size in sizes]
+    # Pages pleines à toutes les tailles : seule la présence ou non de commentaires fait varier
+    # le compte de quelques requêtes, on compare donc au maximum des tailles précédentes
+    regressions = [name for name in all_results[-1]
+                   if all_results[-1][name] > max(results[name] for results in all_results[:-1] or all_results) + 0.5]
+    if regressions:
+        print(f"\n⚠️  Requêtes SQL en hausse avec la taille : {', '.join(regressions)}")
+        sys.exit(1)
+    print('\nNombre de requêtes SQL stable sur toutes les tailles ✅')
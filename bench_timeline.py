@@ -0,0 +1,74 @@
+"""Compare le fil d'actualité en mode pull et en mode push.
+
+Usage : python bench_timeline.py [nb_comptes_suivis] [posts_par_compte] [nb_lectures]
+
+La base de test est créée dans un fichier temporaire, users.db n'est pas touchée.
+Le cache de pages est désactivé : on mesure la construction du fil, pas une page déjà rendue.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmpdir, "bench.db")}'
+os.environ.setdefault('CACHE_BACKEND', 'none')
+
+from app import app, db, User, Post, followers, rebuild_timeline  # noqa: E402
+
+
+def build(nb_followed, posts_per_author):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # Le lecteur (id 1) suit tous les autres comptes
+        db.session.execute(db.insert(User), [
+            {'id': i, 'name': f'User {i}', 'username': f'user{i}', 'password': 'x', 'email': f'user{i}@example.com'}
+            for i in range(1, nb_followed + 2)
+        ])
+        db.session.execute(db.insert(followers), [
+            {'follower_id': 1, 'followed_id': i} for i in range(2, nb_followed + 2)
+        ])
+        start = datetime(2024, 1, 1)
+        db.session.execute(db.insert(Post), [
+            {'user_id': author, 'content': f'Post {n}', 'date_posted': start + timedelta(minutes=n * nb_followed + author)}
+            for author in range(2, nb_followed + 2)
+            for n in range(posts_per_author)
+        ])
+        db.session.execute(db.update(User).where(User.id == 1).values(following_count=nb_followed))
+        db.session.commit()
+
+
+def run(mode, nb_reads):
+    app.config['TIMELINE_MODE'] = mode
+    with app.app_context():
+        if mode == 'push':
+            rebuild_timeline(db.session.get(User, 1))
+            db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = 'user1'
+    client.get('/feed').close()  # échauffement
+    timings = []
+    for _ in range(nb_reads):
+        start = time.perf_counter()
+        response = client.get('/feed')
+        response.get_data()  # page envoyée en streaming : le rendu a lieu à la lecture
+        response.close()
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+if __name__ == '__main__':
+    nb_followed = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    posts_per_author = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    nb_reads = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    build(nb_followed, posts_per_author)
+    print(f'{nb_followed} comptes suivis, {nb_followed * posts_per_author} posts, {nb_reads} lectures de /feed')
+    for mode in ('pull', 'push'):
+        p50, p95 = run(mode, nb_reads)
+        print(f'{mode:>5} : p50 {p50 * 1000:.1f} ms | p95 {p95 * 1000:.1f} ms')
@@ -0,0 +1,105 @@
+"""Compare le classement des posts tendance en mémoire à la requête d'agrégation naïve.
+
+Usage : python bench_trending.py [nb_posts] [nb_likes] [nb_lectures]
+
+La requête naïve recalcule à chaque lecture le score décroissant de tous les posts, par un
+GROUP BY sur toutes les tables Like et Comment (fonctions mathématiques de SQLite 3.35+).
+Le classement en mémoire est reconstruit une fois, puis mis à jour événement par événement.
+La base de test est créée dans un fichier temporaire, users.db n'est pas touchée.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmpdir, "bench.db")}'
+
+from app import app, db, PARIS, User, Post, Like, Comment  # noqa: E402
+
+NAIVE = """
+SELECT post_id, SUM(weight * pow(2, (julianday(date) - julianday(:now)) * 86400 / :half_life)) AS score
+FROM (SELECT post_id, date_liked AS date, :like_weight AS weight FROM "like"
+      UNION ALL
+      SELECT post_id, date_posted AS date, :comment_weight AS weight FROM comment)
+GROUP BY post_id ORDER BY score DESC LIMIT :limit
+"""
+
+
+def build(nb_posts, nb_likes):
+    rng = random.Random(0)
+    nb_users = max(nb_likes // nb_posts, 1) + 1
+    now = datetime.now(PARIS).replace(tzinfo=None)
+    window = app.config['TRENDING_WINDOW']
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(db.insert(User), [
+            {'id': i, 'name': f'User {i}', 'username': f'user{i}', 'password': 'x', 'email': f'user{i}@example.com'}
+            for i in range(1, nb_users + 1)
+        ])
+        db.session.execute(db.insert(Post), [
+            {'id': i, 'user_id': rng.randint(1, nb_users), 'content': f'Post {i}',
+             'date_posted': now - timedelta(seconds=rng.uniform(0, window))}
+            for i in range(1, nb_posts + 1)
+        ])
+        # Popularité en loi de puissance : quelques posts concentrent la plupart des likes
+        pairs = {(rng.randint(1, nb_users), int(nb_posts * rng.random() ** 3) + 1) for _ in range(nb_likes)}
+        db.session.execute(db.insert(Like), [
+            {'user_id': user_id, 'post_id': post_id, 'date_liked': now - timedelta(seconds=rng.uniform(0, window))}
+            for user_id, post_id in pairs
+        ])
+        nb_comments = nb_likes // 5
+        db.session.execute(db.insert(Comment), [
+            {'user_id': rng.randint(1, nb_users), 'post_id': int(nb_posts * rng.random() ** 3) + 1, 'content': 'x',
+             'date_posted': now - timedelta(seconds=rng.uniform(0, window))}
+            for _ in range(nb_comments)
+        ])
+        db.session.commit()
+        return len(pairs), nb_comments
+
+
+def timed(function, nb_reads):
+    timings = []
+    for _ in range(nb_reads):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return result, timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+if __name__ == '__main__':
+    nb_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    nb_likes = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    nb_reads = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    nb_likes, nb_comments = build(nb_posts, nb_likes)
+    size = app.config['TRENDING_SIZE']
+    print(f'{nb_posts} posts, {nb_likes} likes, {nb_comments} commentaires, top {size}, {nb_reads} lectures')
+    with app.app_context():
+        ranking = app.extensions['trending']
+        params = {'now': datetime.now(PARIS).replace(tzinfo=None).isoformat(' '), 'limit': size,
+                  'half_life': app.config['TRENDING_HALF_LIFE'],
+                  'like_weight': app.config['TRENDING_LIKE_WEIGHT'], 'comment_weight': app.config['TRENDING_COMMENT_WEIGHT']}
+        naive, p50, p95 = timed(lambda: db.session.execute(db.text(NAIVE), params).all(), nb_reads)
+        print(f'       agrégat SQL : p50 {p50 * 1000:8.2f} ms | p95 {p95 * 1000:8.2f} ms')
+
+        start = time.perf_counter()
+        ranking.rebuild()
+        print(f'    reconstruction : {(time.perf_counter() - start) * 1000:8.2f} ms (en arrière-plan, toutes les '
+              f"{app.config['TRENDING_REBUILD_INTERVAL']} s)")
+        top, p50, p95 = timed(ranking.top, nb_reads)
+        print(f'classement mémoire : p50 {p50 * 1000:8.3f} ms | p95 {p95 * 1000:8.3f} ms')
+
+        events = [(random.randint(1, nb_posts), 1.0) for _ in range(10000)]
+        start = time.perf_counter()
+        for event in events:
+            ranking.apply([event])
+        print(f'   mise à jour     : {(time.perf_counter() - start) / len(events) * 1e6:8.2f} µs par événement')
+
+    # Regroupement par heure à la reconstruction : l'ordre peut différer entre scores très proches
+    common = len({post_id for post_id, _ in naive[:10]} & {post_id for post_id, _ in top[:10]})
+    print(f'top 10 commun aux deux méthodes : {common}/10')
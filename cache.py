@@ -0,0 +1,174 @@
+"""Cache de réponses rendues : backend mémoire et backend SQLite partagé entre processus.
+
+Les deux backends ont la même interface (get / set / delete / clear / stats),
+une expiration par TTL et une éviction LRU au-delà de `max_entries`. Dans le backend
+SQLite, l'ordre LRU et la taille sont approchés pour qu'une lecture n'écrive presque jamais.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """Cache LRU en mémoire, propre à un processus."""
+
+    def __init__(self, max_entries=1000, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()  # clé -> (valeur, expiration)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] is not None and item[1] < time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        """Enregistre `value` ; ttl=None prend le TTL par défaut, ttl=0 n'expire jamais."""
+        ttl = self.default_ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self._data)}
+
+
+class SQLiteCache:
+    """Cache stocké dans un fichier SQLite, partagé par tous les workers d'une machine.
+
+    Une lecture ne met à jour la date d'accès que si elle a plus de `touch_interval` secondes :
+    les lectures ne prennent pas le verrou d'écriture du fichier. La taille n'est vérifiée
+    (et l'excédent évincé) que toutes les `evict_every` écritures d'un processus.
+    """
+
+    def __init__(self, path, max_entries=10000, default_ttl=300, touch_interval=60, evict_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.touch_interval = touch_interval
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._writes = 0  # écritures depuis la dernière vérification de taille (approché entre threads)
+        self.hits = self.misses = self.evictions = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, accessed REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed)')
+
+    def _connection(self):
+        # Une connexion par thread ; le mode WAL laisse lire pendant qu'un autre processus écrit
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute('SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[1] is not None and row[1] < now:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        if row[2] < now - self.touch_interval:
+            conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+            (key, value, now + ttl if ttl else None, now),
+        )
+        self._writes += 1
+        if self._writes >= self.evict_every:
+            self._writes = 0
+            self._evict(conn)
+
+    def _evict(self, conn):
+        overflow = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)', (overflow,)
+            )
+            self.evictions += overflow
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def stats(self):
+        entries = self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': entries}
+
+
+class NullCache:
+    """Cache désactivé : toujours un miss."""
+
+    hits = misses = evictions = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'hits': 0, 'misses': self.misses, 'evictions': 0, 'entries': 0}
+
+
+def make_cache(config):
+    """Construit le backend choisi par CACHE_BACKEND ('memory', 'sqlite' ou 'none')."""
+    backend = config['CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryCache(config['CACHE_MAX_ENTRIES'], config['CACHE_DEFAULT_TTL'])
+    if backend == 'sqlite':
+        return SQLiteCache(config['CACHE_PATH'], config['CACHE_MAX_ENTRIES'], config['CACHE_DEFAULT_TTL'])
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f'CACHE_BACKEND inconnu : {backend}')
@@ -0,0 +1,55 @@
+"""Compression gzip des réponses texte (HTML, JSON, CSS...) pour les clients qui l'acceptent.
+
+Une réponse complète n'est compressée qu'au-delà de GZIP_MIN_SIZE octets. Une page envoyée
+en streaming l'est toujours, morceau par morceau : chaque morceau est vidé (Z_SYNC_FLUSH)
+pour que le navigateur puisse afficher le haut de page sans attendre la fin.
+
+install_compression() doit être appelée avant les autres after_request qui modifient le
+corps (pied de page de metrics.py) : Flask les exécute dans l'ordre inverse.
+"""
+import gzip
+import zlib
+
+from flask import request
+
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+
+def gzip_stream(chunks, level, charset='utf-8'):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 : en-tête et fin au format gzip
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def install_compression(app):
+    """Compresse en gzip les réponses de `app`. Réglages : GZIP_MIN_SIZE (octets), GZIP_LEVEL."""
+
+    @app.after_request
+    def compress(response):
+        if (response.status_code != 200 or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(COMPRESSIBLE)):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not request.accept_encodings['gzip']:
+            return response
+        level = app.config['GZIP_LEVEL']
+        if response.is_streamed:
+            response.response = gzip_stream(response.response, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['GZIP_MIN_SIZE']:
+                return response
+            response.set_data(gzip.compress(data, level))
+        response.content_encoding = 'gzip'
+        return response
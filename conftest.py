@@ -1,13 +1,37 @@
 import pytest
-from app import app, db
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db, User
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    # Base de test temporaire : la configuration est fixée avant toute connexion,
+    # instance/users.db n'est jamais touchée
+    directory = tmp_path_factory.mktemp('app')
+    return create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{directory / 'test.db'}",
+        'JINJA_BYTECODE_CACHE': '',
+        'JOB_MODE': 'inline',
+        'RATE_LIMIT_BACKEND': 'none',
+        'VERSION_STORE_PATH': str(directory / 'versions.db'),
+    })
+
 
 @pytest.fixture
-def client():
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
-        yield client
-        with app.app_context():
-            db.drop_all()
+def client(app):
+    app.extensions['response_cache'].clear()
+    app.extensions['trending'].clear()
+    # Client sans contexte conservé : les pages envoyées en streaming referment leur contexte
+    # à la fin de la lecture, ce qui dépilerait dans le désordre ceux gardés par `with client`
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        # Utilisateur de test, mot de passe haché comme à l'inscription
+        db.session.add(User(name="Test User", username="testuser", email="test@example.com",
+                            password=generate_password_hash("testpassword", method='pbkdf2:sha256')))
+        db.session.commit()
+    yield client
+    with app.app_context():
+        db.drop_all()
@@ -0,0 +1,130 @@
+"""Profils de configuration de la base SQLite : pragmas, taille des pools, moteur de lecture.
+
+Le profil est choisi par la variable d'environnement DB_PROFILE ('default' ou 'production').
+Chaque réglage peut ensuite être surchargé par sa propre variable d'environnement,
+par exemple DB_BUSY_TIMEOUT=10000 ou DB_READ_POOL_SIZE=0 (désactive le moteur de lecture).
+"""
+import os
+
+import sqlalchemy as sa
+from flask import current_app
+from flask_sqlalchemy.session import Session
+
+
+PROFILES = {
+    # Comportement historique : réglages par défaut de SQLite et de SQLAlchemy
+    'default': {
+        'journal_mode': None,
+        'synchronous': None,
+        'busy_timeout': None,
+        'mmap_size': None,
+        'cache_size': None,
+        'pool_size': None,
+        'max_overflow': None,
+        'pool_timeout': None,
+        'read_pool_size': 0,
+    },
+    # WAL : les lectures ne bloquent plus les écritures et inversement
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,          # ms d'attente sur un verrou avant "database is locked"
+        'mmap_size': 256 * 1024 ** 2,  # octets
+        'cache_size': -64 * 1024,      # négatif = en Kio
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'read_pool_size': 10,
+    },
+}
+
+PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size')
+
+
+def load_profile(environ=os.environ):
+    """Profil choisi par DB_PROFILE, avec les surcharges DB_<REGLAGE> de l'environnement."""
+    name = environ.get('DB_PROFILE', 'default')
+    if name not in PROFILES:
+        raise ValueError(f'DB_PROFILE inconnu : {name}')
+    profile = dict(PROFILES[name], name=name)
+    for key, default in PROFILES['production'].items():
+        value = environ.get(f'DB_{key.upper()}')
+        if value is not None:
+            profile[key] = type(default)(value)
+    return profile
+
+
+def is_memory_uri(uri):
+    database = sa.engine.make_url(uri).database
+    return database in (None, '', ':memory:')
+
+
+def engine_options(profile, uri):
+    """Options du moteur principal (SQLALCHEMY_ENGINE_OPTIONS)."""
+    if is_memory_uri(uri):
+        # Base en mémoire : une seule connexion partagée (StaticPool), pas de pool à régler
+        return {}
+    options = {key: profile[key] for key in ('pool_size', 'max_overflow', 'pool_timeout')
+               if profile[key] is not None}
+    options['connect_args'] = {'check_same_thread': False}
+    if profile['busy_timeout'] is not None:
+        options['connect_args']['timeout'] = profile['busy_timeout'] / 1000
+    return options
+
+
+def install_pragmas(engine, profile, query_only=False):
+    """Applique les pragmas du profil à chaque nouvelle connexion du moteur."""
+    pragmas = {name: profile[name] for name in PRAGMAS if profile[name] is not None}
+    if query_only:
+        pragmas['query_only'] = 1
+    if not pragmas:
+        return
+
+    @sa.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def configure_engines(app, db, profile):
+    """Installe les pragmas et, si le profil le demande, un moteur dédié aux lectures.
+
+    À appeler dans un contexte d'application, avant la première connexion.
+    """
+    install_pragmas(db.engine, profile)
+    app.extensions['read_engine'] = None
+    if profile['read_pool_size'] and not is_memory_uri(str(db.engine.url)):
+        read_engine = sa.create_engine(
+            db.engine.url,
+            pool_size=profile['read_pool_size'],
+            max_overflow=profile['max_overflow'] or 0,
+            pool_timeout=profile['pool_timeout'] or 30,
+            connect_args=engine_options(profile, str(db.engine.url))['connect_args'],
+        )
+        install_pragmas(read_engine, profile, query_only=True)
+        app.extensions['read_engine'] = read_engine
+
+
+class RoutingSession(Session):
+    """Session qui envoie les lectures au moteur de lecture tant que la transaction n'a rien écrit.
+
+    Dès la première écriture (flush, INSERT/UPDATE/DELETE, SQL textuel), la session reste sur
+    le moteur principal jusqu'au commit pour relire ses propres écritures.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        read_engine = current_app.extensions.get('read_engine')
+        if bind is not None or read_engine is None or self.info.get('wrote'):
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if self._flushing or clause is None or clause.is_dml or isinstance(clause, sa.TextClause):
+            self.info['wrote'] = True
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        return read_engine
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def reset_routing(session):
+    session.info.pop('wrote', None)
@@ -0,0 +1,192 @@
+"""Export, import et sauvegarde de la base, en mémoire constante.
+
+Usage : python dump.py export <dossier> [ndjson|csv]
+        python dump.py import <dossier>
+        python dump.py backup <fichier>
+
+export : chaque table (utilisateurs, abonnements, posts, likes, commentaires, likes de
+         commentaires, notifications, compteurs de non-lues) est lue par lots de CHUNK_SIZE
+         lignes dans une seule transaction de lecture (instantané cohérent) et écrite dans
+         <dossier>/<table>.ndjson ou .csv.
+import : les fichiers sont relus ligne à ligne et insérés par lots (executemany), avec un
+         commit par lot ; le schéma est créé au besoin. La base cible doit être vide.
+backup : copie à chaud avec l'API de sauvegarde de SQLite, BACKUP_PAGES pages à la fois :
+         le verrou est relâché entre deux étapes et les écritures continuent pendant la copie.
+
+Les fils précalculés et l'index de recherche ne sont pas exportés : ils sont reconstruits
+après l'import. La base est celle de l'application (DATABASE_URL).
+"""
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+# Ordre des clés étrangères : un import table par table ne référence que des lignes déjà là
+TABLES = ['user', 'followers', 'post', 'like', 'comment', 'comment_like', 'notification', 'notification_inbox']
+CHUNK_SIZE = 10000
+BACKUP_PAGES = 1024
+NULL = r'\N'  # valeur NULL dans les fichiers CSV
+
+
+def iter_rows(cursor, table, chunk_size=CHUNK_SIZE):
+    """Renvoie (colonnes, générateur des lignes de `table`), lues par lots de `chunk_size`."""
+    cursor.execute(f'SELECT * FROM "{table}" ORDER BY rowid')
+    columns = [column[0] for column in cursor.description]
+
+    def rows():
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield from chunk
+
+    return columns, rows()
+
+
+def export_database(db_path, directory, fmt='ndjson', chunk_size=CHUNK_SIZE):
+    """Écrit chaque table de TABLES dans `directory` ; renvoie le nombre de lignes par table."""
+    if fmt not in ('ndjson', 'csv'):
+        raise ValueError(f'Format inconnu : {fmt}')
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    counts = {}
+    try:
+        # Une seule transaction de lecture : toutes les tables sont lues au même instant
+        conn.execute('BEGIN')
+        cursor = conn.cursor()
+        for table in TABLES:
+            columns, rows = iter_rows(cursor, table, chunk_size)
+            counts[table] = 0
+            with open(os.path.join(directory, f'{table}.{fmt}'), 'w', encoding='utf-8', newline='') as out:
+                if fmt == 'csv':
+                    writer = csv.writer(out)
+                    writer.writerow(columns)
+                for row in rows:
+                    if fmt == 'csv':
+                        writer.writerow([NULL if value is None else value for value in row])
+                    else:
+                        out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+                    counts[table] += 1
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return counts
+
+
+def read_file(path):
+    """Renvoie (colonnes, générateur des lignes) d'un fichier .ndjson ou .csv, lu ligne à ligne."""
+    handle = open(path, encoding='utf-8', newline='')
+    if path.endswith('.csv'):
+        reader = csv.reader(handle)
+        columns = next(reader)
+
+        def rows():
+            with handle:
+                for row in reader:
+                    yield [None if value == NULL else value for value in row]
+
+        return columns, rows()
+
+    first = handle.readline()
+    columns = list(json.loads(first)) if first.strip() else []
+
+    def rows():
+        with handle:
+            if columns:
+                yield list(json.loads(first).values())
+            for line in handle:
+                if line.strip():
+                    row = json.loads(line)
+                    yield [row[column] for column in columns]
+
+    return columns, rows()
+
+
+def import_database(db_path, directory, chunk_size=CHUNK_SIZE):
+    """Insère les fichiers de `directory` dans les tables existantes ; renvoie le nombre de lignes par table."""
+    conn = sqlite3.connect(db_path)
+    counts = {}
+    try:
+        for table in TABLES:
+            path = next((os.path.join(directory, f'{table}.{fmt}') for fmt in ('ndjson', 'csv')
+                         if os.path.exists(os.path.join(directory, f'{table}.{fmt}'))), None)
+            if path is None:
+                continue
+            columns, rows = read_file(path)
+            insert = (f'INSERT INTO "{table}" ({", ".join(columns)}) '
+                      f'VALUES ({", ".join("?" for _ in columns)})')
+            counts[table] = 0
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    conn.executemany(insert, chunk)
+                    conn.commit()
+                    counts[table] += len(chunk)
+                    chunk = []
+            if chunk:
+                conn.executemany(insert, chunk)
+                conn.commit()
+                counts[table] += len(chunk)
+    finally:
+        conn.close()
+    return counts
+
+
+def backup_database(db_path, target, pages=BACKUP_PAGES, progress=None):
+    """Copie `db_path` dans `target` pendant que l'application continue d'écrire."""
+    source = sqlite3.connect(db_path)
+    destination = sqlite3.connect(target)
+    try:
+        with destination:
+            source.backup(destination, pages=pages, progress=progress, sleep=0.01)
+    finally:
+        destination.close()
+        source.close()
+
+
+def rebuild_derived():
+    """Reconstruit l'index de recherche et, en mode push, les fils (dans un contexte d'application).
+
+    Les versions des pages et des abonnements changent aussi : ni les ETag déjà envoyés ni
+    les ensembles chargés par un serveur en marche ne restent valides après l'import.
+    """
+    from app import (app, db, User, create_search_tables, drop_search_tables, uses_inbox, rebuild_timeline,
+                     invalidate_all, follow_graph)
+
+    with db.engine.begin() as connection:
+        drop_search_tables(db.metadata, connection)
+        create_search_tables(db.metadata, connection)
+    if app.config['TIMELINE_MODE'] == 'push':
+        for user in User.query:
+            if uses_inbox(user):
+                rebuild_timeline(user)
+        db.session.commit()
+    invalidate_all()
+    follow_graph.invalidate_all()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('export', 'import', 'backup'):
+        sys.exit(__doc__)
+    command, path = sys.argv[1], sys.argv[2]
+
+    from app import app, db  # noqa: E402
+
+    with app.app_context():
+        db_path = db.engine.url.database
+        if command == 'export':
+            counts = export_database(db_path, path, sys.argv[3] if len(sys.argv) > 3 else 'ndjson')
+        elif command == 'import':
+            db.create_all()
+            counts = import_database(db_path, path)
+            rebuild_derived()
+        else:
+            def progress(status, remaining, total):
+                print(f'\r{total - remaining}/{total} pages', end='', flush=True)
+
+            backup_database(db_path, path, progress=progress)
+            print()
+            counts = {}
+    print(' | '.join(f'{name}: {value}' for name, value in counts.items()) or 'Sauvegarde terminée ✅')
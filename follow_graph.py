@@ -0,0 +1,137 @@
+"""Graphe des abonnements en mémoire : ensembles d'ids suivis / abonnés par utilisateur.
+
+Les ensembles sont chargés à la demande et gardés dans un LRU borné par le nombre total d'ids.
+Chaque ensemble porte sa version, lue dans le store de versions partagé par les workers
+(versions.py) : une écriture faite par un autre worker change la version et force le
+rechargement. Ce store n'évince rien, une version n'est donc jamais perdue ni réinventée.
+Une version globale (ALL) s'y ajoute : la changer périme tous les ensembles d'un coup, après
+une écriture en masse (génération de données, import).
+Dans le processus qui écrit, apply() met à jour sans les relire les ensembles chargés à la
+version précédente ; un ensemble plus ancien est oublié et relu à la lecture suivante.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+FOLLOWED = 'followed'
+FOLLOWERS = 'followers'
+ALL = 'follows'
+
+
+class FollowGraph:
+    """`load(direction, user_id)` renvoie les ids suivis (FOLLOWED) ou abonnés (FOLLOWERS)."""
+
+    def __init__(self, load, versions, max_ids=1_000_000):
+        self.load = load
+        self.versions = versions
+        self.max_ids = max_ids
+        self._sets = OrderedDict()  # (direction, user_id) -> ((globale, version), frozenset d'ids)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def version(self, direction, user_id):
+        return self.versions.get_many(ALL, f'{direction}:{user_id}')
+
+    def _bump(self, direction, user_id):
+        return self.versions.bump(f'{direction}:{user_id}')
+
+    def _get(self, direction, user_id):
+        version = self.version(direction, user_id)
+        key = (direction, user_id)
+        with self._lock:
+            entry = self._sets.get(key)
+            if entry is not None and entry[0] == version:
+                self._sets.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        ids = frozenset(self.load(direction, user_id))
+        with self._lock:
+            self._put(key, version, ids)
+        return ids
+
+    def _drop(self, key):
+        # Appelée avec le verrou
+        entry = self._sets.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def _put(self, key, version, ids):
+        # Appelée avec le verrou
+        self._drop(key)
+        if len(ids) > self.max_ids:
+            return  # trop gros pour le cache : relu à chaque fois
+        self._sets[key] = (version, ids)
+        self._size += len(ids)
+        while self._size > self.max_ids:
+            _, (_, evicted) = self._sets.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def followed(self, user_id):
+        return self._get(FOLLOWED, user_id)
+
+    def followers(self, user_id):
+        return self._get(FOLLOWERS, user_id)
+
+    def is_following(self, user_id, other_id):
+        return other_id in self.followed(user_id)
+
+    def mutual(self, user_id):
+        """Ids des comptes que `user_id` suit et qui le suivent."""
+        return self.followed(user_id) & self.followers(user_id)
+
+    def suggestions(self, user_id, limit=10, fanout=50):
+        """Ids les plus suivis par les comptes que suit `user_id` (au plus `fanout` d'entre eux).
+
+        Renvoie une liste de (id, nombre de comptes suivis qui le suivent), du plus fréquent au moins fréquent.
+        """
+        followed = self.followed(user_id)
+        counts = Counter()
+        for other_id in sorted(followed)[:fanout]:
+            counts.update(self.followed(other_id))
+        for excluded in followed | {user_id}:
+            counts.pop(excluded, None)
+        return counts.most_common(limit)
+
+    def apply(self, user_id, other_id, following):
+        """Enregistre un follow (ou unfollow) validé : ensembles locaux mis à jour, versions publiées."""
+        for direction, owner, member in ((FOLLOWED, user_id, other_id), (FOLLOWERS, other_id, user_id)):
+            # Version et ensemble changés ensemble : deux apply() concurrents ne perdent pas de membre
+            with self._lock:
+                generation = self.versions.get(ALL)
+                version = self._bump(direction, owner)
+                entry = self._sets.get((direction, owner))
+                if entry is None:
+                    continue
+                if entry[0] != (generation, version - 1):
+                    # Un autre worker a écrit depuis le chargement : l'ensemble local est
+                    # périmé, le corriger et le publier sous la nouvelle version le figerait
+                    self._drop((direction, owner))
+                    continue
+                ids = entry[1] | {member} if following else entry[1] - {member}
+                self._put((direction, owner), (generation, version), ids)
+
+    def invalidate(self, *user_ids):
+        """Oublie les ensembles des utilisateurs donnés, dans ce processus et dans les autres."""
+        for user_id in user_ids:
+            with self._lock:
+                for direction in (FOLLOWED, FOLLOWERS):
+                    self._bump(direction, user_id)
+                    self._drop((direction, user_id))
+
+    def invalidate_all(self):
+        """Oublie tous les ensembles, dans ce processus et dans les autres, en une seule écriture."""
+        with self._lock:
+            self.versions.bump(ALL)
+            self._sets.clear()
+            self._size = 0
+
+    def clear(self):
+        with self._lock:
+            self._sets.clear()
+            self._size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'sets': len(self._sets), 'ids': self._size}
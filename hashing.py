@@ -0,0 +1,85 @@
+"""Hachage des mots de passe hors du thread de la requête.
+
+Le calcul (scrypt / pbkdf2) est envoyé à un pool de processus borné : il s'exécute en
+parallèle sur tous les cœurs et ne garde pas le GIL du worker qui sert les autres routes.
+Les processus du pool ne sont pas créés par fork : le worker a déjà des threads, et un fork
+pendant qu'un autre thread tient un verrou (logging, pool SQLAlchemy) peut bloquer l'enfant.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasher:
+    """Hache et vérifie les mots de passe avec la méthode configurée.
+
+    executor='process' : pool de `workers` processus, au plus `max_pending` calculs en cours ;
+    executor='inline'  : calcul dans le thread appelant (tests, outils en ligne de commande).
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', executor='process', workers=None, max_pending=None, timeout=10):
+        self.method = method
+        self.executor = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = None
+        self._slots = None
+        self._method_prefix = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            method=config['PASSWORD_HASH_METHOD'],
+            executor=config['PASSWORD_HASH_EXECUTOR'],
+            workers=config['PASSWORD_HASH_WORKERS'],
+            max_pending=config['PASSWORD_HASH_MAX_PENDING'],
+        )
+
+    def _run(self, function, *args):
+        if self.executor == 'inline':
+            return function(*args)
+        with self._lock:
+            if self._pool is None:
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(start_method))
+                # Borne la file d'attente : au-delà, les requêtes attendent un créneau
+                self._slots = threading.BoundedSemaphore(self.max_pending or self._pool._max_workers * 4)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError('Trop de hachages de mot de passe en attente')
+        try:
+            return self._pool.submit(function, *args).result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, stored_hash):
+        """Vrai si `stored_hash` a été calculé avec d'autres paramètres que ceux configurés."""
+        if self._method_prefix is None:
+            # 'scrypt' -> 'scrypt:32768:8:1' : on laisse werkzeug compléter les paramètres par défaut
+            self._method_prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return stored_hash.split('$', 1)[0] != self._method_prefix
+
+    def verify(self, stored_hash, password):
+        """Vérifie `password` ; renvoie (valide, nouveau_hash).
+
+        nouveau_hash n'est pas None quand le mot de passe est valide mais que son hash
+        utilise des paramètres dépassés : l'appelant doit alors l'enregistrer.
+        """
+        if not self._run(check_password_hash, stored_hash, password):
+            return False, None
+        if self.needs_rehash(stored_hash):
+            return True, self.hash(password)
+        return True, None
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,211 @@
+"""File de tâches durable (table job) pour le travail secondaire des écritures.
+
+Une route met une tâche en file dans sa propre transaction (enqueue) : la tâche est validée
+avec l'écriture qui l'a créée, ou pas du tout. Après le commit, un thread du processus la
+prend en charge et la route répond sans attendre. Chaque tâche s'exécute dans sa propre
+transaction, marquage 'done' compris : un échec annule tout et la tâche est reprogrammée
+avec un délai croissant, jusqu'à `max_attempts` essais, puis marquée 'failed'.
+
+Les tâches sont réservées par un UPDATE : plusieurs workers (processus de serve.py ou
+`flask --app app run-jobs`) se partagent la file sans exécuter deux fois la même tâche. Une
+tâche restée 'running' plus de `timeout` secondes (worker arrêté en cours de route) est reprise.
+
+mode='thread' : thread démarré avec le worker web (start), réveillé après chaque commit qui a
+mis des tâches en file et sinon toutes les `poll_interval` secondes ;
+mode='inline' : tâches exécutées en fin de requête, dans le thread de la requête (tests, outils).
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Exécute les tâches de la table job avec `handlers[kind](**payload)`.
+
+    Un gestionnaire peut renvoyer une fonction sans argument, appelée après le commit de la
+    tâche (invalidation de cache...).
+    """
+
+    def __init__(self, app, handlers, mode='thread', poll_interval=1.0, max_attempts=5,
+                 retry_delay=2.0, timeout=300, batch_size=20, keep_done=86400):
+        self.app = app
+        self.handlers = handlers
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.keep_done = keep_done
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._due = False
+        self._last_purge = 0.0
+        self.processed = self.failures = 0
+
+    @classmethod
+    def from_config(cls, app, handlers):
+        config = app.config
+        return cls(
+            app, handlers,
+            mode=config['JOB_MODE'],
+            poll_interval=config['JOB_POLL_INTERVAL'],
+            max_attempts=config['JOB_MAX_ATTEMPTS'],
+            retry_delay=config['JOB_RETRY_DELAY'],
+            timeout=config['JOB_TIMEOUT'],
+            batch_size=config['JOB_BATCH_SIZE'],
+            keep_done=config['JOB_KEEP_DONE'],
+        )
+
+    def enqueue(self, kind, payload, key=None, delay=0):
+        """Ajoute une tâche à la transaction en cours (sans commit). Ignorée si `key` est déjà en file."""
+        if kind not in self.handlers:
+            raise ValueError(f'Tâche inconnue : {kind}')
+        now = time.time()
+        db.session.execute(sqlite_insert(Job).values(
+            kind=kind, payload=json.dumps(payload, sort_keys=True), idempotency_key=key,
+            status='pending', attempts=0, created_at=now, run_at=now + delay,
+        ).on_conflict_do_nothing())
+        db.session.info['jobs_enqueued'] = True
+
+    def notify(self):
+        """Appelée après le commit d'une transaction qui a mis des tâches en file."""
+        if self.mode == 'inline':
+            self._due = True
+            return
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        """Mode thread : démarre le worker s'il ne tourne pas encore ; sans effet sinon.
+
+        Le premier relevé a lieu tout de suite : les tâches laissées en attente ou différées par
+        un processus précédent sont reprises sans attendre qu'une nouvelle tâche soit mise en file.
+        Appelée à chaque requête, elle ne réveille pas un worker déjà démarré (seul notify le fait).
+        """
+        if self.mode != 'thread' or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop = False
+                self._thread = threading.Thread(target=self.work, name='job-queue', daemon=True)
+                self._thread.start()
+                self._wake.set()
+
+    def run_due(self):
+        """Mode inline : exécute les tâches mises en file depuis le dernier appel."""
+        if self._due:
+            self._due = False
+            self.run_pending()
+
+    # ------------------ EXÉCUTION ------------------
+    def claim(self, limit):
+        """Réserve au plus `limit` tâches prêtes (ou abandonnées) ; renvoie leurs ids.
+
+        Les ids prêts sont d'abord lus : une file vide ne coûte qu'un SELECT, sans transaction
+        d'écriture qui entrerait en concurrence avec les écritures des requêtes.
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        claimable = db.or_(
+            db.and_(Job.status == 'pending', Job.run_at <= now),
+            db.and_(Job.status == 'running', Job.started_at < now - self.timeout),
+        )
+        ready = db.session.execute(
+            db.select(Job.id).where(claimable).order_by(Job.run_at).limit(limit)
+        ).scalars().all()
+        if not ready:
+            db.session.rollback()  # referme la transaction de lecture
+            return []
+        # Un autre worker a pu réserver certains de ces ids entre-temps : on revérifie l'état
+        db.session.execute(
+            db.update(Job).where(Job.id.in_(ready), claimable)
+            .values(status='running', claimed_by=token, started_at=now, attempts=Job.attempts + 1)
+        )
+        db.session.commit()
+        return db.session.execute(
+            db.select(Job.id).where(Job.claimed_by == token, Job.status == 'running').order_by(Job.run_at)
+        ).scalars().all()
+
+    def run_pending(self, limit=None):
+        """Exécute les tâches prêtes (au plus `limit`, sinon `batch_size`) ; renvoie leur nombre."""
+        ids = self.claim(limit or self.batch_size)
+        for job_id in ids:
+            self.run_job(db.session.get(Job, job_id))
+        return len(ids)
+
+    def run_job(self, job):
+        job_id, kind, payload, attempts = job.id, job.kind, json.loads(job.payload), job.attempts
+        try:
+            after_commit = self.handlers[kind](**payload)
+            job.status = 'done'
+            job.last_error = None
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            self.failures += 1
+            failed = attempts >= self.max_attempts
+            logger.warning('Tâche %s (%s) en échec, essai %d/%d : %r', job_id, kind, attempts, self.max_attempts, exc)
+            db.session.execute(db.update(Job).where(Job.id == job_id).values(
+                status='failed' if failed else 'pending',
+                run_at=time.time() + self.retry_delay * 2 ** (attempts - 1),
+                last_error=repr(exc),
+            ))
+            db.session.commit()
+            return False
+        self.processed += 1
+        if after_commit is not None:
+            after_commit()
+        return True
+
+    def purge(self):
+        """Supprime les tâches terminées depuis plus de `keep_done` secondes."""
+        db.session.execute(db.delete(Job).where(Job.status == 'done', Job.created_at < time.time() - self.keep_done))
+        db.session.commit()
+
+    def work(self):
+        """Boucle du worker : attend un réveil (ou `poll_interval`) puis vide la file."""
+        while not self._stop:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while not self._stop and self.run_pending() == self.batch_size:
+                        pass
+                    if time.time() - self._last_purge > 60:
+                        self._last_purge = time.time()
+                        self.purge()
+            except Exception:
+                # Base verrouillée, table absente... : on réessaie au prochain réveil
+                logger.exception('Erreur du worker de tâches')
+
+    def shutdown(self):
+        """Arrête le thread après la tâche en cours ; les tâches restantes restent en file."""
+        with self._lock:
+            if self._thread is not None:
+                self._stop = True
+                self._wake.set()
+                self._thread.join()
+                self._thread = None
+
+    def stats(self):
+        """Profondeur de la file, retard de la plus ancienne tâche prête (secondes), échecs."""
+        now = time.time()
+        pending, oldest, failed = db.session.execute(db.select(
+            func.count(Job.id).filter(Job.status == 'pending'),
+            func.min(Job.run_at).filter(Job.status == 'pending', Job.run_at <= now),
+            func.count(Job.id).filter(Job.status == 'failed'),
+        )).one()
+        return {'pending': pending, 'lag': now - oldest if oldest is not None else 0.0, 'failed': failed,
+                'processed': self.processed, 'failures': self.failures}
@@ -0,0 +1,107 @@
+"""Écriture groupée des likes : plusieurs clics partagent une même transaction.
+
+Sous SQLite un seul écrivain à la fois : avec un commit par clic, les likes d'un post très
+populaire passent l'un après l'autre. En mode 'batched', les événements sont mis en file et
+un thread les applique par lots, au plus toutes les `interval` secondes : un seul commit et
+une seule mise à jour du compteur par post pour tout le lot. L'appelant attend le commit de
+son lot et reçoit l'état final de son like, comme en écriture directe.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class LikeWriter:
+    """Applique des événements (type, user_id, id de la cible, liked) avec `apply(events)`.
+
+    `apply` reçoit une liste d'événements, les applique et les valide dans une transaction,
+    et renvoie l'état final (liké ou non) de chacun. liked=None bascule le like.
+    mode='batched' : file en mémoire vidée par un thread, `max_batch` événements au plus par lot ;
+    mode='inline'  : appliqué tout de suite dans le thread appelant (tests, outils).
+    """
+
+    def __init__(self, apply, mode='inline', interval=0.005, max_batch=500, timeout=10):
+        self.apply = apply
+        self.mode = mode
+        self.interval = interval
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = self.events = 0
+
+    @classmethod
+    def from_config(cls, config, apply):
+        return cls(
+            apply,
+            mode=config['LIKE_WRITE_MODE'],
+            interval=config['LIKE_BATCH_INTERVAL'],
+            max_batch=config['LIKE_BATCH_MAX'],
+        )
+
+    def submit(self, kind, user_id, target_id, liked=None):
+        """Enregistre un like (liked=True), un retrait (False) ou une bascule (None) ; renvoie l'état final."""
+        event = (kind, user_id, target_id, liked)
+        if self.mode == 'inline':
+            return self.apply([event])[0]
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='like-writer', daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((event, future))
+        return future.result(timeout=self.timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Le premier événement attend au plus `interval` que d'autres le rejoignent
+            deadline = time.monotonic() + self.interval
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch):
+        try:
+            results = self.apply([event for event, _ in batch])
+        except Exception:
+            # Un événement en échec (utilisateur supprimé, base verrouillée...) ne fait pas échouer les autres
+            for event, future in batch:
+                try:
+                    future.set_result(self.apply([event])[0])
+                except Exception as exc:
+                    future.set_exception(exc)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        self.batches += 1
+        self.events += len(batch)
+
+    def shutdown(self):
+        """Applique les événements en attente puis arrête le thread."""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def stats(self):
+        return {'batches': self.batches, 'events': self.events}
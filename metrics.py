@@ -0,0 +1,230 @@
+"""Instrumentation des requêtes : nombre et durée des requêtes SQL, temps de rendu des templates.
+
+Les événements des moteurs SQLAlchemy et les hooks de Flask remplissent un relevé par requête
+HTTP (g.metrics). En fin de requête il s'ajoute aux totaux par endpoint, exposés au format
+texte de Prometheus sur /_metrics (adresses locales, ou jeton). Les totaux sont propres à
+chaque processus (un par worker).
+
+Pour une page envoyée en streaming, le relevé n'est clos qu'après le dernier morceau : les
+requêtes SQL faites pendant le rendu y sont comptées. L'en-tête Server-Timing, envoyé avant
+le corps, ne couvre alors que le travail fait avant le premier octet.
+"""
+import heapq
+import hmac
+import logging
+import os
+import threading
+import time
+
+import sqlalchemy as sa
+from flask import abort, g, has_app_context, request
+from flask.signals import before_render_template, template_rendered
+from markupsafe import escape
+
+
+class RequestRecord:
+    """Relevé d'une requête HTTP."""
+
+    def __init__(self, endpoint, method, keep):
+        self.endpoint = endpoint or 'none'
+        self.method = method
+        self.keep = keep
+        self.start = time.perf_counter()
+        self.status = 500
+        self.streaming = False
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.slowest = []  # tas (durée, requête) des `keep` requêtes les plus lentes
+        self._render_start = None
+
+    def add_query(self, statement, duration):
+        self.queries += 1
+        self.sql_time += duration
+        item = (duration, statement)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, item)
+        elif item > self.slowest[0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def summary(self):
+        return (f'{self.queries} requêtes SQL en {self.sql_time * 1000:.1f} ms, '
+                f'rendu {self.render_time * 1000:.1f} ms, total {(time.perf_counter() - self.start) * 1000:.1f} ms')
+
+
+class Metrics:
+    """Totaux par endpoint depuis le démarrage du processus, et requêtes les plus lentes."""
+
+    def __init__(self, keep=5, slow_query_ms=None, logger=None):
+        self.keep = keep
+        self.slow_query_ms = slow_query_ms
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.requests = {}   # (endpoint, méthode, statut) -> nombre
+        self.endpoints = {}  # endpoint -> [durée, requêtes SQL, durée SQL, rendu, max requêtes SQL]
+        self.slowest = []    # tas (durée, requête, endpoint)
+        self.gauges = []     # (nom, aide, fonction qui lit la valeur au moment de l'export)
+
+    def record(self, record):
+        duration = time.perf_counter() - record.start
+        with self._lock:
+            key = (record.endpoint, record.method, record.status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            totals = self.endpoints.setdefault(record.endpoint, [0.0, 0, 0.0, 0.0, 0])
+            totals[0] += duration
+            totals[1] += record.queries
+            totals[2] += record.sql_time
+            totals[3] += record.render_time
+            totals[4] = max(totals[4], record.queries)
+            for query_duration, statement in record.slowest:
+                item = (query_duration, statement, record.endpoint)
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, item)
+                elif item > self.slowest[0]:
+                    heapq.heapreplace(self.slowest, item)
+
+    def add_gauge(self, name, help_text, read):
+        """Ajoute à /_metrics une valeur lue par `read()` à chaque export (état d'un service)."""
+        self.gauges.append((name, help_text, read))
+
+    def query_done(self, statement, duration):
+        record = g.get('metrics') if has_app_context() else None
+        if record is not None:
+            record.add_query(statement, duration)
+        if self.slow_query_ms is not None and duration * 1000 >= self.slow_query_ms:
+            endpoint = record.endpoint if record is not None else '-'
+            self.logger.warning('Requête lente (%.1f ms) sur %s : %s', duration * 1000, endpoint, ' '.join(statement.split()))
+
+    def prometheus(self):
+        """Totaux au format texte de Prometheus."""
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+        with self._lock:
+            requests = sorted(self.requests.items())
+            endpoints = sorted((name, list(totals)) for name, totals in self.endpoints.items())
+            slowest = sorted(self.slowest, reverse=True)
+        lines = ['# HELP app_requests_total Requêtes HTTP servies.', '# TYPE app_requests_total counter']
+        lines += [f'app_requests_total{{endpoint="{label(e)}",method="{m}",status="{s}"}} {n}'
+                  for (e, m, s), n in requests]
+        series = [
+            ('app_request_duration_seconds_total', 'Temps passé dans les requêtes HTTP.', 0, 'counter'),
+            ('app_sql_queries_total', 'Requêtes SQL exécutées.', 1, 'counter'),
+            ('app_sql_duration_seconds_total', 'Temps passé dans les requêtes SQL.', 2, 'counter'),
+            ('app_template_render_seconds_total', 'Temps de rendu des templates (SQL du streaming compris).', 3, 'counter'),
+            ('app_sql_queries_per_request_max', 'Plus grand nombre de requêtes SQL pour une requête HTTP.', 4, 'gauge'),
+        ]
+        for name, help_text, index, kind in series:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{{endpoint="{label(e)}"}} {totals[index]:g}' for e, totals in endpoints]
+        lines += ['# HELP app_slowest_sql_seconds Requêtes SQL les plus lentes depuis le démarrage.',
+                  '# TYPE app_slowest_sql_seconds gauge']
+        lines += [f'app_slowest_sql_seconds{{endpoint="{label(e)}",statement="{label(" ".join(s.split()))}"}} {d:.6f}'
+                  for d, s, e in slowest]
+        for name, help_text, read in self.gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {read():g}']
+        return '\n'.join(lines) + '\n'
+
+
+def install_metrics(app, engines):
+    """Branche l'instrumentation sur `app` et les moteurs donnés ; renvoie l'objet Metrics.
+
+    Réglages : METRICS_SLOWEST, METRICS_SLOW_QUERY_MS (None désactive le journal des requêtes
+    lentes), METRICS_SLOW_QUERY_LOG (fichier, sinon le logger de l'application),
+    METRICS_HEADER (en-tête Server-Timing), METRICS_DEBUG_FOOTER (relevé en bas des pages HTML),
+    METRICS_ALLOWED_ADDRS et METRICS_TOKEN (accès à /_metrics).
+    """
+    logger = app.logger
+    if app.config['METRICS_SLOW_QUERY_LOG']:
+        # Logger global au processus : un seul fichier ouvert, même après plusieurs create_app()
+        logger = logging.getLogger('slow_queries')
+        path = os.path.abspath(app.config['METRICS_SLOW_QUERY_LOG'])
+        if not any(getattr(handler, 'baseFilename', None) == path for handler in logger.handlers):
+            logger.addHandler(logging.FileHandler(path))
+        logger.setLevel(logging.WARNING)
+    metrics = Metrics(app.config['METRICS_SLOWEST'], app.config['METRICS_SLOW_QUERY_MS'], logger)
+
+    for engine in engines:
+        if engine is None:
+            continue
+
+        @sa.event.listens_for(engine, 'before_cursor_execute')
+        def query_start(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+        @sa.event.listens_for(engine, 'after_cursor_execute')
+        def query_end(conn, cursor, statement, parameters, context, executemany):
+            metrics.query_done(statement, time.perf_counter() - conn.info['query_start'].pop())
+
+    @before_render_template.connect_via(app)
+    def render_start(sender, template, context, **extra):
+        record = g.get('metrics')
+        if record is not None:
+            record._render_start = time.perf_counter()
+
+    @template_rendered.connect_via(app)
+    def render_end(sender, template, context, **extra):
+        record = g.get('metrics')
+        if record is not None and record._render_start is not None:
+            record.render_time += time.perf_counter() - record._render_start
+            record._render_start = None
+
+    @app.before_request
+    def start_record():
+        g.metrics = RequestRecord(request.endpoint, request.method, metrics.keep)
+
+    @app.after_request
+    def report(response):
+        record = g.get('metrics')
+        if record is None:
+            return response
+        record.status = response.status_code
+        if app.config['METRICS_HEADER']:
+            response.headers['Server-Timing'] = (
+                f'sql;dur={record.sql_time * 1000:.1f};desc="{record.queries} requetes", '
+                f'render;dur={record.render_time * 1000:.1f}')
+        footer = app.config['METRICS_DEBUG_FOOTER'] and response.mimetype == 'text/html'
+        if response.is_streamed:
+            # Le relevé est clos (et le pied de page écrit) après le dernier morceau
+            record.streaming = True
+            response.response = streamed(response.response, record, footer)
+        elif footer:
+            response.set_data(response.get_data() + debug_footer(record).encode())
+        return response
+
+    def streamed(chunks, record, footer):
+        try:
+            yield from chunks
+            if footer:
+                yield debug_footer(record)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            metrics.record(record)
+
+    @app.teardown_request
+    def close_record(exc):
+        record = g.get('metrics')
+        if record is not None and not record.streaming:
+            g.pop('metrics')
+            metrics.record(record)
+
+    @app.route('/_metrics')
+    def prometheus_metrics():
+        # 404 plutôt que 403 : l'endpoint n'existe pas pour qui n'y a pas accès
+        token = app.config['METRICS_TOKEN']
+        if token:
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                abort(404)
+        elif app.config['METRICS_ALLOWED_ADDRS'] is not None and request.remote_addr not in app.config['METRICS_ALLOWED_ADDRS']:
+            abort(404)
+        return metrics.prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    return metrics
+
+
+def debug_footer(record):
+    rows = ''.join(f'<li>{duration * 1000:.1f} ms : <code>{escape(" ".join(statement.split()))}</code></li>'
+                   for duration, statement in sorted(record.slowest, reverse=True))
+    return (f'<div class="debug-metrics" style="font-size: 0.8rem; padding: 10px;">'
+            f'<b>{escape(record.endpoint)}</b> : {record.summary()}<ol>{rows}</ol></div>')
@@ -0,0 +1,225 @@
+"""Modèles de la base et objet SQLAlchemy, sans application.
+
+`db` est lié à une application par create_app() (app.py) : importer ce module ne crée
+aucune connexion ni aucune table.
+"""
+from datetime import datetime
+
+import pytz
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db_profiles import RoutingSession
+
+PARIS = pytz.timezone('Europe/Paris')
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def pending_follows():
+    """Follows / unfollows de la transaction en cours : (suiveur, suivi) -> suit."""
+    return db.session.info.setdefault('follow_changes', {})
+
+
+# ------------------ MODELES ------------------
+############follows
+followers = db.Table(
+    'followers',
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+)
+# La clé primaire sert les "qui je suis" ; cet index sert les "qui me suit" (fan-out, suppression)
+db.Index('ix_followers_followed', followers.c.followed_id, followers.c.follower_id)
+
+
+#############
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=False, nullable=False)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password = db.Column(db.String(80), nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    biography = db.Column(db.Text, nullable=True)  
+    # Compteurs dénormalisés, tenus à jour à l'écriture (voir refresh_counters)
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    posts = db.relationship('Post', backref='author', lazy=True)
+    
+    followed = db.relationship(
+        'User',
+        secondary=followers,
+        primaryjoin=(followers.c.follower_id == id),
+        secondaryjoin=(followers.c.followed_id == id),
+        backref=db.backref('followers', lazy='dynamic'),
+        lazy='dynamic'
+    )
+
+    # ------------------- Méthodes pour suivre / unfollow / vérifier -------------------
+    def follow(self, user):
+        """Suit `user` ; renvoie True si l'abonnement est nouveau.
+
+        Pas de vérification préalable : un abonnement déjà en base (double clic, autre worker)
+        est ignoré par l'INSERT au lieu de lever une IntegrityError.
+        """
+        if not db.session.execute(sqlite_insert(followers).values(
+                follower_id=self.id, followed_id=user.id).on_conflict_do_nothing()).rowcount:
+            return False
+        self.following_count = User.following_count + 1
+        user.followers_count = User.followers_count + 1
+        pending_follows()[(self.id, user.id)] = True
+        return True
+
+    def unfollow(self, user):
+        """Ne suit plus `user` ; renvoie True si un abonnement a été supprimé."""
+        if not db.session.execute(followers.delete().where(
+                followers.c.follower_id == self.id, followers.c.followed_id == user.id)).rowcount:
+            return False
+        self.following_count = User.following_count - 1
+        user.followers_count = User.followers_count - 1
+        pending_follows()[(self.id, user.id)] = False
+        return True
+
+    def is_following(self, user):
+        # Changements pas encore validés de la transaction en cours, sinon le graphe en mémoire
+        pending = pending_follows()
+        if (self.id, user.id) in pending:
+            return pending[(self.id, user.id)]
+        return current_app.extensions['follow_graph'].is_following(self.id, user.id)
+
+    def __repr__(self):
+        return f'<User {self.username}>'
+
+
+#######POSTS ET LIKES
+class Post(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    content = db.Column(db.String(255), nullable=False)
+    date_posted = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
+    likes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    likes = db.relationship('Like', backref='post', lazy=True)
+    comments = db.relationship('Comment', backref='post', lazy=True)
+
+    # Index couvrant le profil et le fil : WHERE user_id ... ORDER BY date_posted DESC, id DESC
+    __table_args__ = (
+        db.Index('ix_post_user_date', 'user_id', 'date_posted', 'id'),
+        db.Index('ix_post_date', 'date_posted', 'id'),
+    )
+    
+
+
+class Like(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    date_liked = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
+
+    # Un utilisateur ne peut liker un post qu'une seule fois
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='unique_like'),
+        db.Index('ix_like_post', 'post_id'),
+    )
+##########
+
+
+
+#######COMMENTAIRES
+class Comment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    content = db.Column(db.String(255), nullable=False)
+    date_posted = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
+    
+    likes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Relation vers l'auteur
+    author = db.relationship('User', backref='comments', lazy=True)
+    
+    likes = db.relationship('CommentLike', backref='comment', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_comment_post', 'post_id', 'id'),
+        db.Index('ix_comment_user', 'user_id'),
+    )
+
+class CommentLike(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    comment_id = db.Column(db.Integer, db.ForeignKey('comment.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date_liked = db.Column(db.DateTime, default=lambda: datetime.now(PARIS))
+
+    # Un utilisateur ne peut liker un commentaire qu'une seule fois.
+    # Index unique plutôt que contrainte : SQLite ne sait pas ajouter une contrainte à une table existante.
+    __table_args__ = (
+        db.Index('unique_comment_like', 'user_id', 'comment_id', unique=True),
+        db.Index('ix_comment_like_comment', 'comment_id'),
+    )
+##############
+
+
+#######FIL PRÉCALCULÉ (mode push)
+class TimelineEntry(db.Model):
+    # Boîte de réception du fil : une ligne par (lecteur, post d'un compte suivi)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    date_posted = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_timeline_user_date', 'user_id', 'date_posted', 'post_id'),
+        db.Index('ix_timeline_post', 'post_id'),
+    )
+##############
+
+
+#######NOTIFICATIONS
+class Notification(db.Model):
+    # Une ligne par (destinataire, type, cible) : les événements s'y cumulent (« 12 personnes ont aimé... »)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # destinataire
+    kind = db.Column(db.String(20), nullable=False)   # like_post, comment, like_comment, follow
+    target_id = db.Column(db.Integer, nullable=False)  # post, commentaire, ou 0 pour un follow
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=True)  # post à afficher (lien)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # dernier auteur d'un événement
+    count = db.Column(db.Integer, nullable=False, default=1)  # événements cumulés
+    unread = db.Column(db.Boolean, nullable=False, default=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(PARIS))
+    actor = db.relationship('User', foreign_keys=[actor_id])
+    post = db.relationship('Post')
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'kind', 'target_id', name='uq_notification_target'),
+        db.Index('ix_notification_user_date', 'user_id', 'updated_at', 'id'),
+        db.Index('ix_notification_post', 'post_id'),
+    )
+
+
+class NotificationInbox(db.Model):
+    # Nombre de notifications non lues, lu par clé primaire à chaque page
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+##############
+
+
+#######FILE DE TÂCHES (voir jobs.py)
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # arguments du gestionnaire, en JSON
+    # Deux mises en file avec la même clé ne créent qu'une tâche
+    idempotency_key = db.Column(db.String(120), nullable=True, unique=True)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Horodatages en secondes depuis l'epoch : le retard de la file se calcule sans conversion
+    created_at = db.Column(db.Float, nullable=False)
+    run_at = db.Column(db.Float, nullable=False)   # pas avant (nouvel essai différé)
+    started_at = db.Column(db.Float, nullable=True)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_ready', 'status', 'run_at'),
+    )
+##############
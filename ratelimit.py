@@ -0,0 +1,203 @@
+"""Limitation de débit par seaux à jetons : par utilisateur, par IP et par classe de routes.
+
+Une règle (n, période) est un seau de n jetons qui se remplit de n jetons par période : une
+rafale de n requêtes passe, puis une requête toutes les période / n secondes. Une requête
+prend un jeton dans chacun de ses seaux (utilisateur connecté, IP), ou dans aucun si l'un
+d'eux est vide : elle reçoit alors une réponse 429 avec l'en-tête Retry-After.
+
+Deux stores, même interface (take / clear / stats) : en mémoire, propre à un processus et
+borné en LRU, et SQLite, partagé par tous les workers d'une machine. Un seau oublié (évincé
+ou purgé) repart plein, comme un seau resté longtemps inutilisé.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, request, session
+
+
+def wait_time(levels, rules):
+    """Secondes avant qu'il y ait un jeton dans chaque seau (0 s'il y en a déjà un partout)."""
+    return max(((1 - level) / rate for level, (_, _, rate) in zip(levels, rules) if level < 1), default=0.0)
+
+
+class MemoryBuckets:
+    """Seaux en mémoire : lecture et mise à jour en O(1), au plus `max_keys` seaux (LRU)."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # clé -> (jetons, horodatage de la dernière prise)
+        self._lock = threading.Lock()
+        self.allowed = self.denied = self.evictions = 0
+
+    def take(self, rules):
+        """`rules` : [(clé, capacité, jetons par seconde)] ; renvoie 0 si un jeton a été pris, sinon l'attente."""
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, capacity, rate in rules:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+            wait = wait_time(levels, rules)
+            if wait:
+                self.denied += 1
+                return wait
+            for (key, _, _), level in zip(rules, levels):
+                self._buckets[key] = (level - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+            self.allowed += 1
+            return 0.0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self):
+        return {'allowed': self.allowed, 'denied': self.denied, 'evictions': self.evictions, 'keys': len(self._buckets)}
+
+
+class SQLiteBuckets:
+    """Seaux stockés dans un fichier SQLite, partagés par tous les workers d'une machine."""
+
+    def __init__(self, path, max_keys=100_000, cleanup_every=1000):
+        self.path = path
+        self.max_keys = max_keys
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._takes = 0
+        self.allowed = self.denied = self.evictions = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        # full_at : instant où le seau sera de nouveau plein, et donc inutile à garder
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_rate_limit_full_at ON rate_limit (full_at)')
+
+    def _connection(self):
+        # Une connexion par thread, en mode WAL, comme le cache de pages partagé
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, rules):
+        now = time.time()
+        conn = self._connection()
+        # BEGIN IMMEDIATE : lecture et écriture des seaux sans qu'un autre worker s'intercale
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            keys = [key for key, _, _ in rules]
+            stored = {key: (tokens, updated) for key, tokens, updated in conn.execute(
+                f'SELECT key, tokens, updated FROM rate_limit WHERE key IN ({", ".join("?" * len(keys))})', keys)}
+            levels = []
+            for key, capacity, rate in rules:
+                tokens, updated = stored.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + max(now - updated, 0) * rate))
+            wait = wait_time(levels, rules)
+            if not wait:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO rate_limit (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                    [(key, level - 1, now, now + (capacity - level + 1) / rate)
+                     for (key, capacity, rate), level in zip(rules, levels)])
+            self._takes += 1
+            if self._takes % self.cleanup_every == 0:
+                self._cleanup(conn, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if wait:
+            self.denied += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def _cleanup(self, conn, now):
+        conn.execute('DELETE FROM rate_limit WHERE full_at < ?', (now,))
+        overflow = conn.execute('SELECT COUNT(*) FROM rate_limit').fetchone()[0] - self.max_keys
+        if overflow > 0:
+            conn.execute(
+                'DELETE FROM rate_limit WHERE key IN (SELECT key FROM rate_limit ORDER BY updated LIMIT ?)', (overflow,))
+            self.evictions += overflow
+
+    def clear(self):
+        self._connection().execute('DELETE FROM rate_limit')
+
+    def stats(self):
+        keys = self._connection().execute('SELECT COUNT(*) FROM rate_limit').fetchone()[0]
+        return {'allowed': self.allowed, 'denied': self.denied, 'evictions': self.evictions, 'keys': keys}
+
+
+class NullBuckets:
+    """Limitation désactivée : tout passe."""
+
+    def take(self, rules):
+        return 0.0
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'allowed': 0, 'denied': 0, 'evictions': 0, 'keys': 0}
+
+
+def make_buckets(config):
+    """Construit le store choisi par RATE_LIMIT_BACKEND ('memory', 'sqlite' ou 'none')."""
+    backend = config['RATE_LIMIT_BACKEND']
+    if backend == 'memory':
+        return MemoryBuckets(config['RATE_LIMIT_MAX_KEYS'])
+    if backend == 'sqlite':
+        return SQLiteBuckets(config['RATE_LIMIT_PATH'], config['RATE_LIMIT_MAX_KEYS'])
+    if backend == 'none':
+        return NullBuckets()
+    raise ValueError(f'RATE_LIMIT_BACKEND inconnu : {backend}')
+
+
+def install_rate_limits(app):
+    """Limite les endpoints de `app` listés dans RATE_LIMIT_ENDPOINTS ; renvoie le store.
+
+    RATE_LIMIT_ENDPOINTS associe un endpoint à une classe de routes, RATE_LIMITS donne pour
+    chaque classe les règles 'user' et 'ip' : (nombre de requêtes, période en secondes), et
+    éventuellement 'methods', les seules méthodes HTTP limitées.
+    """
+    buckets = make_buckets(app.config)
+
+    @app.before_request
+    def rate_limit():
+        route_class = app.config['RATE_LIMIT_ENDPOINTS'].get(request.endpoint)
+        if route_class is None:
+            return None
+        limit = app.config['RATE_LIMITS'][route_class]
+        if request.method not in limit.get('methods', (request.method,)):
+            return None
+        identities = {'user': session.get('user_id'), 'ip': request.remote_addr}
+        rules = []
+        for scope in ('user', 'ip'):
+            if scope in limit and identities[scope] is not None:
+                count, period = limit[scope]
+                rules.append((f'{route_class}:{scope}:{identities[scope]}', count, count / period))
+        wait = buckets.take(rules) if rules else 0
+        if not wait:
+            return None
+        message = f'Trop de requêtes, réessayez dans {math.ceil(wait)} s.'
+        if request.path.startswith('/api/'):
+            response = jsonify({'error': message})
+        else:
+            response = app.response_class(message, mimetype='text/plain')
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response
+
+    return buckets
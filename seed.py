@@ -0,0 +1,155 @@
+"""Générateur de données de test : utilisateurs, abonnements en loi de puissance, posts, likes, commentaires.
+
+Usage : python seed.py [nb_utilisateurs] [posts_par_utilisateur] [base]
+
+`base` vaut users.db par défaut (dans instance/, comme l'application) ; ':memory:' ne sert qu'à
+mesurer le temps de génération. Tous les comptes ont le mot de passe 'motdepasse'.
+
+Les lignes sont insérées par lots avec des INSERT SQLAlchemy Core, sans objets ORM : les dates
+sont fournies, aucune valeur par défaut n'est calculée en Python ligne par ligne. Les compteurs
+dénormalisés, l'index de recherche et, en mode push, les fils précalculés sont reconstruits à la fin.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+WORDS = ['bonjour', 'soleil', 'campus', 'insa', 'projet', 'café', 'musique', 'sport', 'photo',
+         'voyage', 'examen', 'soirée', 'lyon', 'stage', 'code', 'python', 'week-end', 'concert']
+
+
+def insert_chunks(table, rows, chunk_size):
+    """Insère les lignes du générateur `rows` dans `table` (Table Core) par lots de `chunk_size`.
+
+    Renvoie le nombre de lignes insérées.
+    """
+    from app import db
+
+    connection = db.session.connection()
+    insert = table.insert()
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            connection.execute(insert, chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        connection.execute(insert, chunk)
+        total += len(chunk)
+    return total
+
+
+def seed(nb_users, posts_per_user=10, follows_per_user=20, likes_per_post=5, comments_per_post=2,
+         exponent=1.1, chunk_size=10000, rng_seed=0):
+    """Ajoute un graphe synthétique à la base courante (dans un contexte d'application).
+
+    Popularité en loi de puissance : l'utilisateur de rang r est choisi (suivi, auteur des likes
+    et des commentaires) avec un poids 1 / r**exponent. Les nombres de suivis, de posts, de likes
+    et de commentaires suivent une loi exponentielle autour des moyennes données.
+    Renvoie le nombre de lignes insérées par table.
+    """
+    from app import (app, db, password_hasher, PARIS, User, Post, Like, Comment, followers, refresh_counters,
+                     create_search_tables, drop_search_tables, uses_inbox, rebuild_timeline, follow_graph)
+
+    rng = random.Random(rng_seed)
+    first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    first_post = (db.session.query(db.func.max(Post.id)).scalar() or 0) + 1
+    user_ids = list(range(first_user, first_user + nb_users))
+
+    # Rangs de popularité mélangés : les comptes populaires ne sont pas les premiers ids
+    ranked = user_ids[:]
+    rng.shuffle(ranked)
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, nb_users + 1):
+        total += 1 / rank ** exponent
+        cum_weights.append(total)
+
+    def popular(k):
+        return rng.choices(ranked, cum_weights=cum_weights, k=k)
+
+    def draw(mean):
+        return int(rng.expovariate(1 / mean)) if mean else 0
+
+    def text(nb_words):
+        return ' '.join(rng.choices(WORDS, k=nb_words)).capitalize()
+
+    password = password_hasher.hash('motdepasse')
+    now = datetime.now(PARIS)  # comme les lignes écrites par l'application
+    counts = {}
+    start = time.perf_counter()
+
+    counts['user'] = insert_chunks(User.__table__, (
+        {'id': i, 'name': f'Utilisateur {i}', 'username': f'user{i}', 'password': password,
+         'email': f'user{i}@example.com', 'biography': text(8)}
+        for i in user_ids
+    ), chunk_size)
+
+    def follow_rows():
+        for user_id in user_ids:
+            followed = set(popular(min(draw(follows_per_user), nb_users - 1)))
+            followed.discard(user_id)
+            for followed_id in followed:
+                yield {'follower_id': user_id, 'followed_id': followed_id}
+
+    counts['followers'] = insert_chunks(followers, follow_rows(), chunk_size)
+
+    # Posts, likes et commentaires générés ensemble (les likes référencent les ids des posts),
+    # insérés dès qu'un lot de posts est plein pour garder une mémoire bornée
+    posts, likes, comments = [], [], []
+    counts.update(post=0, like=0, comment=0)
+
+    def flush():
+        for name, model, rows in (('post', Post, posts), ('like', Like, likes), ('comment', Comment, comments)):
+            counts[name] += insert_chunks(model.__table__, rows, chunk_size)
+            rows.clear()
+
+    post_id = first_post
+    for user_id in user_ids:
+        for _ in range(draw(posts_per_user)):
+            date_posted = now - timedelta(seconds=rng.randrange(90 * 24 * 3600))
+            posts.append({'id': post_id, 'user_id': user_id, 'content': text(rng.randint(3, 20)),
+                          'date_posted': date_posted})
+            date_liked = date_posted + timedelta(minutes=rng.randrange(1, 600))
+            for liker in set(popular(min(draw(likes_per_post), nb_users))):
+                likes.append({'user_id': liker, 'post_id': post_id, 'date_liked': date_liked})
+            for author in popular(draw(comments_per_post)):
+                comments.append({'post_id': post_id, 'user_id': author, 'content': text(rng.randint(2, 10)),
+                                 'date_posted': date_posted + timedelta(minutes=rng.randrange(1, 600))})
+            post_id += 1
+            if len(posts) >= chunk_size:
+                flush()
+    flush()
+
+    refresh_counters()
+    db.session.commit()
+    # Abonnements insérés sans passer par User.follow : ensembles en mémoire à relire
+    follow_graph.invalidate_all()
+    with db.engine.begin() as connection:
+        drop_search_tables(db.metadata, connection)
+        create_search_tables(db.metadata, connection)
+    if app.config['TIMELINE_MODE'] == 'push':
+        for user in User.query.filter(User.id >= first_user):
+            if uses_inbox(user):
+                rebuild_timeline(user)
+        db.session.commit()
+    counts['seconds'] = round(time.perf_counter() - start, 2)
+    return counts
+
+
+if __name__ == '__main__':
+    nb_users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    posts_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    database = sys.argv[3] if len(sys.argv) > 3 else 'users.db'
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('PASSWORD_HASH_EXECUTOR', 'inline')
+
+    from app import app, db  # noqa: E402
+
+    with app.app_context():
+        db.create_all()
+        counts = seed(nb_users, posts_per_user)
+    print(' | '.join(f'{name}: {value}' for name, value in counts.items()))
@@ -0,0 +1,61 @@
+"""Point d'entrée de production : l'application servie par gunicorn, plusieurs workers et threads.
+
+Usage : flask --app app upgrade-db   (avant le premier lancement)
+        python serve.py
+
+Réglages par variables d'environnement :
+    WEB_BIND     adresse d'écoute (défaut 0.0.0.0:5000)
+    WEB_WORKERS  nombre de processus (défaut : 2 x cœurs + 1)
+    WEB_THREADS  threads par processus (défaut 4)
+    WEB_TIMEOUT  secondes avant de relancer un worker bloqué (défaut 30)
+
+Défauts propres à ce point d'entrée :
+    DB_PROFILE=production, LIKE_WRITE_MODE=batched, TEMPLATE_PREWARM=1
+    avec plusieurs workers : CACHE_BACKEND=sqlite, RATE_LIMIT_BACKEND=sqlite, PASSWORD_HASH_WORKERS=1
+"""
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+def options(environ=os.environ):
+    workers = int(environ.get('WEB_WORKERS', 2 * os.cpu_count() + 1))
+    return {
+        'bind': environ.get('WEB_BIND', '0.0.0.0:5000'),
+        'workers': workers,
+        'threads': int(environ.get('WEB_THREADS', 4)),
+        'worker_class': 'gthread',
+        'timeout': int(environ.get('WEB_TIMEOUT', 30)),
+        # Pas de preload : chaque worker ouvre ses propres connexions SQLite après le fork
+        'preload_app': False,
+        'accesslog': '-',
+    }
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import create_app
+        app = create_app()
+        # Tâches en attente ou différées laissées par les workers précédents : reprises tout de suite
+        app.extensions['jobs'].start()
+        return app
+
+
+if __name__ == '__main__':
+    settings = options()
+    os.environ.setdefault('DB_PROFILE', 'production')
+    os.environ.setdefault('LIKE_WRITE_MODE', 'batched')
+    os.environ.setdefault('TEMPLATE_PREWARM', '1')
+    if settings['workers'] > 1:
+        os.environ.setdefault('CACHE_BACKEND', 'sqlite')
+        os.environ.setdefault('RATE_LIMIT_BACKEND', 'sqlite')
+        os.environ.setdefault('PASSWORD_HASH_WORKERS', '1')
+    Server(settings).run()
@@ -1,28 +1,15 @@
+import gzip
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
 import pytest
-from app import app, db, User, Post, Like, Comment, CommentLike
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from app import create_app, db, apply_like_batch, apply_like_events, User, Post, Like, Comment, CommentLike
 from werkzeug.security import generate_password_hash
 
-@pytest.fixture
-def client():
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
-            # Create a test user with a hashed password
-            hashed_password = generate_password_hash("testpassword", method='pbkdf2:sha256')
-            test_user = User(
-                name="Test User",
-                username="testuser",
-                password=hashed_password,  # Use the hashed password
-                email="test@example.com"
-            )
-            db.session.add(test_user)
-            db.session.commit()
-        yield client
-        with app.app_context():
-            db.drop_all()
-
 
 def test_register(client):
     # Test successful registration
@@ -34,7 +21,8 @@ def test_register(client):
     }, follow_redirects=True)
     assert response.status_code == 200
     # Check that the user is in the database
-    user = User.query.filter_by(username='newuser').first()
+    with client.application.app_context():
+        user = User.query.filter_by(username='newuser').first()
     assert user is not None
     # Check for the flash message
     # To check flashes, you need to access the session from the response context
@@ -55,7 +43,7 @@ def test_login(client):
         assert sess['username'] == 'testuser'
 
 
-def test_like_post(client):
+def test_like_post(app, client):
     # Log in first to establish a session
     client.post('/login', data={
         'username': 'testuser',
@@ -84,7 +72,7 @@ def test_like_post(client):
         like = Like.query.filter_by(user_id=user_id, post_id=post_id).first()
         assert like is not None
 
-def test_create_comment(client):
+def test_create_comment(app, client):
     # Log in first
     client.post('/login', data={
         'username': 'testuser',
@@ -111,3 +99,1241 @@ def test_create_comment(client):
     with app.app_context():
         comment = Comment.query.filter_by(content='My first comment!', post_id=post_id).first()
         assert comment is not None
+
+
+@contextmanager
+def recorded_queries(app):
+    # Enregistre les requêtes SQL émises dans le bloc
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def count_queries(client, url):
+    # Compte les requêtes SQL émises pendant un GET
+    with recorded_queries(client.application) as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def add_users(app, *usernames):
+    # Crée les utilisateurs (mot de passe `<username>password`) ; renvoie les ids de tous les utilisateurs
+    with app.app_context():
+        for username in usernames:
+            db.session.add(User(name=username.capitalize(), username=username, email=f'{username}@example.com',
+                                password=generate_password_hash(f'{username}password')))
+        db.session.commit()
+        return {user.username: user.id for user in User.query}
+
+
+def login(app, username):
+    # Nouveau client connecté en tant qu'un utilisateur créé par add_users
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': f'{username}password'})
+    return client
+
+
+def add_posts_with_comments(app, author_username, commenter_username, nb_posts):
+    with app.app_context():
+        author = User.query.filter_by(username=author_username).first()
+        commenter = User.query.filter_by(username=commenter_username).first()
+        for i in range(nb_posts):
+            post = Post(user_id=author.id, content=f'Post {i}')
+            db.session.add(post)
+            db.session.flush()
+            db.session.add(Like(user_id=commenter.id, post_id=post.id))
+            for j in range(3):
+                comment = Comment(post_id=post.id, user_id=commenter.id, content=f'Commentaire {j}')
+                db.session.add(comment)
+                db.session.flush()
+                db.session.add(CommentLike(user_id=author.id, comment_id=comment.id))
+        db.session.commit()
+
+
+def test_page_query_count_is_bounded(app, client, monkeypatch):
+    # On mesure le rendu, pas le cache de pages
+    from cache import NullCache
+    monkeypatch.setitem(app.extensions, 'response_cache', NullCache())
+    # Un seul lot par page : le nombre de requêtes ne dépend alors que du nombre de pages
+    monkeypatch.setitem(app.config, 'STREAM_BATCH_SIZE', app.config['POSTS_PER_PAGE'])
+    add_users(app, 'other')
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/follow/2')
+
+    add_posts_with_comments(app, 'other', 'testuser', 2)
+    client.get('/feed')  # charge les abonnements dans le graphe en mémoire
+    small = {url: count_queries(client, url) for url in ['/feed', '/user/other']}
+
+    add_posts_with_comments(app, 'other', 'testuser', 10)
+    large = {url: count_queries(client, url) for url in ['/feed', '/user/other']}
+
+    assert small == large
+
+
+def test_counters_follow_writes(app, client):
+    add_users(app, 'other')
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/create_post', data={'content': 'Post compté'})
+    client.post('/follow/2')
+    with app.app_context():
+        post = Post.query.filter_by(content='Post compté').first()
+        post_id = post.id
+    client.post(f'/like_post/{post_id}')
+    client.post(f'/comment/{post_id}', data={'content': 'Un commentaire'})
+    with app.app_context():
+        comment_id = Comment.query.filter_by(post_id=post_id).first().id
+    client.post(f'/like_comment/{comment_id}')
+
+    with app.app_context():
+        post = db.session.get(Post, post_id)
+        assert (post.likes_count, post.comments_count) == (1, 1)
+        assert db.session.get(Comment, comment_id).likes_count == 1
+        assert User.query.filter_by(username='testuser').first().following_count == 1
+        assert User.query.filter_by(username='other').first().followers_count == 1
+
+    client.post(f'/like_post/{post_id}')
+    client.post('/unfollow/2')
+    with app.app_context():
+        assert db.session.get(Post, post_id).likes_count == 0
+        assert User.query.filter_by(username='other').first().followers_count == 0
+
+
+def test_reconcile_counters_fixes_drift(app, client):
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/create_post', data={'content': 'Post dérivé'})
+    with app.app_context():
+        post = Post.query.filter_by(content='Post dérivé').first()
+        db.session.add(Like(user_id=post.user_id, post_id=post.id))
+        post.likes_count = 42
+        db.session.commit()
+        post_id = post.id
+
+    result = app.test_cli_runner().invoke(args=['reconcile-counters'])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert db.session.get(Post, post_id).likes_count == 1
+
+
+def test_cursor_pagination_walks_every_post_once(app, client, monkeypatch):
+    import re
+    from datetime import datetime as dt
+    monkeypatch.setitem(app.config, 'POSTS_PER_PAGE', 4)
+    with app.app_context():
+        user = User.query.filter_by(username='testuser').first()
+        # Plusieurs posts à la même date pour vérifier le départage par id
+        same_date = dt(2024, 1, 1, 12, 0)
+        for i in range(10):
+            db.session.add(Post(user_id=user.id, content=f'Page {i}', date_posted=same_date if i % 2 else dt(2024, 1, 1, i)))
+        db.session.commit()
+        expected = [p.id for p in Post.query.order_by(Post.date_posted.desc(), Post.id.desc())]
+
+    seen = []
+    url = '/user/testuser'
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        seen += [int(i) for i in re.findall(r'data-post-id="(\d+)"', html)]
+        match = re.search(r'href="(/user/testuser\?cursor=[^"]+)"', html)
+        url = match.group(1) if match else None
+    assert seen == expected
+
+    assert client.get('/user/testuser?cursor=pas-un-curseur').status_code == 400
+
+
+def test_push_timeline_fan_out_and_fallback(app, client, monkeypatch):
+    import re
+    from app import TimelineEntry
+    monkeypatch.setitem(app.config, 'TIMELINE_MODE', 'push')
+    monkeypatch.setitem(app.config, 'TIMELINE_INBOX_SIZE', 3)
+    monkeypatch.setitem(app.config, 'POSTS_PER_PAGE', 2)
+    add_users(app, 'other')
+
+    other = login(app, 'other')
+    other.post('/create_post', data={'content': 'Avant le follow'})
+
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/follow/2')
+    for i in range(4):
+        other.post('/create_post', data={'content': f'Après le follow {i}'})
+
+    with app.app_context():
+        # Boîte plafonnée à 3 entrées
+        assert TimelineEntry.query.filter_by(user_id=1).count() == 3
+
+    # Parcours complet du fil : la boîte puis la requête pull au-delà du plafond
+    seen, url = [], '/feed'
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        seen += re.findall(r'<p class="post-content">(.*?)</p>', html)
+        match = re.search(r'name="cursor" value="([^"]+)"', html)
+        url = f'/feed?cursor={match.group(1)}' if match else None
+    assert seen == [f'Après le follow {i}' for i in (3, 2, 1, 0)] + ['Avant le follow']
+
+    with app.app_context():
+        post_id = Post.query.filter_by(content='Après le follow 3').first().id
+    other.post(f'/delete_post/{post_id}')
+    client.post('/unfollow/2')
+    with app.app_context():
+        assert TimelineEntry.query.filter_by(post_id=post_id).count() == 0
+        assert TimelineEntry.query.filter_by(user_id=1).count() == 0
+
+
+def test_current_user_loaded_by_id_and_liked_ids(app, client):
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    with app.app_context():
+        user_id = User.query.filter_by(username='testuser').first().id
+    with client.session_transaction() as sess:
+        assert sess['user_id'] == user_id
+    client.post('/create_post', data={'content': 'Post liké'})
+    client.post('/create_post', data={'content': 'Post pas liké'})
+    with app.app_context():
+        post_id = Post.query.filter_by(content='Post liké').first().id
+    client.post(f'/like_post/{post_id}')
+
+    html = client.get('/profile').get_data(as_text=True)
+    assert html.count('❤️') == 1
+
+    # Une ancienne session sans user_id reste valide
+    with client.session_transaction() as sess:
+        del sess['user_id']
+    assert client.get('/profile').status_code == 200
+    with client.session_transaction() as sess:
+        assert sess['user_id'] == user_id
+
+
+def test_search_is_prefix_ranked_and_synced(app, client, tmp_path):
+    import sqlite3
+    from app import search_users
+    for name, username in [('Alice Martin', 'alice'), ('Alicia Keys', 'alicia'), ('Bob', 'bob')]:
+        client.post('/register', data={'name': name, 'username': username,
+                                       'password': 'password', 'email': f'{username}@example.com'})
+    client.post('/login', data={'username': 'alice', 'password': 'password'})
+    client.post('/create_post', data={'content': 'Bonjour le monde'})
+
+    html = client.get('/search?q=ali').get_data(as_text=True)
+    assert '<b>alicia</b>' in html
+    assert '<b>alice</b>' not in html  # l'utilisateur connecté est exclu
+    assert 'Bonjour le monde' in client.get('/search?q=mon').get_data(as_text=True)
+
+    # Le changement de nom est réindexé
+    client.post('/edit_profile', data={'name': 'Bobette'})
+    bob = app.test_client()
+    bob.post('/login', data={'username': 'bob', 'password': 'password'})
+    assert '<b>alice</b>' in bob.get('/search?q=bobe').get_data(as_text=True)
+
+    # Autre application sur une copie de la base sans tables FTS5 : elle n'hérite pas de
+    # l'index de la première et passe à la recherche LIKE
+    with app.app_context():
+        db.session.execute(db.text('VACUUM INTO :path'), {'path': str(tmp_path / 'like.db')})
+    with sqlite3.connect(tmp_path / 'like.db') as copy:
+        copy.executescript('DROP TABLE user_search; DROP TABLE post_search;')
+    other = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'like.db'}", 'JINJA_BYTECODE_CACHE': '',
+                        'JOB_MODE': 'inline', 'VERSION_STORE_PATH': str(tmp_path / 'versions.db')})
+    other_bob = other.test_client()
+    other_bob.post('/login', data={'username': 'bob', 'password': 'password'})
+    response = other_bob.get('/search?q=ali')
+    assert response.status_code == 200 and '<b>alicia</b>' in response.get_data(as_text=True)
+    for text in ('a_i', 'a%c'):  # pas des jokers
+        assert '<b>alicia</b>' not in other_bob.get('/search', query_string={'q': text}).get_data(as_text=True)
+    with other.app_context():  # sans utilisateur à exclure : bob et alice (« Bobette »)
+        assert [user.username for user in search_users('bob')[0]] == ['alice', 'bob']
+    assert '<b>alice</b>' in bob.get('/search?q=bobe').get_data(as_text=True)
+
+    # La suppression du compte retire l'utilisateur et ses posts de l'index
+    client.post('/delete_account')
+    assert '<b>alice</b>' not in bob.get('/search?q=bobe').get_data(as_text=True)
+    assert 'Bonjour le monde' not in bob.get('/search?q=bonjour').get_data(as_text=True)
+
+
+def test_profile_cache_hits_and_invalidation(app, client):
+    response_cache = app.extensions['response_cache']
+    add_users(app, 'other')
+    other = login(app, 'other')
+    other.post('/create_post', data={'content': 'Premier post'})
+    other.get('/profile')  # consomme le message flash
+
+    visitor = app.test_client()
+    hits = response_cache.hits
+    assert 'Premier post' in visitor.get('/user/other').get_data(as_text=True)
+    assert 'Premier post' in visitor.get('/user/other').get_data(as_text=True)
+    assert response_cache.hits > hits
+
+    # Une écriture change la version du profil : la page est re-rendue
+    other.post('/edit_biography', data={'biography': 'Nouvelle bio'})
+    assert 'Nouvelle bio' in visitor.get('/user/other').get_data(as_text=True)
+
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    with app.app_context():
+        post_id = Post.query.filter_by(content='Premier post').first().id
+    client.post(f'/like_post/{post_id}')
+    assert "Like (1)" in visitor.get('/user/other').get_data(as_text=True)
+
+
+def test_cache_backends_ttl_and_lru(tmp_path):
+    from cache import MemoryCache, SQLiteCache
+    # SQLite : date d'accès et taille tenues à chaque opération, pour un ordre LRU exact
+    for cache in (MemoryCache(max_entries=2),
+                  SQLiteCache(str(tmp_path / 'cache.db'), max_entries=2, touch_interval=0, evict_every=1)):
+        cache.set('a', '1')
+        cache.set('b', '2')
+        assert cache.get('a') == '1'
+        cache.set('c', '3')  # évince 'b', le moins récemment lu
+        assert cache.get('b') is None
+        assert cache.get('a') == '1' and cache.get('c') == '3'
+        cache.set('d', '4', ttl=-1)  # déjà expiré
+        assert cache.get('d') is None
+        assert cache.stats()['hits'] == 3
+
+    # Réglages par défaut : une lecture n'écrit rien, l'excédent est évincé par lots d'écritures
+    cache = SQLiteCache(str(tmp_path / 'shared.db'), max_entries=2, evict_every=3)
+    cache.set('a', '1')
+    conn = cache._connection()
+    changes = conn.total_changes
+    assert cache.get('a') == '1'
+    assert conn.total_changes == changes
+    cache.set('b', '2')
+    cache.set('c', '3')
+    assert cache.stats()['entries'] == 2 and cache.evictions == 1
+
+
+def test_db_profile_env_overrides_and_pragmas(tmp_path):
+    import sqlalchemy as sa
+    from db_profiles import load_profile, engine_options, install_pragmas
+    profile = load_profile({'DB_PROFILE': 'production', 'DB_BUSY_TIMEOUT': '1234', 'DB_READ_POOL_SIZE': '0'})
+    assert (profile['journal_mode'], profile['busy_timeout'], profile['read_pool_size']) == ('WAL', 1234, 0)
+    assert engine_options(profile, 'sqlite:///:memory:') == {}
+    assert engine_options(profile, 'sqlite:///users.db')['connect_args']['timeout'] == 1.234
+
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+    install_pragmas(engine, profile)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 1234
+        assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1  # NORMAL
+
+
+LEGACY_SCHEMA = """
+CREATE TABLE user (id INTEGER PRIMARY KEY, name VARCHAR(80) NOT NULL, username VARCHAR(80) NOT NULL UNIQUE,
+                   password VARCHAR(80) NOT NULL, email VARCHAR(120) NOT NULL UNIQUE, biography TEXT);
+CREATE TABLE post (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, content VARCHAR(255) NOT NULL, date_posted DATETIME);
+CREATE TABLE "like" (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, post_id INTEGER NOT NULL, date_liked DATETIME,
+                     CONSTRAINT unique_like UNIQUE (user_id, post_id));
+CREATE TABLE comment (id INTEGER PRIMARY KEY, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+                      content VARCHAR(255) NOT NULL, date_posted DATETIME);
+CREATE TABLE comment_like (id INTEGER PRIMARY KEY, comment_id INTEGER NOT NULL, user_id INTEGER NOT NULL, date_liked DATETIME);
+CREATE TABLE followers (follower_id INTEGER NOT NULL, followed_id INTEGER NOT NULL, PRIMARY KEY (follower_id, followed_id));
+INSERT INTO user VALUES (1, 'A', 'a', 'x', 'a@example.com', NULL);
+INSERT INTO post VALUES (1, 1, 'Ancien post', '2024-01-01 10:00:00');
+INSERT INTO comment VALUES (1, 1, 1, 'Ancien commentaire', '2024-01-01 11:00:00');
+INSERT INTO comment_like VALUES (1, 1, 1, NULL), (2, 1, 1, NULL);
+"""
+
+
+def test_migration_upgrades_legacy_database(tmp_path):
+    import sqlite3
+    import subprocess
+    import sys
+    path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+
+    # Fichiers annexes dans tmp_path, comme avec conftest : rien n'est écrit dans instance/
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', VERSION_STORE_PATH=str(tmp_path / 'versions.db'),
+               JINJA_BYTECODE_CACHE=str(tmp_path / 'jinja_cache'))
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'upgrade-db'],
+                   env=env, check=True, capture_output=True)
+
+    conn = sqlite3.connect(path)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'ix_post_user_date', 'ix_comment_post', 'unique_comment_like', 'ix_followers_followed'} <= indexes
+    assert conn.execute('SELECT COUNT(*) FROM comment_like').fetchone()[0] == 1
+    assert conn.execute('SELECT likes_count FROM comment').fetchone()[0] == 1
+    assert conn.execute('PRAGMA user_version').fetchone()[0] > 0
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute('INSERT INTO comment_like (comment_id, user_id) VALUES (1, 1)')
+
+
+def test_hot_queries_use_indexes(app, client):
+    from app import TimelineEntry, followers
+
+    hot_queries = {
+        'profil': db.select(Post).where(Post.user_id == 1).order_by(Post.date_posted.desc(), Post.id.desc()).limit(21),
+        'fil': db.select(Post).where(Post.user_id.in_([1, 2, 3])).order_by(Post.date_posted.desc(), Post.id.desc()).limit(21),
+        'commentaires de la page': db.select(Comment).where(Comment.post_id.in_([1, 2, 3])),
+        'like de commentaire': db.select(CommentLike).where(CommentLike.user_id == 1, CommentLike.comment_id == 1),
+        'likes de la page': db.select(Like.post_id).where(Like.user_id == 1, Like.post_id.in_([1, 2])),
+        'suppression de post (likes)': db.delete(Like).where(Like.post_id == 1),
+        'suppression de post (likes de commentaires)': db.delete(CommentLike).where(
+            CommentLike.comment_id.in_(db.select(Comment.id).where(Comment.post_id == 1))),
+        'suppression de post (fils)': db.delete(TimelineEntry).where(TimelineEntry.post_id == 1),
+        'suppression de compte (commentaires)': db.delete(Comment).where(Comment.user_id == 1),
+        'suppression de compte (abonnés)': db.select(followers.c.follower_id).where(followers.c.followed_id == 1),
+        'fil précalculé': db.select(TimelineEntry.post_id).where(TimelineEntry.user_id == 1)
+            .order_by(TimelineEntry.date_posted.desc(), TimelineEntry.post_id.desc()).limit(21),
+    }
+    with app.app_context():
+        for name, statement in hot_queries.items():
+            sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+            plan = [row[3] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+            scans = [step for step in plan if step.startswith('SCAN') and 'CONSTANT ROW' not in step]
+            assert not scans, f'{name} : {plan}'
+            assert any('USING' in step for step in plan), f'{name} : {plan}'
+
+
+def build_account_to_delete(app):
+    # testuser (victime) et other : likes, commentaires et abonnements croisés
+    ids = add_users(app, 'other')
+    victim_id, other_id = ids['testuser'], ids['other']
+    victim = app.test_client()
+    victim.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    friend = login(app, 'other')
+
+    victim.post('/create_post', data={'content': 'Post de la victime'})
+    friend.post('/create_post', data={'content': 'Post de other'})
+    victim.post(f'/follow/{other_id}')
+    friend.post(f'/follow/{victim_id}')
+    with app.app_context():
+        victim_post = Post.query.filter_by(content='Post de la victime').first().id
+        other_post = Post.query.filter_by(content='Post de other').first().id
+    for client_, post_id in [(victim, other_post), (friend, other_post), (friend, victim_post), (victim, victim_post)]:
+        client_.post(f'/like_post/{post_id}')
+        client_.post(f'/comment/{post_id}', data={'content': 'Commentaire'})
+    with app.app_context():
+        comments = Comment.query.filter(Comment.post_id.in_([victim_post, other_post])).all()
+        victim_comments = [c.id for c in comments if c.post_id == victim_post or c.user_id == victim_id]
+    for comment in comments:
+        friend.post(f'/like_comment/{comment.id}')
+        victim.post(f'/like_comment/{comment.id}')
+    return victim, victim_id, other_id, other_post, victim_post, victim_comments
+
+
+def assert_account_fully_deleted(app, victim_id, other_id, other_post, victim_post, victim_comments):
+    from app import followers
+    with app.app_context():
+        assert db.session.get(User, victim_id) is None
+        assert Post.query.filter_by(user_id=victim_id).count() == 0
+        assert Like.query.filter_by(user_id=victim_id).count() == 0
+        assert CommentLike.query.filter_by(user_id=victim_id).count() == 0
+        # Pas d'orphelins : likes et commentaires d'autrui sur ses posts, likes sur ses commentaires
+        assert Like.query.filter_by(post_id=victim_post).count() == 0
+        assert Comment.query.filter_by(post_id=victim_post).count() == 0
+        assert Comment.query.filter(Comment.id.in_(victim_comments)).count() == 0
+        assert CommentLike.query.filter(CommentLike.comment_id.in_(victim_comments)).count() == 0
+        assert db.session.execute(db.select(followers).where(
+            (followers.c.follower_id == victim_id) | (followers.c.followed_id == victim_id))).first() is None
+        post = db.session.get(Post, other_post)
+        assert (post.likes_count, post.comments_count) == (1, 1)
+        assert Comment.query.filter_by(post_id=other_post).first().likes_count == 1
+        other = db.session.get(User, other_id)
+        assert (other.followers_count, other.following_count) == (0, 0)
+
+
+def test_delete_account_cascades_in_one_transaction(app, client):
+    victim, victim_id, other_id, *deleted = build_account_to_delete(app)
+    victim.post('/delete_account')
+    assert_account_fully_deleted(app, victim_id, other_id, *deleted)
+
+
+def test_delete_account_in_background_chunks(app, client, monkeypatch):
+    import app as app_module
+    from models import Job
+    monkeypatch.setitem(app.config, 'ACCOUNT_DELETE_BACKGROUND_THRESHOLD', 1)
+    monkeypatch.setitem(app.config, 'DELETE_CHUNK_SIZE', 1)
+    victim, victim_id, other_id, *deleted = build_account_to_delete(app)
+
+    # Premier essai interrompu en cours de route (base verrouillée) : la tâche reste en file
+    remove_comments = app_module.remove_comments
+
+    def locked(comment_ids):
+        raise OperationalError('DELETE FROM comment', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(app_module, 'remove_comments', locked)
+    victim.post('/delete_account')
+    # Le compte est détaché tout de suite : plus de connexion possible
+    assert victim.post('/login', data={'username': 'testuser', 'password': 'testpassword'}).status_code == 302
+    with victim.session_transaction() as sess:
+        assert 'user_id' not in sess
+    with app.app_context():
+        job = Job.query.filter_by(kind='delete_user_data').one()
+        assert (job.status, job.attempts) == ('pending', 1) and 'database is locked' in job.last_error
+        assert db.session.get(User, victim_id) is not None and Like.query.filter_by(user_id=victim_id).count() == 0
+
+    # Nouvel essai : reprend là où le premier s'est arrêté
+    monkeypatch.setattr(app_module, 'remove_comments', remove_comments)
+    with app.app_context():
+        Job.query.filter_by(kind='delete_user_data').update({Job.run_at: 0})
+        db.session.commit()
+        assert app.extensions['jobs'].run_pending() == 1
+        assert Job.query.filter_by(kind='delete_user_data').one().status == 'done'
+    assert_account_fully_deleted(app, victim_id, other_id, *deleted)
+
+
+def test_login_rehashes_outdated_password(app, client, monkeypatch):
+    password_hasher = app.extensions['password_hasher']
+    monkeypatch.setattr(password_hasher, 'method', 'pbkdf2:sha256:2000')
+    monkeypatch.setattr(password_hasher, '_method_prefix', None)
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    with app.app_context():
+        stored = User.query.filter_by(username='testuser').first().password
+    assert stored.startswith('pbkdf2:sha256:2000$')
+
+    # Un hash à jour n'est pas recalculé
+    client.post('/logout')
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    with app.app_context():
+        assert User.query.filter_by(username='testuser').first().password == stored
+    assert client.post('/login', data={'username': 'testuser', 'password': 'mauvais'},
+                       follow_redirects=True).request.path == '/login'
+
+
+def test_password_hasher_process_pool():
+    from hashing import PasswordHasher
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', executor='process', workers=2, max_pending=2)
+    try:
+        stored = hasher.hash('secret')
+        assert hasher.verify(stored, 'secret') == (True, None)
+        assert hasher.verify(stored, 'autre') == (False, None)
+        valid, new_hash = PasswordHasher(method='pbkdf2:sha256:3000', executor='inline').verify(stored, 'secret')
+        assert valid and new_hash.startswith('pbkdf2:sha256:3000$')
+    finally:
+        hasher.shutdown()
+
+
+def test_api_feed_and_batched_actions(app, client):
+    other_id = add_users(app, 'other')['other']
+    assert client.get('/api/feed').status_code == 401
+
+    other = login(app, 'other')
+    other.post('/create_post', data={'content': 'Post API'})
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    with app.app_context():
+        post_id = Post.query.filter_by(content='Post API').first().id
+
+    response = client.post('/api/actions', json={'actions': [
+        {'type': 'follow', 'user_id': other_id},
+        {'type': 'like_post', 'post_id': post_id},
+        {'type': 'comment', 'post_id': post_id, 'content': 'Commentaire API'},
+        {'type': 'like_post', 'post_id': 999999},
+    ]})
+    results = response.get_json()['results']
+    assert results[0] == {'type': 'follow', 'user_id': other_id, 'followers_count': 1}
+    assert results[1]['liked'] is True
+    assert (results[2]['likes_count'], results[2]['comments_count']) == (1, 1)
+    assert 'error' in results[3]
+
+    comment_id = results[2]['comment_id']
+    results = client.post('/api/actions', json={'actions': [
+        {'type': 'like_comment', 'comment_id': comment_id},
+        {'type': 'like_post', 'post_id': post_id},
+    ]}).get_json()['results']
+    assert results[0]['likes_count'] == 1
+    assert (results[1]['liked'], results[1]['likes_count']) == (False, 0)
+
+    posts = client.get('/api/feed').get_json()['posts']
+    assert [(p['content'], p['liked'], p['likes_count']) for p in posts] == [('Post API', False, 0)]
+    assert posts[0]['comments'][0]['liked'] is True
+
+    assert client.post('/api/actions', json={'actions': [{'type': 'inconnu'}]}).status_code == 400
+    for bad_action in ({'type': []}, {'type': {}}, {'type': 1}, 'like_post'):
+        response = client.post('/api/actions', json={'actions': [bad_action]})
+        assert response.status_code == 400 and 'error' in response.get_json()
+    for bad_id in ([post_id], {'id': post_id}, True, '1'):
+        response = client.post('/api/actions', json={'actions': [{'type': 'like_post', 'post_id': bad_id}]})
+        assert response.status_code == 400 and 'error' in response.get_json()
+    assert client.post('/api/actions', json={'actions': [{'type': 'like_post', 'post_id': post_id}] * 51}).status_code == 400
+
+
+def test_profile_is_streamed_in_batches_then_cached(app, client, monkeypatch):
+    response_cache = app.extensions['response_cache']
+    import re
+    monkeypatch.setitem(app.config, 'POSTS_PER_PAGE', 5)
+    monkeypatch.setitem(app.config, 'STREAM_BATCH_SIZE', 2)
+    monkeypatch.setitem(app.config, 'STREAM_BUFFER_SIZE', 1)
+    add_users(app, 'other')
+    with app.app_context():
+        user = User.query.filter_by(username='testuser').first()
+        for i in range(7):
+            db.session.add(Post(user_id=user.id, content=f'Streamé {i}'))
+        db.session.commit()
+        # Post liké dans le troisième lot (posts du plus récent au plus ancien)
+        liked_id = Post.query.filter_by(content='Streamé 2').first().id
+
+    # Client sans `with` : la réponse est réellement envoyée en streaming
+    visitor = login(app, 'other')
+    visitor.post(f'/like_post/{liked_id}')
+    response = visitor.get('/user/testuser')
+    chunks = list(response.response)
+    assert len(chunks) > 1
+    html = b''.join(chunks).decode()
+    assert [int(i) for i in re.findall(r'data-post-id="(\d+)"', html)][4] == liked_id
+    assert html.count('❤️') == 1
+    assert 'cursor=' in html
+
+    # La page complète a été mise en cache à la fin du streaming
+    hits = response_cache.hits
+    assert visitor.get('/user/testuser').get_data(as_text=True) == html
+    assert response_cache.hits > hits
+
+
+def test_seed_builds_consistent_power_law_graph(app, client):
+    from seed import seed
+    from app import followers
+    with app.app_context():
+        first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+        counts = seed(200, posts_per_user=3, follows_per_user=10, rng_seed=1)
+        assert counts['user'] == 200 and counts['post'] > 0 and counts['like'] > 0
+        seeded = User.query.filter(User.id >= first_id).all()
+
+        # Compteurs cohérents avec les tables sources
+        for user in seeded[:20]:
+            assert user.followers_count == db.session.query(followers).filter_by(followed_id=user.id).count()
+        post = Post.query.filter(Post.user_id >= first_id).order_by(Post.likes_count.desc()).first()
+        assert post.likes_count == Like.query.filter_by(post_id=post.id).count()
+
+        # Loi de puissance : le compte le plus suivi l'est bien plus que la moyenne
+        in_degrees = sorted(user.followers_count for user in seeded)
+        assert in_degrees[-1] > 5 * sum(in_degrees) / len(in_degrees)
+
+    # Les comptes générés sont indexés pour la recherche
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    assert f'<b>user{first_id}</b>' in client.get(f'/search?q=user{first_id}').get_data(as_text=True)
+
+
+def test_request_metrics_endpoint_footer_and_slow_log(app, client, monkeypatch, caplog):
+    import re
+    metrics = app.extensions['metrics']
+    monkeypatch.setitem(app.config, 'METRICS_HEADER', True)
+    monkeypatch.setitem(app.config, 'METRICS_DEBUG_FOOTER', True)
+    monkeypatch.setitem(app.config, 'STREAM_BATCH_SIZE', 2)
+    monkeypatch.setattr(metrics, 'slow_query_ms', 0)
+    with app.app_context():
+        user = User.query.filter_by(username='testuser').first()
+        for i in range(6):
+            db.session.add(Post(user_id=user.id, content=f'Mesuré {i}'))
+        db.session.commit()
+
+    def sql_queries(endpoint):
+        text = app.test_client().get('/_metrics').get_data(as_text=True)
+        match = re.search(rf'^app_sql_queries_total{{endpoint="{endpoint}"}} (\d+)', text, re.M)
+        return int(match.group(1)) if match else 0
+
+    before = sql_queries('user_profile')
+    visitor = app.test_client()
+    with caplog.at_level('WARNING'):
+        response = visitor.get('/user/testuser')
+        html = response.get_data(as_text=True)
+    assert 'sql;dur=' in response.headers['Server-Timing']
+    # Page en streaming : le pied de page arrive en dernier et compte les requêtes du rendu
+    footer = re.search(r'<div class="debug-metrics".*?(\d+) requêtes SQL', html)
+    assert html.rstrip().endswith('</div>') and int(footer.group(1)) >= 3
+    assert sql_queries('user_profile') - before == int(footer.group(1))
+    assert any('Requête lente' in record.getMessage() for record in caplog.records)
+
+    # Le pied de page n'entre pas dans le cache de pages
+    assert html.count('debug-metrics') == 1
+    assert visitor.get('/user/testuser').get_data(as_text=True).count('debug-metrics') == 1
+    text = app.test_client().get('/_metrics').get_data(as_text=True)
+    assert 'app_requests_total{endpoint="user_profile",method="GET",status="200"}' in text
+    assert '# TYPE app_slowest_sql_seconds gauge' in text
+    # Compteurs des caches du worker qui sert /_metrics (la seconde visite vient du cache)
+    hits = re.search(r'^app_response_cache_hits (\d+)', text, re.M)
+    assert int(hits.group(1)) == app.extensions['response_cache'].hits >= 1
+    assert re.search(r'^app_follow_graph_misses \d+', text, re.M)
+
+    # Accès : adresses locales, ou jeton partout s'il est défini
+    remote = app.test_client()
+    remote.environ_base['REMOTE_ADDR'] = '203.0.113.7'
+    assert remote.get('/_metrics').status_code == 404
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'secret')
+    assert app.test_client().get('/_metrics').status_code == 404
+    assert remote.get('/_metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_slow_query_log_handler_is_added_once(tmp_path):
+    import logging
+    path = tmp_path / 'slow.log'
+    for _ in range(3):
+        create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'metrics.db'}", 'JINJA_BYTECODE_CACHE': '',
+                    'METRICS_SLOW_QUERY_LOG': str(path)})
+    logger = logging.getLogger('slow_queries')
+    handlers = [handler for handler in logger.handlers if getattr(handler, 'baseFilename', None) == str(path)]
+    assert len(handlers) == 1
+    logger.removeHandler(handlers[0])
+    handlers[0].close()
+
+
+@pytest.mark.parametrize('fmt', ['ndjson', 'csv'])
+def test_export_import_and_backup_roundtrip(app, client, tmp_path, fmt):
+    import sqlite3
+    import sqlalchemy as sa
+    from dump import TABLES, export_database, import_database, backup_database
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/create_post', data={'content': 'Exporté, avec "guillemets"\net retour'})
+    with app.app_context():
+        post_id = Post.query.filter(Post.content.like('Exporté%')).first().id
+        db_path = db.engine.url.database
+    client.post(f'/like_post/{post_id}')
+    client.post(f'/comment/{post_id}', data={'content': 'Commentaire exporté'})
+    # Notifications et compteur de non-lues de testuser
+    ids = add_users(app, 'alice')
+    alice = login(app, 'alice')
+    alice.post(f'/like_post/{post_id}')
+    alice.post(f"/follow/{ids['testuser']}")
+
+    counts = export_database(db_path, tmp_path / 'export', fmt, chunk_size=2)
+    assert counts['notification'] == 2 and counts['notification_inbox'] >= 1
+    target = tmp_path / 'restored.db'
+    db.metadata.create_all(sa.create_engine(f'sqlite:///{target}'))
+    assert import_database(str(target), tmp_path / 'export', chunk_size=2) == counts
+    backup_database(db_path, str(tmp_path / 'backup.db'), pages=1)
+
+    source = sqlite3.connect(db_path)
+    for path in (target, tmp_path / 'backup.db'):
+        copy = sqlite3.connect(path)
+        for table in TABLES:
+            query = f'SELECT * FROM "{table}" ORDER BY rowid'
+            assert copy.execute(query).fetchall() == source.execute(query).fetchall()
+
+    # Après un import, les ETag et les ensembles d'abonnements déjà servis sont périmés
+    from dump import rebuild_derived
+    from app import content_version
+    with app.app_context():
+        follow_graph = app.extensions['follow_graph']
+        page_version = content_version('profile', ids['testuser'])
+        graph_version = follow_graph.version('followed', ids['alice'])
+        rebuild_derived()
+        assert content_version('profile', ids['testuser']) != page_version
+        assert follow_graph.version('followed', ids['alice']) != graph_version
+
+
+def test_follow_graph_in_memory_mutuals_and_suggestions(app, client):
+    follow_graph = app.extensions['follow_graph']
+    ids = add_users(app, 'alice', 'bob', 'carol')
+    logins = {name: login(app, name) for name in ('alice', 'bob')}
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    logins['alice'].post(f"/follow/{ids['testuser']}")
+    logins['alice'].post(f"/follow/{ids['carol']}")
+    logins['bob'].post(f"/follow/{ids['carol']}")
+    client.post(f"/follow/{ids['alice']}")
+    client.post(f"/follow/{ids['bob']}")
+
+    # Ensembles déjà chargés : plus aucune requête SQL sur la table des abonnements
+    with app.app_context():
+        follow_graph.followed(ids['testuser'])
+        follow_graph.followed(ids['alice'])
+        with recorded_queries(app) as statements:
+            assert follow_graph.followed(ids['testuser']) == {ids['alice'], ids['bob']}
+            assert follow_graph.is_following(ids['alice'], ids['carol'])
+    assert not statements
+
+    # Mis à jour à la validation, sans relecture ; annulé avec la transaction
+    with app.app_context():
+        follow_graph.followers(ids['carol'])
+        follow_graph.followed(ids['bob'])
+        misses = follow_graph.misses
+        logins['bob'].post(f"/unfollow/{ids['carol']}")
+        assert not follow_graph.is_following(ids['bob'], ids['carol'])
+        assert ids['bob'] not in follow_graph.followers(ids['carol'])
+        assert follow_graph.misses == misses
+        alice = db.session.get(User, ids['alice'])
+        alice.follow(db.session.get(User, ids['bob']))
+        assert alice.is_following(db.session.get(User, ids['bob']))
+        db.session.rollback()
+        assert not follow_graph.is_following(ids['alice'], ids['bob'])
+
+    assert client.get('/api/mutuals').get_json()['users'] == [{'id': ids['alice'], 'username': 'alice'}]
+    assert client.get('/api/suggestions').get_json()['users'] == [
+        {'id': ids['carol'], 'username': 'carol', 'followed_by': 1}]
+
+    # Écriture d'un autre processus : la version publiée change, l'ensemble est relu
+    with app.app_context():
+        db.session.execute(db.text('DELETE FROM followers WHERE follower_id = :id'), {'id': ids['alice']})
+        db.session.commit()
+        app.extensions['versions'].bump(f"followed:{ids['alice']}")
+        assert follow_graph.followed(ids['alice']) == set()
+
+
+def test_follow_graph_versions_survive_page_cache_and_are_shared(tmp_path):
+    from follow_graph import FollowGraph
+    from versions import VersionStore
+    loads = []
+
+    def load(direction, user_id):
+        loads.append((direction, user_id))
+        return [2, 3]
+
+    # Cache de pages désactivé, ou qui évince tout : les ensembles restent valides
+    for config in ({'CACHE_BACKEND': 'none'}, {'CACHE_BACKEND': 'memory', 'CACHE_MAX_ENTRIES': 2}):
+        other = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'graph.db'}", 'JINJA_BYTECODE_CACHE': '',
+                            'VERSION_STORE_PATH': str(tmp_path / f"{config['CACHE_BACKEND']}.db"), **config})
+        graph = FollowGraph(load, other.extensions['versions'])
+        for i in range(3):
+            assert graph.followed(1) == {2, 3}
+            for j in range(10):
+                other.extensions['response_cache'].set(f'page:{i}:{j}', 'html')
+        assert (graph.hits, graph.misses) == (2, 1)
+
+    # Deux workers sur le même fichier de versions : l'écriture de l'un fait relire l'autre
+    first, second = (FollowGraph(load, VersionStore(str(tmp_path / 'shared.db'))) for _ in range(2))
+    second.followed(1)
+    first.apply(1, 4, following=True)
+    loads.clear()
+    second.followed(1)
+    assert loads == [('followed', 1)]
+
+    # Ensemble local périmé par l'écriture d'un autre worker : oublié plutôt que corrigé
+    stored = {1: {3}}
+    first, second = (FollowGraph(lambda direction, user_id: set(stored[user_id]),
+                                 VersionStore(str(tmp_path / 'lost.db'))) for _ in range(2))
+    first.apply(1, 3, following=True)
+    assert first.followed(1) == {3}
+    stored[1].add(2)
+    second.apply(1, 2, following=True)
+    stored[1].add(4)
+    first.apply(1, 4, following=True)
+    assert first.followed(1) == second.followed(1) == {2, 3, 4}
+
+    # Écriture en masse : une seule version globale périme les ensembles de tous les workers
+    stored[1].add(5)
+    bumps = first.versions.bumps
+    first.invalidate_all()
+    assert first.versions.bumps == bumps + 1
+    assert first.followed(1) == second.followed(1) == {2, 3, 4, 5}
+
+    # Version globale et version de l'ensemble lues ensemble : une lecture par recherche
+    reads = first.versions.reads
+    assert first.is_following(1, 5)
+    assert first.versions.reads == reads + 1
+
+
+def test_concurrent_like_toggles_and_batched_writer(app, client, monkeypatch):
+    from like_writer import LikeWriter
+    with app.app_context():
+        for i in range(8):
+            db.session.add(User(name=f'Fan {i}', username=f'fan{i}', password='x', email=f'fan{i}@example.com'))
+        db.session.commit()
+        author = User.query.filter_by(username='testuser').first()
+        post = Post(content='Post viral', user_id=author.id)
+        db.session.add(post)
+        db.session.commit()
+        db.session.add(Comment(post_id=post.id, user_id=author.id, content='Commentaire viral'))
+        db.session.commit()
+        post_id = post.id
+        comment_id = Comment.query.filter_by(post_id=post_id).first().id
+        fan_ids = [u.id for u in User.query.filter(User.username.like('fan%'))]
+
+    # Bascules concurrentes, dont plusieurs du même utilisateur : ni erreur ni doublon
+    errors = []
+
+    def toggle(user_id, kind, target_id, times):
+        try:
+            for _ in range(times):
+                apply_like_batch(app, [(kind, user_id, target_id, None)])
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=toggle, args=(user_id, kind, target_id, times))
+               for user_id in fan_ids
+               for kind, target_id, times in (('post', post_id, 3), ('comment', comment_id, 2))]
+    threads += [threading.Thread(target=toggle, args=(fan_ids[0], 'post', post_id, 1)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    with app.app_context():
+        likes = Like.query.filter_by(post_id=post_id).count()
+        assert likes == len(fan_ids) - 1 + (3 + 4) % 2  # fan0 : 7 bascules
+        assert db.session.get(Post, post_id).likes_count == likes
+        assert CommentLike.query.filter_by(comment_id=comment_id).count() == 0
+        assert db.session.get(Comment, comment_id).likes_count == 0
+        # Idempotent : liker deux fois ne compte qu'un like
+        assert apply_like_batch(app, [('comment', fan_ids[1], comment_id, True)] * 2) == [True, True]
+        assert db.session.get(Comment, comment_id).likes_count == 1
+        # Cible supprimée pendant le lot : clés étrangères non vérifiées, mais aucune ligne orpheline
+        apply_like_batch(app, [('post', fan_ids[1], 999999, True), ('comment', fan_ids[1], 999999, True)])
+        assert Like.query.filter_by(post_id=999999).count() == CommentLike.query.filter_by(comment_id=999999).count() == 0
+
+    # File en mémoire : les clics simultanés partagent un commit et une mise à jour du compteur
+    writer = LikeWriter(partial(apply_like_batch, app), mode='batched', interval=0.05)
+    results = {}
+
+    def click(user_id):
+        results[user_id] = writer.submit('post', user_id, post_id, True)
+
+    threads = [threading.Thread(target=click, args=(user_id,)) for user_id in fan_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(results[user_id] for user_id in fan_ids)
+    assert writer.submit('post', 999999, post_id, False) is False  # utilisateur inconnu : rien à retirer
+    writer.shutdown()
+    assert writer.stats()['events'] == len(fan_ids) + 1
+    assert writer.stats()['batches'] < len(fan_ids)
+    with app.app_context():
+        assert db.session.get(Post, post_id).likes_count == Like.query.filter_by(post_id=post_id).count() == len(fan_ids)
+
+    # Route HTML en mode groupé
+    writer = LikeWriter(partial(apply_like_batch, app), mode='batched')
+    monkeypatch.setitem(app.extensions, 'like_writer', writer)
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post(f'/like_post/{post_id}')
+    writer.shutdown()
+    with app.app_context():
+        assert db.session.get(Post, post_id).likes_count == len(fan_ids) + 1
+
+
+def test_static_assets_are_fingerprinted_compressed_and_immutable(app, client):
+    assets = app.extensions['assets']
+    page = client.get('/').get_data(as_text=True)
+    css_url = f"/static/{assets.urls['style.css']}"
+    assert css_url in page and f"/static/{assets.urls['images/LOGO.png']}" in page
+    with open(os.path.join(app.static_folder, 'style.css'), 'rb') as f:
+        css = f.read()
+
+    response = client.get(css_url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.data) < len(css) and gzip.decompress(response.data) == css
+    assert client.get(css_url).data == css
+    assert client.get(css_url, headers={'Accept-Encoding': 'gzip',
+                                        'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # Nom sans empreinte : gestionnaire habituel, revalidé
+    response = client.get('/static/style.css')
+    assert response.status_code == 200 and 'immutable' not in response.headers.get('Cache-Control', '')
+    response.close()
+    assert client.get('/static/style.000000000000.css').status_code == 404
+
+
+def test_logo_webp_variants(app):
+    assets = app.extensions['assets']
+    pytest.importorskip('PIL')
+    assert [width for width, _ in assets.variants['images/LOGO_sidebar.png']] == [240, 480]
+    name = assets.urls['images/LOGO_sidebar.240w.webp']
+    assert assets.files[name].mimetype == 'image/webp'
+    with app.test_request_context():
+        assert app.jinja_env.globals['webp_srcset']('images/LOGO_sidebar.png').endswith(' 480w')
+
+
+def test_pages_answer_304_from_version_stamps_and_are_gzipped(app, client, monkeypatch):
+    from compression import gzip_stream
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/create_post', data={'content': 'Post ETag ' + 'x' * 200})
+    client.get('/profile').close()  # consomme le message flash
+    response = client.get('/profile', headers={'Accept-Encoding': 'gzip'})
+    etag = response.headers['ETag']
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Post ETag' in gzip.decompress(response.data).decode()
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    # Page inchangée : 304 sans rendu, une requête SQL (l'utilisateur courant)
+    with recorded_queries(app) as statements:
+        response = client.get('/profile', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and not response.data
+    assert len(statements) <= 2
+
+    # Cache de pages désactivé : l'ETag vient du store de versions, toujours 304
+    from cache import NullCache
+    monkeypatch.setitem(app.extensions, 'response_cache', NullCache())
+    assert client.get('/profile', headers={'If-None-Match': etag}).status_code == 304
+
+    # Un like change la version du profil, donc l'ETag
+    with app.app_context():
+        post_id = Post.query.filter(Post.content.like('Post ETag%')).first().id
+    client.post(f'/like_post/{post_id}')
+    response = client.get('/profile', headers={'If-None-Match': etag})
+    response.close()
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+    # Petite réponse : pas compressée ; streaming : compressé morceau par morceau
+    response = client.get('/api/mutuals', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert gzip.decompress(b''.join(gzip_stream(iter(['<p>', 'é' * 10, '</p>']), 6))) == ('<p>' + 'é' * 10 + '</p>').encode()
+
+
+def test_app_factory_touches_no_database_and_prewarms_templates(tmp_path):
+    path = tmp_path / 'fresh.db'
+    fresh = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'JINJA_BYTECODE_CACHE': str(tmp_path / 'jinja'),
+        'TEMPLATE_PREWARM': True,
+        'JOB_MODE': 'inline',
+    })
+    assert not path.exists()
+    templates = fresh.jinja_env.list_templates(extensions=['html'])
+    assert len(os.listdir(tmp_path / 'jinja')) == len(templates)
+
+    # Le schéma se crée à la demande, par la commande
+    result = fresh.test_cli_runner().invoke(args=['upgrade-db'])
+    assert result.exit_code == 0, result.output
+    with fresh.app_context():
+        assert db.inspect(db.engine).has_table('post')
+    assert fresh.test_client().get('/user/personne').status_code == 404
+
+
+def test_job_queue_runs_side_effects_with_retries_and_gauges(app, client, monkeypatch):
+    from jobs import JobQueue
+    from models import Job
+    queue = app.extensions['jobs']
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/create_post', data={'content': 'Indexé par une tâche'})
+    with app.app_context():
+        job = Job.query.one()
+        assert (job.kind, job.status, job.attempts) == ('post_created', 'done', 1)
+        # Même clé d'idempotence : pas de seconde tâche
+        queue.enqueue('post_created', {'post_id': 1}, key=job.idempotency_key)
+        db.session.commit()
+        assert Job.query.count() == 1
+    assert 'Indexé par une tâche' in client.get('/search?q=indexe').get_data(as_text=True)
+
+    # Échecs : nouvel essai différé, puis abandon après JOB_MAX_ATTEMPTS essais
+    calls = []
+
+    def flaky(fail_until):
+        calls.append(fail_until)
+        if len(calls) < fail_until:
+            raise RuntimeError('indisponible')
+
+    monkeypatch.setitem(queue.handlers, 'flaky', flaky)
+    monkeypatch.setattr(queue, 'retry_delay', 0)
+    with app.app_context():
+        queue.enqueue('flaky', {'fail_until': 2})
+        queue.enqueue('flaky', {'fail_until': 99})
+        db.session.commit()
+        for _ in range(queue.max_attempts):
+            queue.run_pending()
+        statuses = dict(db.session.execute(db.select(Job.payload, Job.status).where(Job.kind == 'flaky')).all())
+        assert statuses == {'{"fail_until": 2}': 'done', '{"fail_until": 99}': 'failed'}
+        assert Job.query.filter_by(status='failed').one().attempts == queue.max_attempts
+
+        # Mode thread : une tâche laissée en file par un processus précédent est reprise au
+        # démarrage du worker, les suivantes le réveillent après le commit
+        threaded = JobQueue(app, queue.handlers, mode='thread', poll_interval=60)
+        threaded.enqueue('flaky', {'fail_until': 0})
+        db.session.commit()
+        threaded.start()
+
+        def wait_processed(expected):
+            deadline = time.time() + 5
+            while threaded.processed < expected and time.time() < deadline:
+                time.sleep(0.01)
+            assert threaded.processed == expected
+
+        wait_processed(1)
+        threaded.enqueue('flaky', {'fail_until': 0})
+        db.session.commit()
+        threaded.notify()
+        wait_processed(2)
+        threaded.shutdown()
+        assert queue.stats()['pending'] == 0
+
+    text = client.get('/_metrics').get_data(as_text=True)
+    assert 'app_jobs_pending 0' in text and 'app_jobs_failed 1' in text
+    assert 'app_jobs_lag_seconds 0' in text
+
+
+def test_notifications_are_aggregated_paginated_and_compacted(app, client, monkeypatch):
+    from app import compact_notifications
+    from models import Notification
+    ids = add_users(app, 'alice', 'bob')
+    logins = {name: login(app, name) for name in ('alice', 'bob')}
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    client.post('/create_post', data={'content': 'Mon post à notifier'})
+    client.post('/create_post', data={'content': 'Second post'})
+    with app.app_context():
+        post_id, second_id = [p.id for p in Post.query.order_by(Post.id)]
+
+    for name in ('alice', 'bob'):
+        logins[name].post(f'/like_post/{post_id}')
+        logins[name].post(f'/follow/{ids["testuser"]}')
+    logins['bob'].post(f'/comment/{post_id}', data={'content': 'Bravo'})
+    client.post(f'/like_post/{post_id}')  # son propre post : pas de notification
+    assert client.get('/api/notifications/unread').get_json() == {'unread': 3}
+
+    html = client.get('/notifications').get_data(as_text=True)
+    assert '<b>bob</b> et 1 autre' in html and 'aimé votre publication' in html
+    assert 'se sont abonnés' in html and 'commenté votre publication' in html
+    assert client.get('/api/notifications/unread').get_json() == {'unread': 0}
+
+    # Un abonné qui se désabonne puis se réabonne plusieurs fois ne compte qu'une fois
+    for action in ('unfollow', 'follow', 'unfollow', 'follow'):
+        logins['bob'].post(f'/{action}/{ids["testuser"]}')
+    with app.app_context():
+        assert Notification.query.filter_by(kind='follow').one().count == 2
+    assert '<b>bob</b> et 1 autre' in client.get('/notifications').get_data(as_text=True)
+
+    # Après lecture, un nouvel événement rend la même ligne non lue ; un lot = une notification
+    with app.app_context():
+        apply_like_events([('post', ids['alice'], post_id, False)])
+        apply_like_events([('post', ids['alice'], post_id, True),
+                           ('post', ids['bob'], second_id, True), ('post', ids['alice'], second_id, True)])
+        assert dict(db.session.execute(db.select(Notification.target_id, Notification.count)
+                                       .where(Notification.kind == 'like_post')).all()) == {post_id: 2, second_id: 2}
+        assert Notification.query.count() == 4
+    assert client.get('/api/notifications/unread').get_json() == {'unread': 2}
+
+    # Pagination et compaction : on ne garde que les plus récentes
+    monkeypatch.setitem(app.config, 'NOTIFICATIONS_PER_PAGE', 3)
+    assert 'page=2' in client.get('/notifications').get_data(as_text=True)
+    assert 'Aucune notification' not in client.get('/notifications?page=2').get_data(as_text=True)
+    monkeypatch.setitem(app.config, 'NOTIFICATIONS_KEEP', 2)
+    with app.app_context():
+        assert compact_notifications([ids['testuser']]) == 2
+        db.session.commit()
+        assert Notification.query.count() == 2
+
+    # Post supprimé : ses notifications aussi, le compteur de non-lues est recalculé
+    logins['alice'].post(f'/like_post/{second_id}')  # retire son like
+    logins['alice'].post(f'/like_post/{second_id}')
+    assert client.get('/api/notifications/unread').get_json() == {'unread': 1}
+    client.post(f'/delete_post/{second_id}')
+    assert client.get('/api/notifications/unread').get_json() == {'unread': 0}
+
+    # Bascules répétées d'un même utilisateur : comptées une fois, notification retirée à zéro
+    client.post('/create_post', data={'content': 'Post basculé'})
+    with app.app_context():
+        toggled = Post.query.filter_by(content='Post basculé').one().id
+    for _ in range(3):
+        logins['alice'].post(f'/like_post/{toggled}')
+    with app.app_context():
+        assert Notification.query.filter_by(kind='like_post', target_id=toggled).one().count == 1
+    logins['alice'].post(f'/like_post/{toggled}')
+    with app.app_context():
+        assert Notification.query.filter_by(kind='like_post', target_id=toggled).count() == 0
+    assert client.get('/api/notifications/unread').get_json() == {'unread': 0}
+
+    # Compte supprimé : ses likes, commentaires et abonnements sont retirés comme par un unlike
+    add_users(app, 'carol')
+    carol = login(app, 'carol')
+    with app.app_context():
+        follow = Notification.query.filter_by(kind='follow').first()
+        follows = follow.count if follow is not None else 0
+    carol.post(f'/follow/{ids["testuser"]}')
+    carol.post(f'/like_post/{toggled}')
+    logins['alice'].post(f'/like_post/{toggled}')
+    logins['alice'].post(f'/comment/{toggled}', data={'content': 'Premier'})
+    carol.post(f'/comment/{toggled}', data={'content': 'Second'})
+    carol.post('/delete_account')
+    with app.app_context():
+        like = Notification.query.filter_by(kind='like_post', target_id=toggled).one()
+        assert (like.count, like.actor_id) == (1, ids['alice'])
+        comment = Notification.query.filter_by(kind='comment', target_id=toggled).one()
+        assert (comment.count, comment.actor_id) == (1, None)
+        assert sum(n.count for n in Notification.query.filter_by(kind='follow')) == follows
+        unread = Notification.query.filter_by(user_id=ids['testuser'], unread=True).count()
+    assert client.get('/api/notifications/unread').get_json() == {'unread': unread}
+
+
+def test_trending_ranking_is_incremental_decayed_and_rebuildable(app, client, monkeypatch):
+    from trending import TrendingRanking
+    ranking = app.extensions['trending']
+    monkeypatch.setattr(ranking, 'refresh_interval', 0)
+    add_users(app, 'alice', 'bob')
+    logins = {name: login(app, name) for name in ('alice', 'bob')}
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    for content in ('Post A', 'Post B', 'Post C'):
+        client.post('/create_post', data={'content': content})
+    with app.app_context():
+        ids = {p.content: p.id for p in Post.query}
+    assert client.get('/api/trending').get_json() == {'posts': []}  # première lecture : construit depuis la base
+
+    # Mis à jour à chaque like / commentaire validé, sans relire la base
+    for name in ('alice', 'bob'):
+        logins[name].post(f"/like_post/{ids['Post A']}")
+    logins['bob'].post(f"/like_post/{ids['Post B']}")
+    logins['bob'].post(f"/comment/{ids['Post B']}", data={'content': 'Top'})
+    rebuilds = ranking.rebuilds
+    posts = client.get('/api/trending').get_json()['posts']
+    assert [p['content'] for p in posts] == ['Post B', 'Post A']
+    assert posts[0]['score'] == pytest.approx(3.0, rel=0.01) and ranking.rebuilds == rebuilds
+    assert 'Post B' in client.get('/trending').get_data(as_text=True)
+
+    # Reconstruit depuis la base : même classement
+    ranking.clear()
+    assert [p['content'] for p in client.get('/api/trending').get_json()['posts']] == ['Post B', 'Post A']
+
+    # Retrait du like et suppression du post
+    logins['alice'].post(f"/like_post/{ids['Post A']}")
+    logins['bob'].post(f"/like_post/{ids['Post A']}")
+    client.post(f"/delete_post/{ids['Post B']}")
+    assert client.get('/api/trending').get_json() == {'posts': []}
+
+    # Décroissance : un événement d'il y a une demi-vie compte pour moitié ; candidats bornés
+    now = time.time()
+    alone = TrendingRanking(lambda since: [(1, 1.0, now - 3600), (2, 0.6, now)], half_life=3600, capacity=2)
+    assert [(post_id, round(score, 2)) for post_id, score in alone.top()] == [(2, 0.6), (1, 0.5)]
+    alone.apply([(post_id, 1.0) for post_id in range(3, 8)])
+    assert alone.stats()['posts'] == 2
+
+
+def test_rate_limits_per_user_ip_and_route_class(tmp_path):
+    from ratelimit import MemoryBuckets, SQLiteBuckets
+    limited = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'limited.db'}",
+        'JINJA_BYTECODE_CACHE': '',
+        'JOB_MODE': 'inline',
+        'VERSION_STORE_PATH': str(tmp_path / 'versions.db'),
+        'RATE_LIMITS': {'auth': {'ip': (2, 60), 'methods': ('POST',)},
+                        'search': {'user': (30, 60)},
+                        'write': {'user': (3, 60), 'ip': (5, 60)}},
+    })
+    with limited.app_context():
+        db.create_all()
+    add_users(limited, 'alice', 'bob')
+    with limited.app_context():
+        db.session.add(Post(user_id=1, content='Cible'))
+        db.session.commit()
+    alice, bob = limited.test_client(), limited.test_client()
+    assert alice.post('/login', data={'username': 'alice', 'password': 'alicepassword'}).status_code == 302
+    assert alice.post('/login', data={'username': 'alice', 'password': 'faux'}).status_code != 429
+    response = alice.post('/login', data={'username': 'alice', 'password': 'faux'})
+    assert response.status_code == 429 and int(response.headers['Retry-After']) >= 1
+    assert alice.get('/login').status_code == 200  # seules les tentatives (POST) sont limitées
+    # Autre IP : son propre seau
+    bob.environ_base['REMOTE_ADDR'] = '10.0.0.2'
+    assert bob.post('/login', data={'username': 'bob', 'password': 'bobpassword'}).status_code == 302
+
+    # Seau de l'utilisateur : 3 écritures, puis 429 (JSON sur l'API) sans toucher à la base
+    for _ in range(3):
+        assert alice.post('/like_post/1').status_code == 302
+    assert alice.post('/like_post/1').status_code == 429
+    response = alice.post('/api/actions', json={'actions': [{'type': 'like_post', 'post_id': 1}]})
+    assert response.status_code == 429 and 'error' in response.get_json()
+    with limited.app_context():
+        assert db.session.get(Post, 1).likes_count == 1
+    assert alice.get('/feed').status_code == 200  # les lectures ne sont pas limitées
+
+    # Seau de l'IP, partagé par les comptes : 2 jetons restants sur 5
+    carol = limited.test_client()
+    with carol.session_transaction() as sess:
+        sess['username'], sess['user_id'] = 'bob', 2
+    assert carol.post('/like_post/1').status_code == 302
+    assert carol.post('/like_post/1').status_code == 302
+    assert carol.post('/like_post/1').status_code == 429
+    assert bob.post('/like_post/1').status_code == 302  # même compte, autre IP
+    assert limited.extensions['rate_limits'].stats()['denied'] == 4
+
+    # Recharge progressive, éviction LRU, store SQLite partagé entre workers
+    buckets = MemoryBuckets(max_keys=2)
+    assert buckets.take([('a', 1, 20.0)]) == 0
+    assert 0 < buckets.take([('a', 1, 20.0)]) <= 0.05
+    time.sleep(0.06)
+    assert buckets.take([('a', 1, 20.0)]) == 0
+    buckets.take([('b', 1, 1.0)])
+    buckets.take([('c', 1, 1.0)])
+    assert buckets.stats()['evictions'] == 1 and buckets.take([('a', 1, 20.0)]) == 0
+    first, second = SQLiteBuckets(str(tmp_path / 'limits.db')), SQLiteBuckets(str(tmp_path / 'limits.db'))
+    assert first.take([('ip:1', 2, 0.01)]) == 0 and second.take([('ip:1', 2, 0.01)]) == 0
+    assert first.take([('ip:1', 2, 0.01)]) > 90
@@ -0,0 +1,133 @@
+"""Posts tendance : likes et commentaires pondérés, avec décroissance exponentielle.
+
+Chaque événement compte pour son poids, divisé par deux toutes les `half_life` secondes. Tous
+les scores décroissent au même rythme : chaque poids est stocké multiplié par
+2^((t - origine) / half_life) et les scores ne sont jamais réécrits, l'ordre reste valable.
+L'origine est ramenée à l'instant présent à chaque reconstruction, ce qui borne l'exposant.
+
+Les événements validés dans ce processus mettent à jour les scores en O(1). Le classement
+trié est recalculé au plus toutes les `refresh_interval` secondes ; entre deux, top() ne fait
+que découper une liste. Les événements des autres workers arrivent à la reconstruction depuis
+la base (toutes les `rebuild_interval` secondes, dans un thread : le lecteur qui la déclenche
+reçoit l'ancien classement), qui corrige aussi les approximations : seuls les `capacity`
+meilleurs candidats restent en mémoire, un retrait de like compte au poids actuel.
+"""
+import heapq
+import threading
+import time
+
+
+class TrendingRanking:
+    """`load(since)` renvoie des (post_id, poids, horodatage epoch) pour les événements depuis `since`.
+
+    `load` peut être appelée hors de toute requête, depuis le thread de reconstruction.
+    """
+
+    def __init__(self, load, half_life=6 * 3600, window=3 * 24 * 3600, size=50, capacity=5000,
+                 refresh_interval=5, rebuild_interval=300):
+        self.load = load
+        self.half_life = half_life
+        self.window = window
+        self.size = size
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._origin = time.time()
+        self._scores = {}    # post_id -> score ramené à l'origine
+        self._top = []       # [(post_id, score ramené à l'origine)], du plus haut au plus bas
+        self._dirty = False
+        self._refreshed_at = self._built_at = None  # time.monotonic()
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self.refreshes = self.rebuilds = 0
+
+    @classmethod
+    def from_config(cls, config, load):
+        return cls(
+            load,
+            half_life=config['TRENDING_HALF_LIFE'],
+            window=config['TRENDING_WINDOW'],
+            size=config['TRENDING_SIZE'],
+            capacity=config['TRENDING_CAPACITY'],
+            refresh_interval=config['TRENDING_REFRESH_INTERVAL'],
+            rebuild_interval=config['TRENDING_REBUILD_INTERVAL'],
+        )
+
+    def _scaled(self, weight, at, origin):
+        return weight * 2 ** ((at - origin) / self.half_life)
+
+    def apply(self, events, at=None):
+        """Ajoute des événements validés : (post_id, poids) ; un poids None retire le post du classement."""
+        at = time.time() if at is None else at
+        with self._lock:
+            for post_id, weight in events:
+                if weight is None:
+                    self._scores.pop(post_id, None)
+                else:
+                    score = self._scores.get(post_id, 0.0) + self._scaled(weight, at, self._origin)
+                    if score > 0:
+                        self._scores[post_id] = score
+                    else:
+                        self._scores.pop(post_id, None)
+            if len(self._scores) > 2 * self.capacity:
+                # Réduction amortie : une fois toutes les `capacity` nouvelles entrées au plus
+                self._scores = dict(heapq.nlargest(self.capacity, self._scores.items(), key=lambda item: item[1]))
+            self._dirty = True
+
+    def discard(self, post_ids):
+        self.apply([(post_id, None) for post_id in post_ids])
+
+    def top(self, limit=None):
+        """Les posts les mieux classés : [(post_id, score actuel)], au plus `limit` (sinon `size`)."""
+        now = time.monotonic()
+        if self._built_at is None:
+            self.rebuild()
+        elif now - self._built_at >= self.rebuild_interval and not self._rebuild_lock.locked():
+            threading.Thread(target=self.rebuild, name='trending-rebuild', daemon=True).start()
+        if self._dirty and now - self._refreshed_at >= self.refresh_interval:
+            with self._lock:
+                self._refresh()
+        top, origin = self._top, self._origin
+        decay = 2 ** ((origin - time.time()) / self.half_life)
+        return [(post_id, score * decay) for post_id, score in top[:limit or self.size]]
+
+    def _refresh(self):
+        # Appelée avec le verrou
+        self._top = heapq.nlargest(self.size, self._scores.items(), key=lambda item: item[1])
+        self._dirty = False
+        self._refreshed_at = time.monotonic()
+        self.refreshes += 1
+
+    def rebuild(self):
+        """Recalcule tous les scores depuis la base ; un seul thread à la fois, les autres gardent l'ancien classement."""
+        first = self._built_at is None
+        if not self._rebuild_lock.acquire(blocking=first):
+            return
+        try:
+            if self._built_at is not None and time.monotonic() - self._built_at < self.rebuild_interval:
+                return  # reconstruit par un autre thread pendant l'attente
+            origin = time.time()
+            scores = {}
+            for post_id, weight, at in self.load(origin - self.window):
+                scores[post_id] = scores.get(post_id, 0.0) + self._scaled(weight, at, origin)
+            scores = {post_id: score for post_id, score in scores.items() if score > 0}
+            if len(scores) > self.capacity:
+                scores = dict(heapq.nlargest(self.capacity, scores.items(), key=lambda item: item[1]))
+            with self._lock:
+                # Les événements appliqués pendant la lecture sont perdus jusqu'à la prochaine reconstruction
+                self._origin, self._scores = origin, scores
+                self._refresh()
+                self._built_at = time.monotonic()
+            self.rebuilds += 1
+        finally:
+            self._rebuild_lock.release()
+
+    def clear(self):
+        """Oublie tous les scores : le prochain top() relit la base."""
+        with self._lock:
+            self._scores, self._top = {}, []
+            self._dirty = False
+            self._built_at = None
+
+    def stats(self):
+        return {'posts': len(self._scores), 'refreshes': self.refreshes, 'rebuilds': self.rebuilds}
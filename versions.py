@@ -0,0 +1,59 @@
+"""Numéros de version des contenus, stockés dans un fichier SQLite partagé par tous les workers.
+
+Une version change à chaque écriture sur ce qu'elle couvre (abonnements d'un utilisateur,
+pages de son profil ou de son fil) ; les caches de chaque processus la comparent à celle de
+leurs entrées. Contrairement au cache de pages, rien n'y expire ni n'est évincé : une version
+perdue puis recréée ferait passer une entrée périmée pour valide.
+
+Une clé jamais changée est en version 0 : la lire n'écrit rien. Le premier changement part
+de l'horodatage courant, pour qu'un fichier recréé ne redonne pas une version déjà vue.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+
+class VersionStore:
+    """Versions entières par clé : get() et get_many() en une lecture, bump() en une écriture."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.reads = self.bumps = 0
+
+    def _connection(self):
+        # Ouverte au premier usage, une par thread, en mode WAL comme le cache de pages partagé
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS version (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        self.reads += 1
+        row = self._connection().execute('SELECT value FROM version WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def get_many(self, *keys):
+        """Versions de plusieurs clés, dans l'ordre donné, en une seule lecture."""
+        self.reads += 1
+        rows = dict(self._connection().execute(
+            f'SELECT key, value FROM version WHERE key IN ({", ".join("?" for _ in keys)})', keys))
+        return tuple(rows.get(key, 0) for key in keys)
+
+    def bump(self, key):
+        """Change la version de `key` ; renvoie la nouvelle."""
+        self.bumps += 1
+        return self._connection().execute(
+            'INSERT INTO version (key, value) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value',
+            (key, time.time_ns()),
+        ).fetchall()[0][0]  # fetchall : l'instruction se termine, le verrou d'écriture est rendu
+
+    def stats(self):
+        return {'reads': self.reads, 'bumps': self.bumps}
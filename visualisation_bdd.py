@@ -1,38 +1,29 @@
-from app import app, db, User, Post, Like,Comment,CommentLike
-import os
+"""Aperçu de la base, en lecture seule : nombre de lignes par table et premières lignes.
 
-if os.path.exists("users.db"):
-    os.remove("users.db")
+Usage : python visualisation_bdd.py [nb_lignes]
 
-with app.app_context():
-    db.create_all()
-    print("Base de données recréée ✅")
+Les lignes sont lues par lots (dump.iter_rows) : la mémoire reste constante quelle que soit
+la taille de la base. Pour vider ou recréer la base, supprimer instance/users.db à la main.
+"""
+import sqlite3
+import sys
+from itertools import islice
 
-# On exécute les actions à l'intérieur du contexte de l'app Flask
-with app.app_context():
-    User.query.delete()
-    Post.query.delete()
-    Like.query.delete()
-    Comment.query.delete()
-    CommentLike.query.delete()
-    db.session.commit()
-    print("Base de données vidée ✅")
+from app import app, db
+from dump import TABLES, iter_rows
 
-with app.app_context():
-    db.create_all()
-    
-with app.app_context():
-    users = User.query.all()
-    posts = Post.query.all()
-    comm=Comment.query.all()
-    print("=== UTILISATEURS ===")
-    for u in users:
-        print(f"{u.id} | {u.username} | {u.email}| {u.password}")
+nb_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20
 
-    print("=== Commentaires ===")
-    for u in comm:
-        print(f"{u.id} | {u.author.username} | {u.post.id}| {u.content}| {u.date_posted} | {u.likes}")
+with app.app_context():
+    db_path = db.engine.url.database
 
-    print("\n=== POSTS ===")
-    for p in posts:
-        print(f"{p.id} | {p.author.username} | {p.content} | {p.date_posted}")
+conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+cursor = conn.cursor()
+for table in TABLES:
+    total = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    columns, rows = iter_rows(cursor, table, chunk_size=nb_rows or 1)
+    print(f'\n=== {table.upper()} ({total} lignes) ===')
+    print(' | '.join(column for column in columns if column != 'password'))
+    for row in islice(rows, nb_rows):
+        print(' | '.join(str(value) for column, value in zip(columns, row) if column != 'password'))
+conn.close()